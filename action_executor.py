@@ -0,0 +1,298 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import *
+from instrumentation import timer, timed, count
+
+# Side effects of a moderation decision (quarantine move, verified tag, alert
+# email) used to run one blocking call after another on the request path.
+# ActionExecutor runs them for a whole batch of objects at once.
+
+_RETRYABLE_CODES = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'TooManyRequestsException',
+    'RequestTimeout', 'RequestTimeTooSkewed', 'InternalError', 'ServiceUnavailable'
+}
+# The source object is already gone (moved by an earlier delivery of the same
+# event) or was overwritten by a newer upload since the event was sent
+_STALE_CODES = {'404', 'NoSuchKey', 'NotFound', '412', 'PreconditionFailed'}
+
+
+def _error_code(error) -> str:
+    return getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+
+
+def is_stale(error) -> bool:
+    """The object was already moved, deleted or replaced since its event was sent"""
+    return _error_code(error) in _STALE_CODES
+
+
+def is_retryable(error) -> bool:
+    """Throttling, 5xx and connection errors are worth retrying; other 4xx are not"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        from botocore.exceptions import BotoCoreError
+        # Connection resets and timeouts come without an HTTP response
+        return isinstance(error, BotoCoreError)
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return _error_code(error) in _RETRYABLE_CODES or status >= 500
+
+
+def with_retries(fn, *args, attempts: int = ACTION_MAX_ATTEMPTS,
+                 base_delay: float = ACTION_RETRY_BASE_DELAY, **kwargs):
+    """Call fn, retrying retryable errors with full-jitter exponential backoff"""
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+
+
+class AlertDigest:
+    """
+    Collect forbidden-content alerts and send them as one SES email per
+    interval (or per max_items alerts) instead of one email per object
+    """
+
+    def __init__(self, client_fn, interval: float = ALERT_DIGEST_INTERVAL,
+                 max_items: int = ALERT_DIGEST_MAX_ITEMS, enabled: bool = ALERT_EMAILS_ENABLED):
+        self._client_fn = client_fn
+        self.interval = interval
+        self.max_items = max_items
+        self.enabled = enabled
+        self.last_sent = time.time()
+        self.sent = 0
+        self._alerts = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def add(self, bucket_name: str, object_key: str, detections: list):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._alerts.append((datetime.now(), bucket_name, object_key, detections))
+            self._arm_timer()
+
+    def _arm_timer(self):
+        # Make sure a quiet period doesn't hold alerts back indefinitely
+        if self.interval > 0 and self._timer is None:
+            self._timer = threading.Timer(self.interval, self.flush, kwargs={'force': True})
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, force: bool = False) -> int:
+        """Send pending alerts if the digest is due; returns how many were sent"""
+        with self._lock:
+            due = force or len(self._alerts) >= self.max_items or time.time() - self.last_sent >= self.interval
+            if not self._alerts or not due:
+                return 0
+            alerts, self._alerts = self._alerts, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        try:
+            self._send(alerts)
+        except Exception as e:
+            print(f"Error sending alert digest: {e}")
+            with self._lock:
+                # Keep them for the next digest, which may have to come from the timer
+                self._alerts[:0] = alerts
+                self._arm_timer()
+            return 0
+        self.last_sent = time.time()
+        self.sent += len(alerts)
+        return len(alerts)
+
+    @timed('alert_email')
+    def _send(self, alerts: list):
+        """Send alert email via SES"""
+        sections = []
+        for timestamp, bucket_name, object_key, detections in alerts:
+            detection_summary = "\n".join([
+                f"  - {d['class']} (confidence: {d['confidence']:.2f})"
+                for d in detections
+            ])
+            sections.append(
+                f"{timestamp.strftime('%Y-%m-%d %H:%M:%S')}  s3://{bucket_name}/{object_key}\n{detection_summary}"
+            )
+
+        subject = f"Content Moderation Alert - Forbidden Content Detected in {len(alerts)} file(s)"
+        body = (
+            "Forbidden content was detected in the following files, which have been "
+            "moved to the quarantine bucket:\n\n" + "\n\n".join(sections)
+        )
+
+        with_retries(
+            self._client_fn().send_email,
+            Source=SES_SENDER_EMAIL,
+            Destination={'ToAddresses': [SES_RECIPIENT_EMAIL]},
+            Message={
+                'Subject': {'Data': subject},
+                'Body': {'Text': {'Data': body}}
+            }
+        )
+
+
+class ActionExecutor:
+    """
+    Apply quarantine/verify decisions for many objects concurrently. Every
+    action is retried on transient errors and safe to repeat, so an event
+    redelivered after a partial failure never double-moves an object.
+    """
+
+    def __init__(self, client_fn, workers: int = ACTION_WORKERS):
+        self._client_fn = client_fn
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.digest = AlertDigest(lambda: client_fn('ses'))
+        # Recently applied (action, bucket, key, etag), to skip redeliveries
+        # to a warm container without any S3 calls
+        self._applied = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        return self._client_fn('s3')
+
+    def run(self, actions: list, dry_run: bool = False) -> list:
+        """
+        Apply (bucket, key, result, etag) decisions concurrently and return
+        one action dict per item, in order. dry_run reports the decisions
+        without touching S3.
+        """
+        with timer('actions'):
+            futures = [self._pool.submit(self.apply, *action, dry_run=dry_run) for action in actions]
+            outputs = [future.result() for future in futures]
+        for output in outputs:
+            count('moderation_objects_total', action=output['action'])
+        self.digest.flush()
+        return outputs
+
+    def apply(self, bucket_name: str, object_key: str, result: dict, etag: str = None,
+              dry_run: bool = False) -> dict:
+        """Quarantine or verify an object based on its detection result"""
+        if not result['success']:
+            return {
+                'action': 'error',
+                'error': result['error']
+            }
+
+        action = 'quarantined' if result['has_forbidden_content'] else 'verified'
+        output = {
+            'action': action,
+            'detections': result['detections']
+        }
+        if dry_run:
+            output['dry_run'] = True
+            return output
+        marker = (action, bucket_name, object_key, etag)
+        if etag and marker in self._applied:
+            output['already_applied'] = True
+            return output
+
+        try:
+            if action == 'quarantined':
+                applied = self.quarantine(bucket_name, object_key, etag)
+                if applied:
+                    self.digest.add(bucket_name, object_key, result['detections'])
+            else:
+                applied = self.verify(bucket_name, object_key, etag)
+        except Exception as e:
+            print(f"Error applying {action} to {object_key}: {e}")
+            return {
+                'action': 'error',
+                'error': str(e)
+            }
+
+        if not applied:
+            output['already_applied'] = True
+        if etag:
+            with self._lock:
+                self._applied[marker] = True
+                while len(self._applied) > ACTION_IDEMPOTENCY_ENTRIES:
+                    self._applied.popitem(last=False)
+        return output
+
+    def quarantine(self, source_bucket: str, object_key: str, etag: str = None) -> bool:
+        """
+        Move an object to the quarantine bucket. The destination key comes
+        from the object's LastModified time, so repeating a move overwrites
+        the same copy. Returns False when there was nothing left to move.
+        """
+        head = self._head(source_bucket, object_key, etag)
+        if head is None:
+            return False
+
+        destination = f"quarantined/{head['LastModified'].strftime('%Y%m%d_%H%M%S')}_{object_key}"
+        try:
+            # Only the version just checked; a newer upload has an event of its own
+            self._copy(source_bucket, object_key, destination, head['ContentLength'], head['ETag'])
+        except Exception as e:
+            if is_stale(e):
+                print(f"Skipping {object_key}: replaced while quarantining ({_error_code(e)})")
+                return False
+            raise
+        # Delete from source bucket
+        with_retries(self.s3_client.delete_object, Bucket=source_bucket, Key=object_key)
+        return True
+
+    def verify(self, bucket_name: str, object_key: str, etag: str = None) -> bool:
+        """
+        Add the verified tag. With an ETag the object is checked first, so a
+        stale event never marks a newer upload of the same key as verified.
+        """
+        if etag and self._head(bucket_name, object_key, etag) is None:
+            return False
+        with_retries(
+            self.s3_client.put_object_tagging,
+            Bucket=bucket_name,
+            Key=object_key,
+            Tagging={
+                'TagSet': [
+                    {
+                        'Key': 'ContentModeration',
+                        'Value': 'Verified'
+                    }
+                ]
+            }
+        )
+        return True
+
+    def _head(self, bucket_name: str, object_key: str, etag: str = None):
+        """head_object, or None when the object is gone or no longer matches etag"""
+        params = {'Bucket': bucket_name, 'Key': object_key}
+        if etag:
+            params['IfMatch'] = '"' + etag.strip('"') + '"'
+        try:
+            return with_retries(self.s3_client.head_object, **params)
+        except Exception as e:
+            if is_stale(e):
+                print(f"Skipping {object_key}: already moved or replaced ({_error_code(e)})")
+                return None
+            raise
+
+    def _copy(self, source_bucket: str, object_key: str, destination: str, size: int, etag: str = None):
+        source = {'Bucket': source_bucket, 'Key': object_key}
+        conditions = {'CopySourceIfMatch': etag} if etag else {}
+        if size < ACTION_MULTIPART_THRESHOLD:
+            with_retries(self.s3_client.copy_object, Bucket=S3_QUARANTINE_BUCKET, CopySource=source, Key=destination,
+                         **conditions)
+            return
+
+        # copy_object is limited to 5 GB; the managed copy splits the object
+        # into UploadPartCopy requests that run in parallel
+        from boto3.s3.transfer import TransferConfig
+        config = TransferConfig(
+            multipart_threshold=ACTION_MULTIPART_THRESHOLD,
+            multipart_chunksize=ACTION_MULTIPART_CHUNK_SIZE,
+            max_concurrency=ACTION_COPY_CONCURRENCY
+        )
+        with_retries(self.s3_client.copy, source, S3_QUARANTINE_BUCKET, destination, ExtraArgs=conditions,
+                     Config=config)
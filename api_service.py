@@ -1,9 +1,19 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
 import tempfile
 import os
-from content_moderator import ContentModerator
+import asyncio
+import json
+import tarfile
+import threading
+import zipfile
+from typing import List
+from model_registry import get_moderator, warm_up
+from inference_dispatcher import BoundedExecutor, MicroBatcher, Overloaded
+from instrumentation import registry, timer, count, profile_request
+from config import *
 import uvicorn
 
 app = FastAPI(title="Content Moderation API")
@@ -17,13 +27,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize content moderator
-moderator = ContentModerator()
+# Shared content moderator (same instance the Lambda handler would use)
+moderator = get_moderator()
+if WARMUP_ON_INIT:
+    warm_up()
+
+# Inference runs off the event loop. Concurrent /analyze-image requests are
+# micro-batched into single model calls; videos get their own bounded pool.
+image_batcher = MicroBatcher(moderator.detect_images)
+video_executor = BoundedExecutor(API_VIDEO_WORKERS, API_MAX_PENDING_VIDEOS)
+
+def _busy() -> HTTPException:
+    return HTTPException(status_code=429, detail="Server busy, retry later", headers={"Retry-After": "1"})
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """
+    Time every request, and run the sampling profiler on sampled requests
+    (or on X-Profile: 1 when PROFILE_ON_DEMAND is set). Streamed responses
+    are only covered until their first byte.
+    """
+    force = PROFILE_ON_DEMAND and request.headers.get('x-profile') == '1'
+    with profile_request(request.url.path.strip('/') or 'root', force) as profile, timer('request'):
+        response = await call_next(request)
+    # The route template, not the raw path, so unknown URLs don't add label values
+    route = request.scope.get('route')
+    count('http_requests_total', path=route.path if route else 'unmatched', status=response.status_code)
+    if profile.path:
+        response.headers['X-Profile-Path'] = profile.path
+    return response
 
 @app.get("/")
 async def root():
     return {"message": "Content Moderation API - Upload images or videos for analysis"}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: stage latency histograms and counters. They are per
+    process, so run one worker per scrape target.
+    """
+    return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.post("/analyze-image")
 async def analyze_image(file: UploadFile):
     """
@@ -37,8 +82,16 @@ async def analyze_image(file: UploadFile):
         # Read file content
         contents = await file.read()
         
-        # Process image
-        result = moderator.process_image(contents)
+        # Process image (batched with concurrent requests)
+        try:
+            detections = await image_batcher.submit(contents)
+        except Overloaded:
+            raise _busy()
+        
+        if isinstance(detections, Exception):
+            result = {'success': False, 'error': str(detections)}
+        else:
+            result = detections.to_result()
         
         if result['success']:
             return {
@@ -51,28 +104,39 @@ async def analyze_image(file: UploadFile):
         else:
             raise HTTPException(status_code=500, detail=result['error'])
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/analyze-video")
-async def analyze_video(file: UploadFile):
+async def analyze_video(file: UploadFile, request: Request, stream: bool = False):
     """
-    Analyze a video file for forbidden content
+    Analyze a video file for forbidden content. With ?stream=true, detection
+    results are streamed back as NDJSON, one line per analyzed segment,
+    while the video is still being processed.
     """
     try:
         # Validate file type
         if not file.content_type.startswith('video/'):
             raise HTTPException(status_code=400, detail="File must be a video")
         
+        # Reject obviously oversized uploads before touching the body
+        if int(request.headers.get('content-length') or 0) > API_MAX_VIDEO_BYTES + UPLOAD_CHUNK_SIZE:
+            raise _too_large()
+        
         # Save video to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-            contents = await file.read()
-            tmp_file.write(contents)
-            tmp_file_path = tmp_file.name
+        tmp_file_path = await _save_upload(file)
+        
+        if stream:
+            return _stream_video(tmp_file_path, file.filename)
         
         try:
             # Process video
-            result = moderator.process_video(tmp_file_path)
+            try:
+                result = await video_executor.run(moderator.process_video, tmp_file_path)
+            except Overloaded:
+                raise _busy()
             
             if result['success']:
                 return {
@@ -80,7 +144,9 @@ async def analyze_video(file: UploadFile):
                     "filename": file.filename,
                     "video_duration": result['video_duration'],
                     "total_frames_processed": result['total_frames_processed'],
+                    "frames_inferred": result['frames_inferred'],
                     "forbidden_frames": result['forbidden_frames'],
+                    "forbidden_segments": result['forbidden_segments'],
                     "has_forbidden_content": len(result['forbidden_frames']) > 0
                 }
             else:
@@ -91,9 +157,181 @@ async def analyze_video(file: UploadFile):
             if os.path.exists(tmp_file_path):
                 os.unlink(tmp_file_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Video exceeds {API_MAX_VIDEO_BYTES} bytes")
+
+async def _save_upload(file: UploadFile) -> str:
+    """
+    Copy an upload to a temporary file in UPLOAD_CHUNK_SIZE chunks instead of
+    reading it into memory, enforcing API_MAX_VIDEO_BYTES as it goes
+    """
+    suffix = os.path.splitext(file.filename or '')[1] or '.mp4'
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > API_MAX_VIDEO_BYTES:
+                    raise _too_large()
+                tmp_file.write(chunk)
+        except BaseException:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise
+    return tmp_file.name
+
+def _stream_video(tmp_file_path: str, filename: str) -> StreamingResponse:
+    """
+    Run iter_video_events on the video pool and stream each event as an
+    NDJSON line. The temporary file is removed once analysis finishes.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+    
+    def produce():
+        try:
+            for event in moderator.iter_video_events(tmp_file_path):
+                if cancelled.is_set():
+                    break
+                if event['event'] == 'segment':
+                    frame_results = [moderator.frame_result(*frame) for frame in event['frames']]
+                    event = {
+                        'event': 'segment',
+                        'start': event['start'],
+                        'end': event['end'],
+                        'frames_inferred': event['frames_inferred'],
+                        'has_forbidden_content': any(r['has_forbidden_content'] for r in frame_results),
+                        'frames': frame_results
+                    }
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(events.put_nowait, {'event': 'error', 'error': str(e)})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+    
+    try:
+        job = video_executor.start(produce)
+    except Overloaded:
+        os.unlink(tmp_file_path)
+        raise _busy()
+    job.add_done_callback(lambda _: os.path.exists(tmp_file_path) and os.unlink(tmp_file_path))
+    
+    async def lines():
+        forbidden = False
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                forbidden = forbidden or event.get('has_forbidden_content', False)
+                if event['event'] == 'complete':
+                    event = dict(event, filename=filename, has_forbidden_content=forbidden)
+                yield json.dumps(event) + "\n"
+        finally:
+            # Client went away (or we are done): stop analyzing
+            cancelled.set()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/analyze-images")
+async def analyze_images(files: List[UploadFile]):
+    """
+    Analyze many images, or zip/tar archives of images, in one request.
+    Results are streamed back as NDJSON, one line per image in completion
+    order, while the rest are still being processed.
+    """
+    for file in files:
+        if _archive_type(file) is None and not (file.content_type or '').startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"Not an image or archive: {file.filename}")
+    
+    return StreamingResponse(_stream_results(files), media_type="application/x-ndjson")
+
+def _archive_type(file: UploadFile):
+    """'zip', 'tar' or None, from the content type or file name"""
+    name = (file.filename or '').lower()
+    if file.content_type in ('application/zip', 'application/x-zip-compressed') or name.endswith('.zip'):
+        return 'zip'
+    if (file.content_type in ('application/x-tar', 'application/gzip', 'application/x-gzip')
+            or name.endswith(('.tar', '.tar.gz', '.tgz'))):
+        return 'tar'
+    return None
+
+def _iter_images(files: List[UploadFile]):
+    """
+    Yield (filename, bytes) one image at a time, extracting archive members
+    lazily so only the images in flight are held in memory
+    """
+    for file in files:
+        archive_type = _archive_type(file)
+        file.file.seek(0)
+        if archive_type is None:
+            yield file.filename, file.file.read()
+        elif archive_type == 'zip':
+            with zipfile.ZipFile(file.file) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and _is_image_member(member.filename, member.file_size):
+                        yield f"{file.filename}/{member.filename}", archive.read(member)
+        else:
+            with tarfile.open(fileobj=file.file, mode='r:*') as archive:
+                for member in archive:
+                    if member.isfile() and _is_image_member(member.name, member.size):
+                        yield f"{file.filename}/{member.name}", archive.extractfile(member).read()
+
+def _is_image_member(name: str, size: int) -> bool:
+    return size <= API_MAX_ARCHIVE_MEMBER_BYTES and any(name.lower().endswith(ext) for ext in IMAGE_EXTENSIONS)
+
+async def _stream_results(files: List[UploadFile]):
+    loop = asyncio.get_running_loop()
+    images = _iter_images(files)
+    in_flight = set()
+    index = 0
+    exhausted = False
+    
+    while in_flight or not exhausted:
+        # Keep a bounded window of images queued for batched inference
+        while not exhausted and len(in_flight) < API_STREAM_WINDOW:
+            # Archive extraction is blocking, keep it off the event loop
+            item = await loop.run_in_executor(None, next, images, None)
+            if item is None:
+                exhausted = True
+                break
+            in_flight.add(asyncio.ensure_future(_analyze_one(index, *item)))
+            index += 1
+        
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield json.dumps(task.result()) + "\n"
+
+async def _analyze_one(index: int, filename: str, contents: bytes) -> dict:
+    while True:
+        try:
+            detections = await image_batcher.submit(contents)
+            break
+        except Overloaded:
+            # Other requests filled the queue; wait for room instead of failing
+            await asyncio.sleep(0.05)
+    
+    if isinstance(detections, Exception):
+        return {"success": False, "index": index, "filename": filename, "error": str(detections)}
+    result = detections.to_result()
+    return {
+        "success": True,
+        "index": index,
+        "filename": filename,
+        "has_forbidden_content": result['has_forbidden_content'],
+        "detections": result['detections'],
+        "total_detections": result['total_detections']
+    }
+
 # Handler for AWS Lambda
 handler = Mangum(app) 
 
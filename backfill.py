@@ -0,0 +1,270 @@
+"""
+Backfill: moderate objects that are already in a bucket, e.g. uploads from
+before the S3 trigger was installed, or everything again after
+FORBIDDEN_CLASSES or the moderation policy changed. Every object gets fresh
+inference: the result cache is keyed by config and policy, and backfill
+neither uses nor writes the near-duplicate index (whose saved file the
+workers would otherwise all load and overwrite concurrently).
+
+Keys are listed with list_objects_v2 in the main process and sent in batches
+to a process pool. Each worker loads its own model once and runs
+ContentModerator.handle_s3_images, which downloads a batch on a thread pool
+and runs one batched inference for it. Progress is checkpointed to a JSON file
+so an interrupted run resumes where it stopped. Actions are idempotent, so
+redoing the few batches after the checkpoint is harmless.
+
+Usage:
+    python backfill.py --bucket my-uploads --prefix 2024/ --workers 4 --checkpoint backfill.json
+    python backfill.py --checkpoint backfill.json   # resume
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from config import *
+from video_sampler import batched
+
+
+def list_objects(s3_client, bucket_name: str, prefix: str = '', start_after: str = '',
+                 videos: bool = False, page_size: int = 1000):
+    """
+    Yield (key, etag, size) of every image (and video with videos=True)
+    under prefix, in key order, starting after start_after
+    """
+    extensions = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS if videos else IMAGE_EXTENSIONS
+    params = {'Bucket': bucket_name, 'Prefix': prefix, 'PaginationConfig': {'PageSize': page_size}}
+    if start_after:
+        params['StartAfter'] = start_after
+    for page in s3_client.get_paginator('list_objects_v2').paginate(**params):
+        for obj in page.get('Contents', []):
+            if os.path.splitext(obj['Key'])[1].lower() in extensions:
+                yield obj['Key'], obj['ETag'].strip('"'), obj['Size']
+
+
+def worker_thread_plan(workers: int, cpus: int = None) -> dict:
+    """
+    Each worker's share of the cores. thread_plan() alone would give every
+    worker process all of them, oversubscribing the machine workers times over.
+    """
+    from inference_profiles import available_cpus, thread_plan
+    cpus = cpus or available_cpus()
+    return thread_plan(cpus=max(1, cpus // max(1, workers)))
+
+
+def _init_worker(plan: dict = None):
+    # Size the thread pools before the model exists, then load one model per
+    # worker process before the first batch arrives
+    import model_registry
+    from inference_profiles import apply_thread_plan
+    apply_thread_plan(plan)
+    model_registry.warm_up()
+
+
+def moderate_batch(bucket_name: str, objects: list, dry_run: bool = False) -> list:
+    """Worker: moderate a batch of (key, etag) and return (key, action dict) pairs"""
+    import model_registry
+    moderator = model_registry.get_moderator()
+    is_image = [os.path.splitext(key)[1].lower() in IMAGE_EXTENSIONS for key, _ in objects]
+    images = [obj for obj, image in zip(objects, is_image) if image]
+    videos = [obj for obj, image in zip(objects, is_image) if not image]
+
+    outputs = []
+    if images:
+        results = moderator.handle_s3_images(
+            [(bucket_name, key, etag) for key, etag in images], dry_run=dry_run, near_duplicates=False
+        )
+        outputs.extend(zip([key for key, _ in images], results))
+    for key, etag in videos:
+        outputs.append((key, moderator.handle_s3_video(bucket_name, key, etag, dry_run=dry_run)))
+    return outputs
+
+
+class Checkpoint:
+    """
+    Progress of a backfill run, saved as JSON. Batches finish out of order,
+    so the resume point (start_after) only moves past a batch once every
+    batch before it has finished too.
+    """
+
+    def __init__(self, path: str, bucket_name: str, prefix: str, start_after: str = ''):
+        self.path = path
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.start_after = start_after
+        self.processed = 0
+        self.bytes = 0
+        self.counts = {}
+        self._in_flight = []
+        self._finished = set()
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            state = json.load(f)
+        checkpoint = cls(path, state['bucket'], state['prefix'], state['start_after'])
+        checkpoint.processed = state['processed']
+        checkpoint.bytes = state['bytes']
+        checkpoint.counts = state['counts']
+        return checkpoint
+
+    def started(self, last_key: str):
+        self._in_flight.append(last_key)
+
+    def finished(self, last_key: str, outputs: list, size: int):
+        self.processed += len(outputs)
+        self.bytes += size
+        for _, output in outputs:
+            self.counts[output['action']] = self.counts.get(output['action'], 0) + 1
+
+        self._finished.add(last_key)
+        while self._in_flight and self._in_flight[0] in self._finished:
+            self._finished.discard(self._in_flight[0])
+            self.start_after = self._in_flight.pop(0)
+
+    def save(self):
+        """Write the checkpoint atomically, so a crash never leaves a torn file"""
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'bucket': self.bucket_name,
+                'prefix': self.prefix,
+                'start_after': self.start_after,
+                'processed': self.processed,
+                'bytes': self.bytes,
+                'counts': self.counts,
+                'updated': time.time()
+            }, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class _InlineExecutor:
+    """Runs batches in this process (--workers 0), for debugging and tests"""
+
+    def __init__(self, initializer):
+        initializer()
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def run_backfill(checkpoint: Checkpoint, workers: int = os.cpu_count(), batch_size: int = INFERENCE_BATCH_SIZE,
+                 dry_run: bool = False, videos: bool = False, results_path: str = None,
+                 report_interval: float = 10.0) -> dict:
+    """Moderate every listed object, checkpointing and reporting throughput as it goes"""
+    import model_registry
+    s3_client = model_registry.get_client('s3')
+    objects = list_objects(s3_client, checkpoint.bucket_name, checkpoint.prefix, checkpoint.start_after, videos)
+
+    if workers > 0:
+        # spawn: workers start clean instead of inheriting boto3/thread state
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(worker_thread_plan(workers),))
+    else:
+        executor = _InlineExecutor(_init_worker)
+
+    results_file = open(results_path, 'a') if results_path else None
+    started = time.time()
+    last_report = started
+    processed_at_start = checkpoint.processed
+    bytes_at_start = checkpoint.bytes
+    in_flight = {}
+
+    def report(final: bool = False):
+        elapsed = max(time.time() - started, 1e-9)
+        processed = checkpoint.processed - processed_at_start
+        print(f"{'Done' if final else 'Progress'}: {checkpoint.processed} objects "
+              f"({processed / elapsed:.1f} objects/s, "
+              f"{(checkpoint.bytes - bytes_at_start) / elapsed / 1e6:.1f} MB/s) {checkpoint.counts}, "
+              f"resume after {checkpoint.start_after!r}")
+
+    def collect(futures):
+        nonlocal last_report
+        for future in futures:
+            batch = in_flight.pop(future)
+            # A crashed worker raises here; the checkpoint is saved on the
+            # way out without moving past this batch, so it is retried on resume
+            outputs = future.result()
+            checkpoint.finished(batch[-1][0], outputs, sum(size for _, _, size in batch))
+            if results_file:
+                for key, output in outputs:
+                    results_file.write(json.dumps({
+                        'key': key, 'action': output['action'], 'error': output.get('error')
+                    }) + "\n")
+        checkpoint.save()
+        if time.time() - last_report >= report_interval:
+            last_report = time.time()
+            report()
+
+    try:
+        with executor:
+            for batch in batched(objects, batch_size):
+                # Bound the work queued ahead of the workers
+                while len(in_flight) >= max(workers, 1) * 2:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                future = executor.submit(
+                    moderate_batch, checkpoint.bucket_name, [(key, etag) for key, etag, _ in batch], dry_run
+                )
+                in_flight[future] = batch
+                checkpoint.started(batch[-1][0])
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+    finally:
+        checkpoint.save()
+        if results_file:
+            results_file.close()
+
+    report(final=True)
+    elapsed = time.time() - started
+    return {
+        'processed': checkpoint.processed,
+        'counts': checkpoint.counts,
+        'elapsed_s': elapsed,
+        'objects_per_s': (checkpoint.processed - processed_at_start) / elapsed if elapsed else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moderate objects already stored in an S3 bucket")
+    parser.add_argument('--bucket', default=S3_INPUT_BUCKET)
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--start-after', default='', help="Only process keys after this one")
+    parser.add_argument('--checkpoint', help="Progress file; an existing one is resumed")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Inference processes (0 = run in this process)")
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE, help="Objects per worker task")
+    parser.add_argument('--videos', action='store_true', help="Also moderate videos")
+    parser.add_argument('--dry-run', action='store_true', help="Report decisions without moving or tagging")
+    parser.add_argument('--results', help="Append one JSON line per object to this file")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    if args.checkpoint and os.path.exists(args.checkpoint) and not args.restart:
+        checkpoint = Checkpoint.load(args.checkpoint)
+        print(f"Resuming s3://{checkpoint.bucket_name}/{checkpoint.prefix} after {checkpoint.start_after!r} "
+              f"({checkpoint.processed} objects already processed)")
+    else:
+        checkpoint = Checkpoint(args.checkpoint, args.bucket, args.prefix, args.start_after)
+
+    summary = run_backfill(checkpoint, args.workers, args.batch_size, args.dry_run, args.videos,
+                           args.results, args.report_interval)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Offline throughput/latency benchmark for the moderation pipeline.
+
+Everything is generated or mocked locally, so a run needs no network or AWS
+account: synthetic JPEGs at several resolutions, synthetic MP4s at several
+frame rates and durations, moto-backed S3, and the FastAPI app driven
+in-process through its test client. Each case runs in a fresh interpreter
+(like bench_startup.py) and reports:
+
+  - cold_start_s: imports, model load and the first (untimed) call
+  - items_per_s: images or video frames analyzed per second of wall time
+  - p50_ms / p99_ms / mean_ms: latency of one call (an image or a batch,
+    a video, a request)
+  - peak_rss_mb: peak resident memory of the case's process
+
+Cases: process_image, handle_s3_image, api_image (per resolution, batch
+size and thread count) and process_video, api_video (per fps x duration).
+Result caching and the near-duplicate index are disabled so every call
+runs inference.
+
+Offline model weights: pass --model (e.g. an exported .onnx with --backend
+onnx, or yolov8n.yaml for randomly initialised ultralytics weights).
+
+Usage:
+    python bench_pipeline.py --backend onnx --model yolov8n.onnx --output bench.json
+    python bench_pipeline.py --cases process_image --resolutions 1920x1080 --batch-sizes 1,8 \\
+        --threads 1,4 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+CASES = ('process_image', 'handle_s3_image', 'api_image', 'process_video', 'api_video')
+# Metrics compared against a baseline, and whether higher is better
+COMPARED_METRICS = {'items_per_s': True, 'p99_ms': False, 'peak_rss_mb': False}
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    A reproducible JPEG with a gradient background, shapes and noise, so it
+    decodes and compresses like a photo rather than a flat test card
+    """
+    import cv2
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                      np.full((height, width), 128, np.float32)], axis=-1)
+    image = (image + rng.normal(0, 12, image.shape)).clip(0, 255).astype(np.uint8)
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.circle(image, center, int(rng.integers(8, max(9, min(width, height) // 6))), color, -1)
+        else:
+            size = (int(rng.integers(8, max(9, width // 5))), int(rng.integers(8, max(9, height // 5))))
+            cv2.rectangle(image, center, (center[0] + size[0], center[1] + size[1]), color, -1)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def synthetic_video(path: str, fps: float, duration: float, width: int = 1280, height: int = 720,
+                    seed: int = 0) -> str:
+    """Write a reproducible MP4 of shapes moving over a noisy background"""
+    import cv2
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for i in range(int(fps * duration)):
+            frame = background.copy()
+            # Scene cuts every 2 seconds, so scene-change skipping sees real changes
+            shift = int(i // (2 * fps))
+            cv2.rectangle(frame, ((i * 7) % width, 100 + 40 * (shift % 5)),
+                          ((i * 7) % width + 160, 260 + 40 * (shift % 5)), (40, 200, 90), -1)
+            cv2.circle(frame, (width // 2, (i * 5) % height), 60 + 10 * (shift % 4), (220, 60, 60), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def summarize(latencies: list, items: int, wall_s: float) -> dict:
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        'calls': len(latencies),
+        'items': items,
+        'wall_s': wall_s,
+        'items_per_s': items / wall_s if wall_s else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None,
+        'mean_ms': float(latencies_ms.mean()) if len(latencies) else None
+    }
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _timed_calls(fn, calls: list, threads: int) -> tuple:
+    """Run fn over calls from threads concurrent callers; (latencies, wall_s)"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(args):
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(timed, calls))
+    return latencies, time.perf_counter() - start
+
+
+def _check(result: dict) -> dict:
+    if not result.get('success', result.get('action') not in (None, 'error')):
+        raise RuntimeError(f"Benchmark call failed: {result}")
+    return result
+
+
+def run_case(spec: dict) -> dict:
+    """Worker: run one benchmark case in this (fresh) process"""
+    # Holds the synthetic video, removed however the case ends
+    with tempfile.TemporaryDirectory(prefix='bench_') as tmp_dir:
+        return _run_case(spec, tmp_dir)
+
+
+def _run_case(spec: dict, tmp_dir: str) -> dict:
+    started = time.perf_counter()
+    import model_registry
+    moderator = model_registry.get_moderator()
+    case = spec['case']
+    batch_size = spec.get('batch_size', 1)
+    iterations = spec['iterations']
+
+    if case in ('process_image', 'handle_s3_image', 'api_image'):
+        width, height = spec['resolution']
+        # A few distinct images, reused round-robin
+        images = [synthetic_image(width, height, seed) for seed in range(4)]
+        batches = [[images[(i * batch_size + j) % len(images)] for j in range(batch_size)]
+                   for i in range(iterations + 1)]
+    else:
+        video_path = synthetic_video(os.path.join(tmp_dir, 'video.mp4'), spec['fps'], spec['duration'],
+                                     *spec['resolution'])
+
+    if case == 'process_image':
+        def call(batch):
+            if len(batch) == 1:
+                _check(moderator.process_image(batch[0]))
+            else:
+                for result in moderator.process_images(batch, batch_size):
+                    _check(result)
+        calls = [(batch,) for batch in batches]
+        items_per_call = [batch_size] * len(calls)
+
+    elif case == 'handle_s3_image':
+        from moto import mock_aws
+        from config import S3_QUARANTINE_BUCKET
+        mock = mock_aws()
+        mock.start()
+        s3_client = model_registry.get_client('s3')
+        s3_client.create_bucket(Bucket='bench-uploads')
+        s3_client.create_bucket(Bucket=S3_QUARANTINE_BUCKET)
+        # Distinct keys, since quarantined objects are moved away
+        calls = []
+        for i, batch in enumerate(batches):
+            objects = []
+            for j, image in enumerate(batch):
+                key = f"bench/{i:05d}_{j:03d}.jpg"
+                etag = s3_client.put_object(Bucket='bench-uploads', Key=key, Body=image)['ETag'].strip('"')
+                objects.append(('bench-uploads', key, etag))
+            calls.append((objects,))
+
+        def call(objects):
+            for result in moderator.handle_s3_images(objects):
+                _check(result)
+        items_per_call = [batch_size] * len(calls)
+
+    elif case == 'api_image':
+        from fastapi.testclient import TestClient
+        import api_service
+        client = TestClient(api_service.app).__enter__()
+
+        def call(batch):
+            response = client.post('/analyze-image', files={'file': ('bench.jpg', batch[0], 'image/jpeg')})
+            if response.status_code != 200:
+                raise RuntimeError(f"Benchmark request failed: {response.status_code} {response.text}")
+        calls = [(batch,) for batch in batches]
+        items_per_call = [1] * len(calls)
+
+    elif case == 'process_video':
+        frames = []
+
+        def call():
+            frames.append(_check(moderator.process_video(video_path))['total_frames_processed'])
+        calls = [()] * (iterations + 1)
+        items_per_call = None
+
+    elif case == 'api_video':
+        from fastapi.testclient import TestClient
+        import api_service
+        client = TestClient(api_service.app).__enter__()
+        with open(video_path, 'rb') as f:
+            video = f.read()
+        frames = []
+
+        def call():
+            response = client.post('/analyze-video', files={'file': ('bench.mp4', video, 'video/mp4')})
+            if response.status_code != 200:
+                raise RuntimeError(f"Benchmark request failed: {response.status_code} {response.text}")
+            frames.append(response.json()['total_frames_processed'])
+        calls = [()] * (iterations + 1)
+        items_per_call = None
+
+    else:
+        raise ValueError(f"Unknown benchmark case: {case}")
+
+    # The first call pays for model load and lazy setup: it ends the cold start
+    call(*calls[0])
+    cold_start_s = time.perf_counter() - started
+    # For S3 batches, threads sets the download pool; batches run one at a time as in Lambda
+    callers = 1 if case == 'handle_s3_image' else spec.get('threads', 1)
+    latencies, wall_s = _timed_calls(call, calls[1:], callers)
+    items = sum(items_per_call[1:]) if items_per_call else sum(frames[1:])
+
+    result = dict(spec, cold_start_s=cold_start_s, **summarize(latencies, items, wall_s))
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _case_env(args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'WARMUP_ON_INIT': 'false',
+        'RESULT_CACHE_BACKEND': 'none',
+        'PHASH_INDEX_ENABLED': 'false',
+        'VIDEO_STOP_AFTER_HITS': '0',
+        'PROFILE_SAMPLE_RATE': '0',
+        # moto only; nothing leaves the machine
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'S3_QUARANTINE_BUCKET': 'bench-quarantine'
+    })
+    if args.backend:
+        env['INFERENCE_BACKEND'] = args.backend
+    if args.model:
+        env['ONNX_MODEL_PATH' if args.backend == 'onnx' else 'MODEL_PATH'] = args.model
+    return env
+
+
+def build_cases(args) -> list:
+    specs = []
+    for case in args.cases:
+        if case in ('process_video', 'api_video'):
+            for fps, duration in args.videos:
+                specs.append({'case': case, 'fps': fps, 'duration': duration, 'resolution': args.video_resolution,
+                              'iterations': args.video_iterations})
+            continue
+        # The API takes one image per request; concurrency comes from threads
+        batch_sizes = [1] if case == 'api_image' else args.batch_sizes
+        for resolution in args.resolutions:
+            for batch_size in batch_sizes:
+                for threads in args.threads:
+                    specs.append({'case': case, 'resolution': resolution, 'batch_size': batch_size,
+                                  'threads': threads, 'iterations': args.iterations})
+    return specs
+
+
+def case_name(spec: dict) -> str:
+    if 'fps' in spec:
+        return f"{spec['case']} {spec['fps']:g}fps {spec['duration']:g}s"
+    width, height = spec['resolution']
+    return f"{spec['case']} {width}x{height} batch={spec['batch_size']} threads={spec['threads']}"
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare every case also present in baseline; returns one row per metric
+    with the relative change and whether it is a regression beyond tolerance
+    """
+    previous = {case['name']: case for case in baseline['cases']}
+    rows = []
+    for case in report['cases']:
+        if case['name'] not in previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous[case['name']].get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append({
+                'name': case['name'],
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'change': change,
+                'regression': -change > tolerance if higher_is_better else change > tolerance
+            })
+    return rows
+
+
+def _environment(args) -> dict:
+    import cv2
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'backend': args.backend,
+        'model': args.model,
+        'commit': commit
+    }
+
+
+def _size(text: str) -> list:
+    width, height = text.lower().split('x')
+    return [int(width), int(height)]
+
+
+def _video(text: str) -> tuple:
+    fps, duration = text.lower().split('x')
+    return float(fps), float(duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the moderation pipeline")
+    parser.add_argument('--cases', default=','.join(CASES), type=lambda s: s.split(','),
+                        help=f"Comma-separated subset of {', '.join(CASES)}")
+    parser.add_argument('--resolutions', default='640x480,1920x1080,3840x2160',
+                        type=lambda s: [_size(r) for r in s.split(',')])
+    parser.add_argument('--batch-sizes', default='1,8', type=lambda s: [int(b) for b in s.split(',')])
+    parser.add_argument('--threads', default='1,4', type=lambda s: [int(t) for t in s.split(',')],
+                        help="Concurrent callers (process_image/api_image) or S3 download workers")
+    parser.add_argument('--iterations', type=int, default=20, help="Timed calls per image case")
+    parser.add_argument('--videos', default='30x5,60x10', type=lambda s: [_video(v) for v in s.split(',')],
+                        help="Synthetic videos as <fps>x<seconds>")
+    parser.add_argument('--video-resolution', default='1280x720', type=_size)
+    parser.add_argument('--video-iterations', type=int, default=3, help="Timed calls per video case")
+    parser.add_argument('--backend', default=None, help="INFERENCE_BACKEND override")
+    parser.add_argument('--model', default=None, help="Local weights for the backend")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    parser.add_argument('--baseline', help="Earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="Relative change counted as a regression when comparing")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        spec = json.loads(args.worker)
+        if spec['case'] == 'handle_s3_image':
+            # Read by config at import time, so it has to be set before run_case imports it
+            os.environ['S3_DOWNLOAD_WORKERS'] = str(spec['threads'])
+        print(json.dumps(run_case(spec)))
+        return
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"Unknown cases: {', '.join(sorted(unknown))}")
+
+    report = {'environment': _environment(args), 'cases': []}
+    for spec in build_cases(args):
+        name = case_name(spec)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(spec)],
+                              capture_output=True, text=True, env=_case_env(args))
+        if proc.returncode != 0:
+            print(f"{name}: failed\n{proc.stderr[-2000:]}")
+            report['cases'].append(dict(spec, name=name, error=proc.stderr[-2000:]))
+            continue
+        result = dict(json.loads(proc.stdout.strip().splitlines()[-1]), name=name)
+        report['cases'].append(result)
+        print(f"{name}: {result['items_per_s']:.1f} items/s, p50 {result['p50_ms']:.1f} ms, "
+              f"p99 {result['p99_ms']:.1f} ms, cold start {result['cold_start_s']:.2f}s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        report['comparison'] = rows
+        for row in rows:
+            print(f"{row['name']} {row['metric']}: {row['baseline']:.1f} -> {row['current']:.1f} "
+                  f"({row['change']:+.1%}){'  REGRESSION' if row['regression'] else ''}")
+        regressions = [row for row in rows if row['regression']]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    failed = [case for case in report['cases'] if 'error' in case]
+    if regressions or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
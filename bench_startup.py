@@ -0,0 +1,127 @@
+"""
+Cold-start benchmark for the Lambda entry point.
+
+Every measurement runs in a fresh interpreter so it reflects what a new
+Lambda container pays:
+
+  1. an `-X importtime` breakdown of importing the entry module with
+     warm-up disabled (the cost of events that are skipped as non-images)
+  2. time-to-first-inference: imports, model load, first and second
+     inference on a synthetic image
+
+Usage:
+    python bench_startup.py --backend onnx --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FIRST_INFERENCE_SNIPPET = r'''
+import json, time
+t0 = time.perf_counter()
+import model_registry
+import numpy as np
+t1 = time.perf_counter()
+moderator = model_registry.get_moderator()
+moderator.model
+t2 = time.perf_counter()
+image = np.zeros((480, 640, 3), dtype=np.uint8)
+result = moderator.process_image(image)
+t3 = time.perf_counter()
+moderator.process_image(image)
+t4 = time.perf_counter()
+assert result['success'], result
+print(json.dumps({
+    'import_s': t1 - t0,
+    'model_load_s': t2 - t1,
+    'first_inference_s': t3 - t2,
+    'second_inference_s': t4 - t3,
+    'time_to_first_inference_s': t3 - t0
+}))
+'''
+
+
+def _env(backend: str) -> dict:
+    env = dict(os.environ)
+    env['WARMUP_ON_INIT'] = 'false'
+    if backend:
+        env['INFERENCE_BACKEND'] = backend
+    return env
+
+
+def profile_imports(module: str, backend: str, top: int) -> dict:
+    """Run `python -X importtime -c 'import module'` and summarize it"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=_env(backend), check=True
+    )
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append({
+            'module': name.strip(),
+            # Indentation in the name column shows import nesting depth
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us)
+        })
+
+    top_level = [e for e in entries if e['depth'] == 0]
+    return {
+        'module': module,
+        'total_import_s': sum(e['cumulative_us'] for e in top_level) / 1e6,
+        'modules_imported': len(entries),
+        'slowest': sorted(top_level, key=lambda e: e['cumulative_us'], reverse=True)[:top]
+    }
+
+
+def time_first_inference(backend: str, repeat: int) -> dict:
+    """Measure import, model load and first inference in fresh interpreters"""
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-c', FIRST_INFERENCE_SNIPPET],
+            capture_output=True, text=True, env=_env(backend), check=True
+        )
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in runs[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the moderation Lambda")
+    parser.add_argument('--module', default='lambda_function', help="Entry module to import")
+    parser.add_argument('--backend', default=None, help="INFERENCE_BACKEND override")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=15, help="Slowest imports to report")
+    parser.add_argument('--skip-inference', action='store_true', help="Only profile imports")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = {'imports': profile_imports(args.module, args.backend, args.top)}
+    print(f"Importing {args.module}: {report['imports']['total_import_s']:.3f}s "
+          f"({report['imports']['modules_imported']} modules)")
+    for entry in report['imports']['slowest']:
+        print(f"  {entry['cumulative_us'] / 1000:8.1f} ms  {entry['module']}")
+
+    if not args.skip_inference:
+        report['first_inference'] = time_first_inference(args.backend, args.repeat)
+        for key, value in report['first_inference'].items():
+            print(f"{key}: {value:.3f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
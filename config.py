@@ -9,12 +9,55 @@ S3_INPUT_BUCKET = os.getenv('S3_INPUT_BUCKET', 'YOUR_INPUT_BUCKET_NAME')
 S3_QUARANTINE_BUCKET = os.getenv('S3_QUARANTINE_BUCKET', 'YOUR_QUARANTINE_BUCKET_NAME')
 S3_OUTPUT_BUCKET = os.getenv('S3_OUTPUT_BUCKET', 'YOUR_OUTPUT_BUCKET_NAME')
 
+# Concurrent S3 downloads when a Lambda event carries several records
+S3_DOWNLOAD_WORKERS = int(os.getenv('S3_DOWNLOAD_WORKERS', '8'))
+
+# Quarantine/verify actions run concurrently after inference, retrying
+# throttling and 5xx errors with jittered exponential backoff
+ACTION_WORKERS = int(os.getenv('ACTION_WORKERS', '16'))
+ACTION_MAX_ATTEMPTS = 4
+ACTION_RETRY_BASE_DELAY = 0.2  # Seconds, doubled per attempt
+ACTION_IDEMPOTENCY_ENTRIES = 10000  # Recently applied actions remembered per process
+# Objects at least this large are moved to quarantine with a managed
+# multipart copy (copy_object is limited to 5 GB)
+ACTION_MULTIPART_THRESHOLD = int(os.getenv('ACTION_MULTIPART_THRESHOLD', str(256 * 1024 * 1024)))
+ACTION_MULTIPART_CHUNK_SIZE = 64 * 1024 * 1024
+ACTION_COPY_CONCURRENCY = 8
+
+S3_MAX_POOL_CONNECTIONS = max(10, S3_DOWNLOAD_WORKERS, ACTION_WORKERS)
+
 # SES Configuration
 SES_SENDER_EMAIL = os.getenv('SES_SENDER_EMAIL', 'YOUR_SENDER_EMAIL@domain.com')
 SES_RECIPIENT_EMAIL = os.getenv('SES_RECIPIENT_EMAIL', 'YOUR_RECIPIENT_EMAIL@domain.com')
+# Alerts are coalesced into one digest email per ALERT_DIGEST_INTERVAL seconds
+# or ALERT_DIGEST_MAX_ITEMS alerts (0 = one digest per batch of events).
+# Pending alerts are kept in memory, so keep the interval short in Lambda.
+ALERT_EMAILS_ENABLED = os.getenv('ALERT_EMAILS_ENABLED', 'false').lower() == 'true'
+ALERT_DIGEST_INTERVAL = float(os.getenv('ALERT_DIGEST_INTERVAL', '0'))
+ALERT_DIGEST_MAX_ITEMS = 50
 
 # Model Configuration - Using standard COCO model
-MODEL_PATH = './yolov8n.pt'  # Standard YOLOv8 nano model with COCO classes
+MODEL_PATH = os.getenv('MODEL_PATH', './yolov8n.pt')  # Standard YOLOv8 nano model with COCO classes
+
+# Inference backend: 'ultralytics' runs the PyTorch weights above, 'onnx' runs
+# the ONNX export (train.py) on ONNX Runtime's CPU kernels without importing torch
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'ultralytics')
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', './yolov8n.onnx')
+# CPU inference profile (onnx backend): 'fp32' runs ONNX_MODEL_PATH as exported,
+# 'int8-dynamic' and 'int8-static' run the quantized copies quantize_model.py
+# writes next to it (yolov8n.int8-static.onnx, ...)
+INFERENCE_PROFILE = os.getenv('INFERENCE_PROFILE', 'fp32')
+# Intra-op threads for ONNX Runtime/torch (0 = every core this process may
+# use: affinity mask and cgroup quota, i.e. the vCPUs of the Lambda memory
+# size). OpenCV (decoding, resizing) gets the cores inference leaves over, at
+# least 1, so the video decoder thread and inference don't oversubscribe.
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+OPENCV_THREADS = int(os.getenv('OPENCV_THREADS', '0'))
+INFERENCE_IMAGE_SIZE = 640
+# Candidate filtering and NMS for the ONNX backend (ultralytics defaults)
+NMS_CONFIDENCE_THRESHOLD = 0.25
+NMS_IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
 CLASS_NAMES = {
     0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus',
     6: 'train', 7: 'truck', 8: 'boat', 9: 'traffic light', 10: 'fire hydrant',
@@ -34,11 +77,171 @@ CLASS_NAMES = {
     77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'
 }
 
+# Bump when retraining/replacing the weights file in place so cached
+# results from the old model are not reused
+MODEL_VERSION = os.getenv('MODEL_VERSION', '1')
+
 # Detection thresholds
 CONFIDENCE_THRESHOLD = 0.5
 # For testing: consider knife (43) and scissors (76) as "forbidden" items
 FORBIDDEN_CLASSES = [43, 76]  # knife, scissors
+# Moderation policy file (JSON, local path or s3://bucket/key) with per-class
+# thresholds, minimum box areas, co-occurrence rules and per-bucket/prefix
+# overrides; see moderation_policy.py. Without one, FORBIDDEN_CLASSES at
+# CONFIDENCE_THRESHOLD is the policy. Changes are picked up without a
+# redeploy, checked at most every POLICY_RELOAD_INTERVAL seconds.
+POLICY_PATH = os.getenv('POLICY_PATH', '')
+POLICY_RELOAD_INTERVAL = float(os.getenv('POLICY_RELOAD_INTERVAL', '60'))
+
+# Decode large JPEGs at 1/2, 1/4 or 1/8 size (DCT scaling) when the result is
+# still at least INFERENCE_IMAGE_SIZE, since the model downsizes to that anyway
+DECODE_REDUCED_SIZE = os.getenv('DECODE_REDUCED_SIZE', 'false').lower() == 'true'
+
+# Number of images sent to the model per inference call in batch mode
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', '8'))
+
+# Tiled inference for small objects in large images: after the full-image
+# pass, images whose longer side is at least TILING_MIN_SIZE are also run as
+# overlapping TILING_TILE_SIZE tiles and the detections merged. Tiles grow
+# when more than TILING_MAX_TILES would be needed, which bounds latency.
+# Images already flagged by the full-image pass skip the tile pass, and video
+# frames are never tiled.
+TILING_ENABLED = os.getenv('TILING_ENABLED', 'false').lower() == 'true'
+TILING_TILE_SIZE = int(os.getenv('TILING_TILE_SIZE', str(INFERENCE_IMAGE_SIZE)))
+TILING_OVERLAP = float(os.getenv('TILING_OVERLAP', '0.2'))  # Fraction of the tile size
+TILING_MIN_SIZE = int(os.getenv('TILING_MIN_SIZE', str(2 * INFERENCE_IMAGE_SIZE)))
+TILING_MAX_TILES = int(os.getenv('TILING_MAX_TILES', '16'))
+TILING_MERGE_THRESHOLD = 0.5  # Intersection over the smaller box
+
+# Two-stage cascade: a cheap low-resolution pass that only scores the classes
+# the moderation policy watches decides whether the full detector (and tiling)
+# runs. Images with no watched-class score of at least CASCADE_THRESHOLD are
+# reported clean, with no detections. Stage 1 runs CASCADE_MODEL_PATH when
+# set (a smaller model on the same backend), otherwise the main model at
+# CASCADE_IMAGE_SIZE (ONNX needs a dynamic=True export for that).
+# Tune the threshold with evaluate_cascade.py.
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+CASCADE_IMAGE_SIZE = int(os.getenv('CASCADE_IMAGE_SIZE', '320'))
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '0.1'))
+CASCADE_MODEL_PATH = os.getenv('CASCADE_MODEL_PATH', '')
 
 # Video processing
 VIDEO_FRAME_RATE = 1  # Process 1 frame per second
-MAX_VIDEO_DURATION = 300  # Maximum 5 minutes 
\ No newline at end of file
+MAX_VIDEO_DURATION = 300  # Maximum 5 minutes
+# Frame sampling: 'grab' skips frames without retrieving them, 'seek' jumps
+# straight to each sampled frame, 'auto' seeks once the gap between sampled
+# frames is at least VIDEO_SEEK_MIN_INTERVAL frames
+VIDEO_SAMPLING_MODE = os.getenv('VIDEO_SAMPLING_MODE', 'auto')
+VIDEO_SEEK_MIN_INTERVAL = 90
+DEFAULT_VIDEO_FPS = 30  # Used when a container doesn't report its frame rate
+# Decoded frames buffered between the decoder thread and batched inference
+VIDEO_QUEUE_SIZE = 2 * INFERENCE_BATCH_SIZE
+# Early exit: stop analyzing after this many forbidden frames (0 = whole video).
+# 1 is enough for quarantine decisions that don't need the full timeline.
+VIDEO_STOP_AFTER_HITS = int(os.getenv('VIDEO_STOP_AFTER_HITS', '0'))
+# Scene-change skipping: a sampled frame only goes to the model when its 32x32
+# grayscale thumbnail differs from the last analyzed frame by more than
+# SCENE_CHANGE_THRESHOLD (0-1); otherwise the last result is carried forward.
+# 'diff' compares pixels, 'hist' compares histograms, 'off' analyzes every
+# sampled frame. At least one frame every SCENE_MAX_CARRY seconds is analyzed.
+SCENE_CHANGE_MODE = os.getenv('SCENE_CHANGE_MODE', 'diff')
+SCENE_CHANGE_THRESHOLD = float(os.getenv('SCENE_CHANGE_THRESHOLD', '0.03'))
+SCENE_MAX_CARRY = float(os.getenv('SCENE_MAX_CARRY', '10'))
+
+# S3 videos are read with ranged GETs instead of being downloaded: blocks of
+# S3_VIDEO_BLOCK_SIZE bytes, at most S3_VIDEO_MAX_BLOCKS kept in memory.
+# Older OpenCV builds without stream input read a presigned URL instead.
+S3_VIDEO_BLOCK_SIZE = int(os.getenv('S3_VIDEO_BLOCK_SIZE', str(1024 * 1024)))
+S3_VIDEO_MAX_BLOCKS = int(os.getenv('S3_VIDEO_MAX_BLOCKS', '8'))
+S3_VIDEO_URL_EXPIRY = 900
+S3_VIDEO_STOP_AFTER_HITS = int(os.getenv('S3_VIDEO_STOP_AFTER_HITS', '1'))
+
+# Model lifecycle
+# Run a dummy inference when the model is first loaded so the first real
+# request does not pay the graph/kernel setup cost.
+WARMUP_ON_INIT = os.getenv('WARMUP_ON_INIT', 'true').lower() == 'true'
+WARMUP_IMAGE_SIZE = INFERENCE_IMAGE_SIZE
+
+# File extensions moderated as images (S3 events and archive uploads)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
+# File extensions moderated as videos (S3 events)
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v'}
+
+# Pre-inference gate for S3 objects: one ranged GET of the first PROBE_BYTES
+# gives the real content type, the size and the image dimensions before
+# anything else is downloaded or decoded. Empty, non-media, oversized and
+# corrupt objects and decompression bombs are rejected (not retried), and
+# objects are routed by content rather than extension: still images,
+# animations (GIF/WebP/APNG, judged on ANIMATION_MAX_FRAMES sampled frames)
+# or the video path. MAX_IMAGE_PIXELS is also checked before every decode.
+# Cost: the Lambda handler used to skip uploads without an image/video
+# extension for free; with the gate on, each of them costs one ranged GET of
+# PROBE_BYTES (and a moderator in the container). Filter the S3 trigger by
+# suffix if the bucket also receives other files, or set PROBE_ENABLED=false
+# to route by extension only.
+PROBE_ENABLED = os.getenv('PROBE_ENABLED', 'true').lower() == 'true'
+PROBE_BYTES = int(os.getenv('PROBE_BYTES', str(64 * 1024)))
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(50 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', '50000000'))
+ANIMATION_MAX_FRAMES = int(os.getenv('ANIMATION_MAX_FRAMES', '8'))
+
+# Result cache keyed by content hash (S3 ETag or BLAKE2 of the bytes) plus
+# model/threshold config, so re-uploads of the same file skip inference.
+# 'memory' (in-process LRU), 'sqlite' (local file, survives while the
+# container is warm) or 'none'
+RESULT_CACHE_BACKEND = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '10000'))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(24 * 3600)))  # seconds
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', '/tmp/moderation_results.sqlite3')
+
+# Perceptual-hash index of previously moderated images, to catch resized or
+# recompressed reposts without inference. Distances are Hamming distances
+# between 64-bit hashes. Verdicts are keyed like result cache entries (model
+# and config plus moderation policy fingerprint), and a saved index made
+# under another model or config is discarded on load.
+PHASH_INDEX_ENABLED = os.getenv('PHASH_INDEX_ENABLED', 'true').lower() == 'true'
+PHASH_ALGORITHM = os.getenv('PHASH_ALGORITHM', 'phash')  # 'phash' or 'dhash'
+# Near-matches of quarantined images are quarantined without inference
+PHASH_FORBIDDEN_DISTANCE = int(os.getenv('PHASH_FORBIDDEN_DISTANCE', '6'))
+# Near-matches of verified images skip inference only when enabled
+PHASH_SKIP_VERIFIED = os.getenv('PHASH_SKIP_VERIFIED', 'false').lower() == 'true'
+PHASH_VERIFIED_DISTANCE = int(os.getenv('PHASH_VERIFIED_DISTANCE', '2'))
+# Blank and near-flat images all hash (nearly) alike, so images whose
+# low-frequency detail is below this RMS contrast (in grey levels) are
+# neither looked up nor indexed and always get inference
+PHASH_MIN_TEXTURE = float(os.getenv('PHASH_MIN_TEXTURE', '5'))
+# Local persistence of the index ('' keeps it in memory only)
+PHASH_INDEX_PATH = os.getenv('PHASH_INDEX_PATH', '/tmp/phash_index.npz')
+PHASH_SAVE_INTERVAL = 60  # seconds between saves of a changed index
+
+# API service concurrency: inference runs off the event loop on a bounded
+# pool, and requests beyond the pending limit get a 429
+API_INFERENCE_WORKERS = int(os.getenv('API_INFERENCE_WORKERS', '1'))
+API_MAX_PENDING = int(os.getenv('API_MAX_PENDING', '64'))  # queued images
+API_BATCH_WAIT_MS = float(os.getenv('API_BATCH_WAIT_MS', '5'))  # micro-batching window
+API_VIDEO_WORKERS = int(os.getenv('API_VIDEO_WORKERS', '1'))
+API_MAX_PENDING_VIDEOS = int(os.getenv('API_MAX_PENDING_VIDEOS', '4'))
+# /analyze-images: images in flight per request, and the largest archive
+# member that will be extracted (guards against zip bombs)
+API_STREAM_WINDOW = int(os.getenv('API_STREAM_WINDOW', '16'))
+API_MAX_ARCHIVE_MEMBER_BYTES = int(os.getenv('API_MAX_ARCHIVE_MEMBER_BYTES', str(50 * 1024 * 1024)))
+# /analyze-video: uploads are copied to disk in chunks and rejected with 413
+# once they exceed the limit
+API_MAX_VIDEO_BYTES = int(os.getenv('API_MAX_VIDEO_BYTES', str(500 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Instrumentation: per-stage latency histograms (download, decode,
+# preprocess, inference, postprocess, actions, ...) served by the API at
+# /metrics, and in Lambda one CloudWatch Embedded Metric Format log line per
+# invocation. With METRICS_ENABLED=false the timers are no-ops.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_EMF = os.getenv('METRICS_EMF', 'true' if os.getenv('AWS_LAMBDA_FUNCTION_NAME') else 'false').lower() == 'true'
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'ContentModeration')
+METRICS_SERVICE_NAME = os.getenv('METRICS_SERVICE_NAME', 'content-moderation')
+# Sampling profiler for individual requests: a fraction of Lambda invocations
+# and API requests (or API requests sent with X-Profile: 1 when
+# PROFILE_ON_DEMAND is set) write folded stacks to PROFILE_OUTPUT_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ON_DEMAND = os.getenv('PROFILE_ON_DEMAND', 'false').lower() == 'true'
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))  # seconds between stack samples
+PROFILE_OUTPUT_DIR = os.getenv('PROFILE_OUTPUT_DIR', '/tmp/profiles')
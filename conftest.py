@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from moto import mock_aws
+import content_moderator
+import model_registry
+from config import FORBIDDEN_CLASSES, S3_QUARANTINE_BUCKET
+from content_moderator import ContentModerator
+from detections import DetectionSet
+
+KNIFE = FORBIDDEN_CLASSES[0]
+
+class BrightnessModel:
+    """
+    Finds a knife in every image with its mean brightness as the confidence,
+    so bright images are forbidden and dark ones clean; records which
+    passes ran
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, images, image_size=None, threshold=0.5, classes=None):
+        self.calls.append(('prefilter' if classes is not None else 'full', len(images)))
+        return [
+            DetectionSet([KNIFE], [np.asarray(image).mean() / 255], [[0, 0, 4, 4]], threshold)
+            for image in images
+        ]
+
+@pytest.fixture
+def brightness_model(monkeypatch):
+    model = BrightnessModel()
+    monkeypatch.setattr(ContentModerator, 'model', model)
+    return model
+
+@pytest.fixture
+def s3_client(monkeypatch, brightness_model):
+    """Mocked S3 with an 'uploads' and the quarantine bucket, and fresh process-wide state"""
+    # Near-duplicate verdicts stay in memory, so nothing leaks between tests
+    monkeypatch.setattr(model_registry, 'PHASH_INDEX_PATH', '')
+    monkeypatch.setattr(content_moderator, 'PHASH_INDEX_PATH', '')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        model_registry.reset()
+        client = model_registry.get_client('s3')
+        client.create_bucket(Bucket='uploads')
+        client.create_bucket(Bucket=S3_QUARANTINE_BUCKET)
+        yield client
+    # Don't leak clients bound to the mock into other tests
+    model_registry.reset()
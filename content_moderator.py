@@ -1,68 +1,69 @@
-import boto3
-import cv2
+import time
 import numpy as np
-from ultralytics import YOLO
-from PIL import Image
-import io
-import tempfile
-import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from config import *
+from model_registry import (
+    get_model, get_client, get_result_cache, get_phash_index, get_action_executor, get_policy_engine
+)
+from phash_index import image_hash
+from result_cache import cache_key, content_id, CONFIG_FINGERPRINT
+from detections import DetectionSet
+from image_io import decode_image, animation_frames
+from content_probe import probe, fetch_header, fetch_rest
+from tiling import needs_tiling, tile_grid, image_size, crop, merge_detections
+from video_sampler import (
+    VideoFrameSampler, SceneChangeDetector, skip_unchanged, forbidden_segments, prefetch, batched
+)
+from s3_video import open_s3_video
+from action_executor import is_stale
+from instrumentation import timer, count
+
+# cv2 is imported where it is used so that importing this module
+# (and cold-starting the Lambda) only pays for what an event actually needs
 
 class ContentModerator:
-    def __init__(self):
-        try:
-            # Initialize YOLO model - will download automatically if not present
-            print(f"Loading YOLO model from: {MODEL_PATH}")
-            self.model = YOLO(MODEL_PATH)
-            print("YOLO model loaded successfully!")
-        except Exception as e:
-            print(f"Error loading YOLO model: {e}")
-            raise
+    def __init__(self, model_path: str = None, backend_name: str = INFERENCE_BACKEND):
+        self.model_path = model_path
+        self.backend_name = backend_name
+        # PolicySet the near-duplicate index was last pruned for
+        self._indexed_policies = None
         
-        self.s3_client = boto3.client('s3', region_name=AWS_REGION)
-        # print(f"S3 client initialized with region: {AWS_REGION}")
-        self.ses_client = boto3.client('ses', region_name=AWS_REGION)
+    # Models and AWS clients are shared process-wide so warm Lambda
+    # invocations and API requests reuse them instead of rebuilding them.
+    # They are resolved on first use so constructing a moderator is free.
+    @property
+    def model(self):
+        return get_model(self.model_path, self.backend_name)
+    
+    @property
+    def prefilter_model(self):
+        # A dedicated small model when configured, else the main model at low resolution
+        if CASCADE_MODEL_PATH:
+            return get_model(CASCADE_MODEL_PATH, self.backend_name)
+        return self.model
+    
+    @property
+    def s3_client(self):
+        return get_client('s3')
+    
+    @property
+    def ses_client(self):
+        return get_client('ses')
+    
+    @property
+    def actions(self):
+        return get_action_executor()
+    
+    @property
+    def policies(self):
+        return get_policy_engine()
         
     def process_image(self, image_data):
         """
         Process a single image and return detection results
         """
         try:
-            # Convert image data to PIL Image
-            if isinstance(image_data, bytes):
-                image = Image.open(io.BytesIO(image_data))
-            else:
-                image = image_data
-                
-            # Run inference
-            results = self.model(image)[0]
-            
-            detections = []
-            has_forbidden_content = False
-            
-            for box in results.boxes:
-                class_id = int(box.cls[0])
-                confidence = float(box.conf[0])
-                
-                if confidence >= CONFIDENCE_THRESHOLD:
-                    detection = {
-                        'class': CLASS_NAMES.get(class_id, f'unknown_{class_id}'),
-                        'class_id': class_id,
-                        'confidence': confidence,
-                        'bbox': box.xyxy[0].tolist()
-                    }
-                    detections.append(detection)
-                    
-                    if class_id in FORBIDDEN_CLASSES:
-                        has_forbidden_content = True
-            
-            return {
-                'success': True,
-                'has_forbidden_content': has_forbidden_content,
-                'detections': detections,
-                'total_detections': len(detections)
-            }
+            return self.detect(image_data).to_result()
             
         except Exception as e:
             return {
@@ -70,60 +71,198 @@ class ContentModerator:
                 'error': str(e)
             }
     
-    def process_video(self, video_path: str):
+    def process_images(self, images: list, batch_size: int = INFERENCE_BATCH_SIZE, policy=None) -> list:
+        """
+        Process several images in fixed-size inference batches and return
+        detection results in the same order as the input
+        """
+        return [
+            detections.to_result() if isinstance(detections, DetectionSet)
+            else {'success': False, 'error': str(detections)}
+            for detections in self.detect_images(images, batch_size, policy=policy)
+        ]
+    
+    def detect(self, image_data) -> DetectionSet:
+        """
+        Run inference on a single image and return its compact DetectionSet
+        """
+        detections = self.detect_images([image_data])[0]
+        if isinstance(detections, Exception):
+            raise detections
+        return detections
+    
+    def detect_images(self, images: list, batch_size: int = INFERENCE_BATCH_SIZE,
+                      tiled: bool = TILING_ENABLED, cascade: bool = CASCADE_ENABLED, policy=None) -> list:
+        """
+        Run batched inference and return a DetectionSet per image, or the
+        exception that prevented that image from being processed. With
+        cascade, only images the prefilter flags get full inference; with
+        tiled, large images also get a tile pass for small objects. policy
+        is a CompiledPolicy, or a list with one per image; by default the
+        moderation policy's default scope decides.
+        """
+        if policy is None:
+            policy = self.policies.resolve()
+        policies = policy if isinstance(policy, list) else [policy] * len(images)
+        distinct = list({id(p): p for p in policies}.values())
+        # Only ask the model for candidates below its default threshold when a policy needs them
+        floor = min([p.floor for p in distinct], default=CONFIDENCE_THRESHOLD)
+        detect_kwargs = {'threshold': floor} if floor < CONFIDENCE_THRESHOLD else {}
+        outputs = [None] * len(images)
+        loaded = []
+        scales = []
+        positions = []
+        
+        # Decode up front so one corrupt image fails on its own
+        for i, image_data in enumerate(images):
+            try:
+                # Reduced-size decoding would throw away the detail tiles are for
+                with timer('decode'):
+                    image, scale = self._load_image(image_data, reduced=DECODE_REDUCED_SIZE and not tiled)
+                loaded.append(image)
+                scales.append(scale)
+                positions.append(i)
+            except Exception as e:
+                outputs[i] = e
+        
+        if cascade and loaded:
+            with timer('prefilter'):
+                watched = sorted(set().union(*(p.classes for p in distinct)))
+                escalate = self.prefilter_scores(loaded, batch_size, classes=watched) >= CASCADE_THRESHOLD
+            count('moderation_prefilter_escalated_total', int(escalate.sum()))
+            count('moderation_prefilter_cleared_total', int((~escalate).sum()))
+            for i in np.flatnonzero(~escalate).tolist():
+                outputs[positions[i]] = DetectionSet.empty()
+            loaded, scales, positions = (
+                [items[i] for i in np.flatnonzero(escalate).tolist()] for items in (loaded, scales, positions)
+            )
+        
+        for start in range(0, len(loaded), batch_size):
+            batch = loaded[start:start + batch_size]
+            batch_positions = positions[start:start + batch_size]
+            try:
+                with timer('detect'):
+                    batch_detections = self.model.detect(batch, **detect_kwargs)
+                for i, detections in zip(batch_positions, batch_detections):
+                    outputs[i] = detections
+            except Exception as e:
+                for i in batch_positions:
+                    outputs[i] = e
+        
+        if tiled:
+            # Tiled images are decoded at full size, so the full pass can be
+            # judged now and flagged images skip their tiles
+            for i in positions:
+                if isinstance(outputs[i], DetectionSet):
+                    outputs[i].apply_policy(policies[i])
+            with timer('tiles'):
+                self._detect_tiles(dict(zip(positions, loaded)), outputs, batch_size, detect_kwargs)
+        
+        for i, scale in zip(positions, scales):
+            if isinstance(outputs[i], DetectionSet):
+                outputs[i].rescale(scale)
+        # min_area is in original-image pixels, so judge after rescaling
+        for detections, image_policy in zip(outputs, policies):
+            if isinstance(detections, DetectionSet):
+                detections.apply_policy(image_policy)
+        return outputs
+    
+    def prefilter_scores(self, images: list, batch_size: int = INFERENCE_BATCH_SIZE,
+                         threshold: float = CASCADE_THRESHOLD, classes: list = None) -> np.ndarray:
         """
-        Process a video file and return detection results for each frame
+        Cascade stage 1: the highest confidence among classes (default: every
+        class the moderation policy watches) of each decoded image in a
+        low-resolution pass (0 when nothing reaches threshold). A failed
+        batch scores 1 so its images still get the full detector.
         """
+        if classes is None:
+            classes = sorted(set().union(*(p.classes for p in self.policies.current().scopes)))
+        if not classes:
+            # The policy can't flag anything
+            return np.zeros(len(images), dtype=np.float32)
+        scores = []
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            try:
+                for detections in self.prefilter_model.detect(
+                    batch, image_size=CASCADE_IMAGE_SIZE, threshold=threshold, classes=classes
+                ):
+                    scores.append(float(detections.confidences.max(initial=0)))
+            except Exception as e:
+                print(f"Prefilter failed, running full inference: {e}")
+                scores.extend([1.0] * len(batch))
+        return np.array(scores, dtype=np.float32)
+    
+    def _detect_tiles(self, images: dict, outputs: list, batch_size: int, detect_kwargs: dict = None):
+        """
+        Run overlapping tiles of every large image through the model, batched
+        across images, and merge them into that image's full-image
+        detections. Images the full pass already flagged keep their verdict
+        without paying for tiles.
+        """
+        jobs = []
+        tiles = []
+        for i, image in images.items():
+            full = outputs[i]
+            if not isinstance(full, DetectionSet) or full.has_forbidden_content or not needs_tiling(image):
+                continue
+            boxes = tile_grid(*image_size(image))
+            jobs.append((i, boxes))
+            tiles.extend(crop(image, box) for box in boxes.tolist())
+        
         try:
-            cap = cv2.VideoCapture(video_path)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            frame_interval = int(fps / VIDEO_FRAME_RATE)
-            frame_results = []
-            forbidden_frames = []
-            
-            frame_count = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                    
-                # Process every nth frame based on frame_interval
-                if frame_count % frame_interval == 0:
-                    # Convert BGR to RGB
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(frame_rgb)
-                    
-                    # Process frame
-                    result = self.process_image(pil_image)
-                    
-                    if result['success']:
-                        frame_result = {
-                            'frame_number': frame_count,
-                            'timestamp': frame_count / fps,
-                            'detections': result['detections'],
-                            'has_forbidden_content': result['has_forbidden_content']
-                        }
-                        frame_results.append(frame_result)
-                        
-                        if result['has_forbidden_content']:
-                            forbidden_frames.append(frame_result)
-                
-                frame_count += 1
-                
-                # Stop if video is too long
-                if frame_count / fps > MAX_VIDEO_DURATION:
-                    break
+            detections = []
+            for start in range(0, len(tiles), batch_size):
+                detections.extend(self.model.detect(tiles[start:start + batch_size], **(detect_kwargs or {})))
+        except Exception as e:
+            print(f"Tile pass failed, keeping full-image detections: {e}")
+            return
+        
+        for i, boxes in jobs:
+            outputs[i] = merge_detections(outputs[i], detections[:len(boxes)], boxes)
+            detections = detections[len(boxes):]
+    
+    def _load_image(self, image_data, reduced: bool = DECODE_REDUCED_SIZE):
+        """
+        Decode encoded image bytes (bytes, bytearray or memoryview) to a BGR
+        array; NumPy BGR arrays and PIL images pass through untouched.
+        Returns (image, scale) where scale maps boxes back to full resolution.
+        """
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            return decode_image(image_data, reduced)
+        return image_data, 1
+    
+    def process_video(self, video_path, stop_after_hits: int = VIDEO_STOP_AFTER_HITS,
+                      batch_size: int = INFERENCE_BATCH_SIZE, policy=None):
+        """
+        Process a video file (a path, URL or seekable binary stream) and
+        return detection results for each frame.
+        A decoder thread feeds sampled frames through a bounded queue into
+        batched inference; with stop_after_hits > 0 analysis stops once that
+        many forbidden frames were found. Forbidden detections are also
+        reported as per-class time segments.
+        """
+        try:
+            # (frame_number, timestamp, DetectionSet); dicts are only built at the end
+            frame_detections = []
+            for event in self.iter_video_events(video_path, stop_after_hits, batch_size, policy):
+                if event['event'] == 'segment':
+                    frame_detections.extend(event['frames'])
+                else:
+                    summary = event
             
-            cap.release()
+            frame_results = [self.frame_result(*frame) for frame in frame_detections]
+            forbidden_frames = [r for r in frame_results if r['has_forbidden_content']]
             
             return {
                 'success': True,
                 'total_frames_processed': len(frame_results),
+                'frames_inferred': summary['frames_inferred'],
                 'forbidden_frames': forbidden_frames,
+                'forbidden_segments': forbidden_segments(frame_detections),
                 'frame_results': frame_results,
-                'video_duration': frame_count / fps
+                'video_duration': summary['video_duration'],
+                'stopped_early': summary['stopped_early']
             }
             
         except Exception as e:
@@ -132,110 +271,439 @@ class ContentModerator:
                 'error': str(e)
             }
     
-    def handle_s3_image(self, bucket_name: str, object_key: str) -> dict:
+    def iter_video_events(self, video_path, stop_after_hits: int = VIDEO_STOP_AFTER_HITS,
+                          batch_size: int = INFERENCE_BATCH_SIZE, policy=None):
         """
-        Handle S3 image upload - download, process, and take action
+        Analyze a video incrementally. Yields one {'event': 'segment'} per
+        inference batch, whose 'frames' are (frame_number, timestamp,
+        DetectionSet) tuples, then a final {'event': 'complete'} with the
+        video duration and whether analysis stopped early. Frames that didn't
+        change since the last analyzed one reuse its DetectionSet.
         """
+        # Video libraries are only loaded when a video is actually processed
+        import cv2
+        
+        # One policy for the whole video, even if the file reloads meanwhile
+        policy = policy or self.policies.resolve()
+        if isinstance(video_path, str):
+            cap = cv2.VideoCapture(video_path)
+        else:
+            # Readable, seekable binary stream (e.g. S3RangeReader)
+            cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [])
+        if not cap.isOpened():
+            # Drop the query string so presigned URLs don't end up in logs
+            name = video_path.split('?')[0] if isinstance(video_path, str) else getattr(video_path, 'name', 'stream')
+            raise ValueError(f"Could not open video: {name}")
         try:
-            # Download image from S3
-            response = self.s3_client.get_object(Bucket=bucket_name, Key=object_key)
-            image_data = response['Body'].read()
-            
-            # Process image
-            result = self.process_image(image_data)
+            # Only the sampled frames are decoded. Frames go to the model as
+            # the BGR arrays OpenCV produced, without RGB/PIL copies.
+            sampler = VideoFrameSampler(cap)
+            hits = 0
+            inferred = 0
+            last = None
+            stopped_early = False
             
-            if result['success']:
-                if result['has_forbidden_content']:
-                    # Move to quarantine bucket
-                    self._move_to_quarantine(bucket_name, object_key)
-                    # Send alert email
-                    self._send_alert_email(object_key, result['detections'])
-                    return {
-                        'action': 'quarantined',
-                        'detections': result['detections']
-                    }
-                else:
-                    # Add verified tag
-                    self._add_verified_tag(bucket_name, object_key)
-                    return {
-                        'action': 'verified',
-                        'detections': result['detections']
+            # Scene-change checks run on the decoder thread too
+            prefetched = prefetch(skip_unchanged(sampler, SceneChangeDetector()))
+            try:
+                for batch in batched(prefetched, batch_size):
+                    changed = [image for _, _, image in batch if image is not None]
+                    # Process frames (not tiled, so per-video latency stays predictable)
+                    results = iter(
+                        self.detect_images(changed, batch_size, tiled=False, policy=policy) if changed else []
+                    )
+                    frames = []
+                    for frame_number, timestamp, image in batch:
+                        if image is not None:
+                            detections = next(results)
+                            if isinstance(detections, Exception):
+                                print(f"Error processing frame {frame_number}: {detections}")
+                                # Nothing to carry forward until the next analyzed frame
+                                last = None
+                                continue
+                            last = detections
+                            inferred += 1
+                            hits += detections.has_forbidden_content
+                        elif last is None:
+                            continue
+                        frames.append((frame_number, timestamp, last))
+                    
+                    yield {
+                        'event': 'segment',
+                        'start': batch[0][1],
+                        'end': batch[-1][1],
+                        'frames_inferred': len(changed),
+                        'frames': frames
                     }
-            else:
-                return {
-                    'action': 'error',
-                    'error': result['error']
-                }
-                
-        except Exception as e:
-            return {
-                'action': 'error',
-                'error': str(e)
+                    
+                    if stop_after_hits and hits >= stop_after_hits:
+                        stopped_early = True
+                        break
+            finally:
+                # Stops the decoder thread before the capture is released
+                prefetched.close()
+            
+            yield {
+                'event': 'complete',
+                'video_duration': sampler.duration,
+                'frames_inferred': inferred,
+                'stopped_early': stopped_early
             }
+        finally:
+            cap.release()
+    
+    def frame_result(self, frame_number: int, timestamp: float, detections: DetectionSet) -> dict:
+        """Convert one analyzed frame to the frame result dict used in responses"""
+        return {
+            'frame_number': frame_number,
+            'timestamp': timestamp,
+            'detections': detections.to_dicts(),
+            'has_forbidden_content': detections.has_forbidden_content
+        }
+    
+    def handle_s3_image(self, bucket_name: str, object_key: str, etag: str = None) -> dict:
+        """
+        Handle S3 image upload - download, process, and take action
+        """
+        return self.handle_s3_images([(bucket_name, object_key, etag)])[0]
     
-    def _move_to_quarantine(self, source_bucket: str, object_key: str):
-        """Move object to quarantine bucket"""
+    def handle_s3_video(self, bucket_name: str, object_key: str, etag: str = None,
+                        stop_after_hits: int = S3_VIDEO_STOP_AFTER_HITS, dry_run: bool = False) -> dict:
+        """
+        Handle S3 video upload - stream sampled frames with ranged GETs,
+        process, and take action. The video is never downloaded in full.
+        """
         try:
-            # Copy to quarantine bucket
-            self.s3_client.copy_object(
-                Bucket=S3_QUARANTINE_BUCKET,
-                CopySource={'Bucket': source_bucket, 'Key': object_key},
-                Key=f"quarantined/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{object_key}"
-            )
-            
-            # Delete from source bucket
-            self.s3_client.delete_object(Bucket=source_bucket, Key=object_key)
-            
+            source = open_s3_video(self.s3_client, bucket_name, object_key)
+            found = self._probe_video(source) if PROBE_ENABLED else None
         except Exception as e:
-            print(f"Error moving to quarantine: {e}")
+            if is_stale(e):
+                return self._stale(object_key, e)
+            return {'action': 'error', 'error': str(e)}
+        if found is not None and found['kind'] == 'rejected':
+            return self._rejected(object_key, found)
+        if found is not None and found['kind'] != 'video':
+            print(f"{object_key} is an image ({found['format']}), not a video")
+            return self.handle_s3_images([(bucket_name, object_key, etag)], dry_run)[0]
+        
+        result = self.process_video(source, stop_after_hits, policy=self.policies.resolve(bucket_name, object_key))
+        if not result['success']:
+            return self._take_action(bucket_name, object_key, result, etag, dry_run)
+        
+        # Quarantine on any forbidden frame; the alert lists their detections
+        result['has_forbidden_content'] = bool(result['forbidden_frames'])
+        result['detections'] = [d for frame in result['forbidden_frames'] for d in frame['detections']]
+        action = self._take_action(bucket_name, object_key, result, etag, dry_run)
+        action.update({
+            'forbidden_segments': result['forbidden_segments'],
+            'total_frames_processed': result['total_frames_processed'],
+            'frames_inferred': result['frames_inferred'],
+            'video_duration': result['video_duration'],
+            'stopped_early': result['stopped_early']
+        })
+        if hasattr(source, 'bytes_fetched'):
+            action['bytes_fetched'] = source.bytes_fetched
+        return action
+    
+    def _probe_video(self, source):
+        """Probe the start of an opened S3 video; None for presigned URLs"""
+        if isinstance(source, str):
+            return None
+        # The reader caches this block, so decoding starts without another request
+        header = source.read(PROBE_BYTES)
+        source.seek(0)
+        return probe(header, source.size)
+    
+    def _rejected(self, object_key: str, found: dict) -> dict:
+        """Report an object the probe rejected; it is left where it is and not retried"""
+        print(f"Rejected {object_key}: {found['reason']} "
+              f"({found['format'] or 'unknown format'}, {found['size']} bytes)")
+        count('moderation_rejected_total', reason=found['reason'])
+        return {
+            'action': 'rejected',
+            'reason': found['reason'],
+            'format': found['format']
+        }
+    
+    def _stale(self, object_key: str, error) -> dict:
+        """
+        The object is gone or was replaced since its event was sent, e.g. a
+        redelivered event after the quarantine move: nothing left to do, and
+        nothing to retry
+        """
+        code = error.response['Error']['Code']
+        print(f"Skipping {object_key}: already moved or replaced ({code})")
+        return {
+            'action': 'skipped',
+            'already_applied': True,
+            'reason': code
+        }
+    
+    def handle_s3_images(self, objects: list, dry_run: bool = False, near_duplicates: bool = True) -> list:
+        """
+        Handle a batch of S3 image uploads - probe and download every
+        (bucket, key) or (bucket, key, etag) concurrently, run one batched
+        inference for the ones not already decided by the result cache or
+        the near-duplicate index, and take action per object (only report it
+        with dry_run). Rejected objects are reported without inference, and
+        objects that turn out to be videos take the video path. Without
+        near_duplicates the index is neither consulted nor updated.
+        """
+        outputs = [None] * len(objects)
+        results = [None] * len(objects)
+        cache_keys = [None] * len(objects)
+        shortcuts = [None] * len(objects)
+        probes = [None] * len(objects)
+        images = []
+        positions = []
+        # Each object is judged by the policy scope of its bucket/prefix
+        policy_set = self.policies.current()
+        policies = [policy_set.resolve(obj[0], obj[1]) for obj in objects]
+        
+        with ThreadPoolExecutor(max_workers=S3_DOWNLOAD_WORKERS) as pool:
+            futures = [
+                pool.submit(self._fetch_s3_object, *obj, policy=policy) for obj, policy in zip(objects, policies)
+            ]
+            for i, future in enumerate(futures):
+                try:
+                    cache_keys[i], results[i], image_data, probes[i] = future.result()
+                    if results[i] is not None:
+                        shortcuts[i] = {'cached': True}
+                        count('moderation_shortcuts_total', kind='cache')
+                    elif image_data is not None:
+                        images.append(image_data)
+                        positions.append(i)
+                    elif probes[i]['kind'] == 'rejected':
+                        outputs[i] = self._rejected(objects[i][1], probes[i])
+                except Exception as e:
+                    if is_stale(e):
+                        outputs[i] = self._stale(objects[i][1], e)
+                        continue
+                    outputs[i] = {
+                        'action': 'error',
+                        'error': str(e)
+                    }
+        
+        animated = {i for i, found in enumerate(probes) if found is not None and found['kind'] == 'animation'}
+        # The near-duplicate index holds verdicts of still images only, each
+        # matching lookups under the same model, config and policy scope
+        stills = [(i, image_data) for i, image_data in zip(positions, images) if i not in animated]
+        phash_keys = [f"{CONFIG_FINGERPRINT}:{policy.fingerprint}" for policy in policies]
+        image_hashes = {}
+        if near_duplicates:
+            with timer('phash'):
+                self._retire_stale_verdicts(policy_set)
+                image_hashes = self._match_near_duplicates(
+                    [image_data for _, image_data in stills], [i for i, _ in stills], results, shortcuts, phash_keys
+                )
+        
+        # Still images and sampled animation frames share the inference batches
+        batch = []
+        owners = []
+        for i, image_data in zip(positions, images):
+            if results[i] is not None:
+                continue
+            if i not in animated:
+                batch.append(image_data)
+                owners.append((i, None))
+                continue
+            try:
+                frames = animation_frames(image_data)
+            except Exception as e:
+                results[i] = {'success': False, 'error': f"Could not decode animation: {e}"}
+                continue
+            batch.extend(frame for _, frame in frames)
+            owners.extend((i, frame_number) for frame_number, _ in frames)
+        
+        inferred = self.process_images(batch, policy=[policies[i] for i, _ in owners])
+        frame_results = {}
+        for (i, frame_number), result in zip(owners, inferred):
+            if frame_number is None:
+                results[i] = result
+            else:
+                frame_results.setdefault(i, []).append((frame_number, result))
+        for i, frames in frame_results.items():
+            results[i] = self._merge_frame_results(frames)
+        
+        for i in dict.fromkeys(i for i, _ in owners):
+            result = results[i]
+            if not result['success']:
+                continue
+            if self.result_cache is not None:
+                self.result_cache.set(cache_keys[i], result)
+            if i in image_hashes:
+                self.phash_index.add(image_hashes[i], result['has_forbidden_content'], objects[i][1], phash_keys[i])
+        
+        # Cache and near-duplicate hits go straight to the quarantine/verify action,
+        # and every object's action runs concurrently
+        decided = [i for i, result in enumerate(results) if result is not None]
+        actions = self.actions.run([
+            (objects[i][0], objects[i][1], results[i], objects[i][2] if len(objects[i]) > 2 else None)
+            for i in decided
+        ], dry_run)
+        for i, action in zip(decided, actions):
+            outputs[i] = dict(action, **(shortcuts[i] or {}))
+        
+        if near_duplicates:
+            self._save_phash_index()
+        
+        # Objects that are really videos are streamed like any other video
+        for i, found in enumerate(probes):
+            if outputs[i] is None and found is not None and found['kind'] == 'video':
+                print(f"{objects[i][1]} is a video ({found['format']}), not an image")
+                outputs[i] = self.handle_s3_video(*objects[i], dry_run=dry_run)
+        return outputs
+    
+    def _merge_frame_results(self, frames: list) -> dict:
+        """One result for an animation from its (frame_number, result) pairs"""
+        analyzed = [(frame_number, result) for frame_number, result in frames if result['success']]
+        if not analyzed:
+            return frames[0][1]
+        detections = [
+            dict(detection, frame=frame_number)
+            for frame_number, result in analyzed for detection in result['detections']
+        ]
+        return {
+            'success': True,
+            'has_forbidden_content': any(result['has_forbidden_content'] for _, result in analyzed),
+            'detections': detections,
+            'total_detections': len(detections),
+            'frames_analyzed': len(analyzed)
+        }
+    
+    def _match_near_duplicates(self, images: list, positions: list, results: list, shortcuts: list,
+                               fingerprints: list) -> dict:
+        """
+        Look downloaded images up in the perceptual-hash index and fill in
+        results for the ones a known image decides under the same
+        fingerprint. Returns the hashes of the images that still need
+        inference, keyed by position.
+        """
+        index = self.phash_index
+        image_hashes = {}
+        if index is None:
+            return image_hashes
+        
+        for i, image_data in zip(positions, images):
+            try:
+                found = image_hash(image_data)
+            except Exception:
+                # Undecodable images are reported by process_images
+                continue
+            if found is None:
+                # Blank or near-flat: it would match every other blank image
+                continue
+            image_hashes[i] = found
+            match = index.match(image_hashes[i], fingerprints[i])
+            if match is None:
+                continue
+            results[i] = {
+                'success': True,
+                'has_forbidden_content': match['forbidden'],
+                'detections': [],
+                'total_detections': 0
+            }
+            shortcuts[i] = {
+                'near_duplicate_of': match['near_duplicate_of'],
+                'hash_distance': match['distance']
+            }
+            count('moderation_shortcuts_total', kind='near_duplicate')
+            del image_hashes[i]
+        return image_hashes
     
-    def _add_verified_tag(self, bucket_name, object_key):
-        """Add verified tag to S3 object"""
+    @property
+    def phash_index(self):
+        return get_phash_index()
+    
+    def _retire_stale_verdicts(self, policy_set):
+        """Drop near-duplicate verdicts made under policies that are no longer loaded"""
+        index = self.phash_index
+        if index is None or policy_set is self._indexed_policies:
+            return
+        dropped = index.retain({f"{CONFIG_FINGERPRINT}:{policy.fingerprint}" for policy in policy_set.scopes})
+        if dropped:
+            print(f"Moderation policy changed, dropped {dropped} near-duplicate verdict(s)")
+        self._indexed_policies = policy_set
+    
+    def _save_phash_index(self):
+        """Persist the near-duplicate index when it changed, at most every PHASH_SAVE_INTERVAL"""
+        index = self.phash_index
+        if index is None or not PHASH_INDEX_PATH or not index.dirty:
+            return
+        if time.time() - index.last_saved < PHASH_SAVE_INTERVAL:
+            return
         try:
-            self.s3_client.put_object_tagging(
-                Bucket=bucket_name,
-                Key=object_key,
-                Tagging={
-                    'TagSet': [
-                        {
-                            'Key': 'ContentModeration',
-                            'Value': 'Verified'
-                        }
-                    ]
-                }
-            )
+            index.save(PHASH_INDEX_PATH)
         except Exception as e:
-            print(f"Error adding verified tag: {e}")
-
-
-    def _send_alert_email(self, object_key: str, detections: list):
-        """Send alert email via SES"""
-        return
-        try:
-            detection_summary = "\n".join([
-                f"- {d['class']} (confidence: {d['confidence']:.2f})"
-                for d in detections
-            ])
-            
-            subject = f"Content Moderation Alert - Forbidden Content Detected"
-            body = f"""
-            Forbidden content detected in file: {object_key}
-            
-            Detections:
-            {detection_summary}
-            
-            The file has been moved to quarantine bucket.
-            Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            """
-            
-            self.ses_client.send_email(
-                Source=SES_SENDER_EMAIL,
-                Destination={'ToAddresses': [SES_RECIPIENT_EMAIL]},
-                Message={
-                    'Subject': {'Data': subject},
-                    'Body': {'Text': {'Data': body}}
-                }
-            )
+            print(f"Error saving near-duplicate index: {e}")
+    
+    @property
+    def result_cache(self):
+        return get_result_cache()
+    
+    def _fetch_s3_object(self, bucket_name: str, object_key: str, etag: str = None, policy=None) -> tuple:
+        """
+        Look an S3 object up in the result cache and download it on a miss.
+        Returns (cache_key, cached_result, image_data, probe); the body is
+        only read when there is no cached result for its ETag under policy,
+        and with PROBE_ENABLED only when the probe found an image (image_data
+        is None for rejected objects and videos).
+        """
+        cache = self.result_cache
+        fingerprint = policy.fingerprint if policy is not None else ''
+        key = None
+        if cache is not None and etag:
+            # ETag from the S3 event: a hit skips the S3 request entirely
+            key = cache_key(content_id(etag=etag), fingerprint)
+            cached = cache.get(key)
+            if cached is not None:
+                return key, cached, None, None
+        
+        if PROBE_ENABLED:
+            return self._probe_and_fetch(bucket_name, object_key, cache, key, fingerprint, etag)
+        
+        with timer('download'):
+            params = {'Bucket': bucket_name, 'Key': object_key}
+            if etag:
+                # A replaced object fails with 412; its own event moderates the new one
+                params['IfMatch'] = '"' + etag.strip('"') + '"'
+            response = self.s3_client.get_object(**params)
+            if cache is not None and key is None and response.get('ETag'):
+                key = cache_key(content_id(etag=response['ETag']), fingerprint)
+                cached = cache.get(key)
+                if cached is not None:
+                    response['Body'].close()
+                    return key, cached, None, None
             
-        except Exception as e:
-            print(f"Error sending alert email: {e}") 
\ No newline at end of file
+            image_data = response['Body'].read()
+        if cache is not None and key is None:
+            key = cache_key(content_id(image_data), fingerprint)
+        return key, None, image_data, None
+    
+    def _probe_and_fetch(self, bucket_name: str, object_key: str, cache, key: str, fingerprint: str,
+                         event_etag: str = None) -> tuple:
+        """
+        _fetch_s3_object with the pre-inference gate: one ranged GET for the
+        header, then the rest of the body only for images worth decoding
+        """
+        with timer('probe'):
+            header, size, etag = fetch_header(self.s3_client, bucket_name, object_key, etag=event_etag)
+            if cache is not None and key is None and etag:
+                key = cache_key(content_id(etag=etag), fingerprint)
+                cached = cache.get(key)
+                if cached is not None:
+                    return key, cached, None, None
+            found = probe(header, size)
+        if found['kind'] not in ('image', 'animation'):
+            return key, None, None, found
+        
+        with timer('download'):
+            image_data = fetch_rest(self.s3_client, bucket_name, object_key, header, size, etag)
+        if cache is not None and key is None:
+            key = cache_key(content_id(image_data), fingerprint)
+        return key, None, image_data, found
+    
+    def _take_action(self, bucket_name: str, object_key: str, result: dict, etag: str = None,
+                     dry_run: bool = False) -> dict:
+        """Quarantine or verify an object based on its detection result"""
+        return self.actions.run([(bucket_name, object_key, result, etag)], dry_run)[0]
@@ -0,0 +1,100 @@
+from config import *
+from image_io import sniff_format, image_dimensions, is_animated
+
+# Header-only probing of uploads. Junk (empty files, non-media behind an
+# image extension, truncated uploads, images whose declared dimensions would
+# take gigabytes to decode) is rejected from its first few KB, before the
+# body is downloaded or anything is decoded. Everything else is routed by
+# what the bytes actually are, not by the file extension.
+
+IMAGE_FORMATS = ('jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff')
+VIDEO_FORMATS = ('mp4', 'matroska', 'avi')
+
+
+def probe(header, size: int = None) -> dict:
+    """
+    Classify an object from its first bytes and its total size. Returns
+    {'kind', 'format', 'size'} plus 'width'/'height' for images when the
+    header has them; kind is 'image', 'animation', 'video' or 'rejected',
+    with a 'reason' for rejections.
+    """
+    size = len(header) if size is None else size
+    image_format = sniff_format(header)
+    found = {'kind': 'rejected', 'format': image_format, 'size': size}
+
+    if size == 0:
+        return dict(found, reason='empty')
+    if image_format in VIDEO_FORMATS:
+        return dict(found, kind='video')
+    if image_format not in IMAGE_FORMATS:
+        return dict(found, reason='unsupported')
+    if size > MAX_IMAGE_BYTES:
+        return dict(found, reason='too_large')
+
+    dimensions = image_dimensions(header, image_format)
+    if dimensions is None:
+        # Only conclusive when the header is the whole file; otherwise the
+        # dimensions may sit further in (large EXIF, TIFF IFD at the end) and
+        # are checked again before decoding
+        if len(header) >= size:
+            return dict(found, reason='corrupt')
+    else:
+        width, height = dimensions
+        found.update(width=width, height=height)
+        if not width or not height:
+            return dict(found, reason='corrupt')
+        if width * height > MAX_IMAGE_PIXELS:
+            # Decompression bomb, or just more pixels than we are willing to allocate
+            return dict(found, reason='too_many_pixels')
+
+    found['kind'] = 'animation' if is_animated(header, image_format) else 'image'
+    return found
+
+
+def fetch_header(s3_client, bucket_name: str, object_key: str, probe_bytes: int = PROBE_BYTES,
+                 etag: str = None) -> tuple:
+    """
+    Read the first probe_bytes of an S3 object with one ranged GET. Returns
+    (header, object size, ETag); header is the whole object when it is
+    smaller than probe_bytes. With etag, a replaced object fails with 412.
+    """
+    params = {'Bucket': bucket_name, 'Key': object_key, 'Range': f"bytes=0-{probe_bytes - 1}"}
+    if etag:
+        params['IfMatch'] = '"' + etag.strip('"') + '"'
+    try:
+        response = s3_client.get_object(**params)
+    except Exception as e:
+        # Any range of an empty object is unsatisfiable
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'InvalidRange':
+            return b'', 0, None
+        raise
+    header = response['Body'].read()
+    # "bytes 0-65535/1234567"; servers that ignore Range send the whole object
+    content_range = response.get('ContentRange')
+    size = int(content_range.rsplit('/', 1)[1]) if content_range else len(header)
+    return header, size, response.get('ETag')
+
+
+def fetch_rest(s3_client, bucket_name: str, object_key: str, header: bytes, size: int, etag: str = None):
+    """
+    Download the part of an object after header into one preallocated
+    buffer holding the whole object. The range is pinned to etag so a
+    concurrent overwrite fails instead of mixing two versions.
+    """
+    if len(header) >= size:
+        return header
+    params = {'Bucket': bucket_name, 'Key': object_key, 'Range': f"bytes={len(header)}-"}
+    if etag:
+        params['IfMatch'] = etag
+    response = s3_client.get_object(**params)
+
+    data = bytearray(size)
+    data[:len(header)] = header
+    view = memoryview(data)
+    position = len(header)
+    for chunk in response['Body'].iter_chunks(1024 * 1024):
+        view[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    if position != size:
+        raise ValueError(f"Object changed while downloading: expected {size} bytes, got {position}")
+    return data
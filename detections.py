@@ -0,0 +1,98 @@
+import numpy as np
+from config import *
+
+# Boolean lookup table indexed by class id, built once so the forbidden check
+# is a single array gather instead of a list scan per box
+FORBIDDEN_LOOKUP = np.zeros(max(CLASS_NAMES) + 1, dtype=bool)
+FORBIDDEN_LOOKUP[FORBIDDEN_CLASSES] = True
+
+
+class DetectionSet:
+    """
+    Detections for one image kept as NumPy arrays. Dicts are only built by
+    to_dicts()/to_result() when the result leaves the service.
+    """
+    __slots__ = ('class_ids', 'confidences', 'xyxy', 'forbidden')
+
+    def __init__(self, class_ids, confidences, xyxy, threshold: float = CONFIDENCE_THRESHOLD):
+        class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+
+        # Threshold and forbidden-class match in one vectorized step
+        keep = confidences >= threshold
+        in_table = (class_ids >= 0) & (class_ids < len(FORBIDDEN_LOOKUP))
+        forbidden = np.zeros(len(class_ids), dtype=bool)
+        forbidden[in_table] = FORBIDDEN_LOOKUP[class_ids[in_table]]
+
+        self.class_ids = class_ids[keep]
+        self.confidences = confidences[keep]
+        self.xyxy = xyxy[keep]
+        self.forbidden = forbidden[keep]
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty((0, 4)))
+
+    @classmethod
+    def from_results(cls, results, threshold: float = CONFIDENCE_THRESHOLD):
+        """Build a DetectionSet from one YOLO Results object"""
+        boxes = results.boxes
+        if boxes is None or len(boxes) == 0:
+            return cls.empty()
+        # Pull whole tensors out once instead of indexing box by box
+        return cls(
+            boxes.cls.cpu().numpy(),
+            boxes.conf.cpu().numpy(),
+            boxes.xyxy.cpu().numpy(),
+            threshold
+        )
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def rescale(self, factor: float):
+        """Scale boxes in place (e.g. from a reduced-size decode) and return self"""
+        if factor != 1:
+            self.xyxy *= factor
+        return self
+
+    def apply_policy(self, policy):
+        """
+        Re-decide the detections with a CompiledPolicy (moderation_policy):
+        drop the ones it doesn't report and flag the forbidden ones, in place.
+        Boxes must be in original image coordinates for min_area.
+        """
+        keep, forbidden = policy.evaluate(self.class_ids, self.confidences, self.xyxy)
+        self.class_ids = self.class_ids[keep]
+        self.confidences = self.confidences[keep]
+        self.xyxy = self.xyxy[keep]
+        self.forbidden = forbidden[keep]
+        return self
+
+    @property
+    def has_forbidden_content(self) -> bool:
+        return bool(self.forbidden.any())
+
+    def to_dicts(self) -> list:
+        """Convert to the list-of-dicts detection format used by the API"""
+        return [
+            {
+                'class': CLASS_NAMES.get(class_id, f'unknown_{class_id}'),
+                'class_id': class_id,
+                'confidence': confidence,
+                'bbox': bbox
+            }
+            for class_id, confidence, bbox in zip(
+                self.class_ids.tolist(), self.confidences.tolist(), self.xyxy.tolist()
+            )
+        ]
+
+    def to_result(self) -> dict:
+        """Convert to the process_image result dict"""
+        return {
+            'success': True,
+            'has_forbidden_content': self.has_forbidden_content,
+            'detections': self.to_dicts(),
+            'total_detections': len(self)
+        }
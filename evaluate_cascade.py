@@ -0,0 +1,134 @@
+"""
+Evaluation harness for the two-stage cascade (CASCADE_* in config.py).
+
+Runs the prefilter and the full detector over a labelled local dataset:
+
+    dataset/
+        forbidden/   images that contain forbidden content
+        benign/      images that don't
+
+and reports, for each candidate CASCADE_THRESHOLD, how much full-detector
+recall the cascade loses and how much inference time it saves. Each stage
+runs once per image; thresholds are swept over the recorded scores.
+
+Usage:
+    python evaluate_cascade.py dataset --thresholds 0.05,0.1,0.2 --output cascade.json
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from config import *
+
+
+def load_dataset(root: str) -> tuple:
+    """(paths, labels) of every image under root/forbidden and root/benign"""
+    paths, labels = [], []
+    for label, subdir in ((True, 'forbidden'), (False, 'benign')):
+        directory = os.path.join(root, subdir)
+        for name in sorted(os.listdir(directory)):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(directory, name))
+                labels.append(label)
+    return paths, np.array(labels, dtype=bool)
+
+
+def run_stages(moderator, paths: list, batch_size: int, min_threshold: float) -> dict:
+    """
+    Decode every image once and record, per image, the prefilter score, the
+    full detector's verdict and the time each stage took
+    """
+    from image_io import decode_image
+    scores, flags, stage1_times, full_times = [], [], [], []
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                images.append(decode_image(f.read(), reduced=False)[0])
+
+        t0 = time.perf_counter()
+        scores.extend(moderator.prefilter_scores(images, batch_size, threshold=min_threshold).tolist())
+        t1 = time.perf_counter()
+        detections = moderator.detect_images(images, batch_size, cascade=False)
+        t2 = time.perf_counter()
+
+        # Batch time is split evenly across its images
+        stage1_times.extend([(t1 - t0) / len(images)] * len(images))
+        full_times.extend([(t2 - t1) / len(images)] * len(images))
+        for d in detections:
+            if isinstance(d, Exception):
+                raise d
+            flags.append(d.has_forbidden_content)
+
+    return {
+        'scores': np.array(scores),
+        'flags': np.array(flags, dtype=bool),
+        'stage1_times': np.array(stage1_times),
+        'full_times': np.array(full_times)
+    }
+
+
+def summarize(labels: np.ndarray, stages: dict, thresholds: list) -> list:
+    """Recall and compute trade-off of the cascade at each threshold"""
+    positives = max(int(labels.sum()), 1)
+    negatives = max(int((~labels).sum()), 1)
+    full_cost = stages['full_times'].sum()
+    recall_full = (labels & stages['flags']).sum() / positives
+
+    rows = []
+    for threshold in thresholds:
+        escalate = stages['scores'] >= threshold
+        flags = stages['flags'] & escalate
+        cascade_cost = stages['stage1_times'].sum() + stages['full_times'][escalate].sum()
+        recall = (labels & flags).sum() / positives
+        rows.append({
+            'threshold': threshold,
+            'escalation_rate': float(escalate.mean()),
+            'recall_full': float(recall_full),
+            'recall_cascade': float(recall),
+            'recall_lost': float(recall_full - recall),
+            'false_positive_rate': float((~labels & flags).sum() / negatives),
+            'compute_saved': float(1 - cascade_cost / full_cost) if full_cost else 0.0
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the cascade prefilter on a labelled dataset")
+    parser.add_argument('dataset', help="Directory with forbidden/ and benign/ subdirectories")
+    parser.add_argument('--thresholds', default='0.05,0.1,0.15,0.2,0.25',
+                        help="Comma-separated CASCADE_THRESHOLD candidates")
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE)
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    import model_registry
+    thresholds = sorted(float(t) for t in args.thresholds.split(','))
+    paths, labels = load_dataset(args.dataset)
+    print(f"{len(paths)} images ({int(labels.sum())} forbidden, {int((~labels).sum())} benign)")
+
+    stages = run_stages(model_registry.get_moderator(), paths, args.batch_size, thresholds[0])
+    rows = summarize(labels, stages, thresholds)
+
+    print(f"Full detector: {stages['full_times'].mean() * 1000:.1f} ms/image, "
+          f"prefilter: {stages['stage1_times'].mean() * 1000:.1f} ms/image")
+    print(f"{'threshold':>9}  {'escalated':>9}  {'recall':>6}  {'lost':>6}  {'fpr':>6}  {'saved':>6}")
+    for row in rows:
+        print(f"{row['threshold']:9.3f}  {row['escalation_rate']:9.1%}  {row['recall_cascade']:6.1%}  "
+              f"{row['recall_lost']:6.1%}  {row['false_positive_rate']:6.1%}  {row['compute_saved']:6.1%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'dataset': args.dataset,
+                'images': len(paths),
+                'prefilter_ms_per_image': stages['stage1_times'].mean() * 1000,
+                'full_ms_per_image': stages['full_times'].mean() * 1000,
+                'thresholds': rows
+            }, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
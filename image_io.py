@@ -0,0 +1,218 @@
+import io
+import numpy as np
+from config import *
+
+# JPEG start-of-frame markers carrying the image dimensions (C4, C8 and CC
+# are DHT/JPG/DAC, not frames)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(data):
+    """
+    Return (width, height) from a JPEG header without decoding, or None if
+    data is not a JPEG or the header is truncated
+    """
+    view = memoryview(data)
+    if bytes(view[:3]) != b'\xff\xd8\xff':
+        return None
+
+    i = 2
+    while i + 9 <= len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def _uint(view, start: int, length: int, byteorder: str = 'little') -> int:
+    return int.from_bytes(view[start:start + length], byteorder)
+
+
+def sniff_format(data):
+    """
+    Container format from the first bytes of a file: 'jpeg', 'png', 'gif',
+    'webp', 'bmp', 'tiff', 'heif' (HEIC/AVIF), 'mp4' (also MOV/M4V),
+    'matroska' (also WebM), 'avi', or None when it is none of these
+    """
+    head = bytes(memoryview(data)[:16])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        return 'avi'
+    if head.startswith(b'BM') and len(head) >= 14:
+        return 'bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'matroska'
+    if head[4:8] == b'ftyp':
+        return 'heif' if head[8:12] in (b'heic', b'heix', b'mif1', b'msf1', b'avif', b'avis') else 'mp4'
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free'):
+        # QuickTime files without an ftyp box
+        return 'mp4'
+    return None
+
+
+def _tiff_dimensions(view):
+    byteorder = 'little' if bytes(view[:2]) == b'II' else 'big'
+    offset = _uint(view, 4, 4, byteorder)
+    if offset + 2 > len(view):
+        return None
+    width = height = None
+    for entry in range(offset + 2, offset + 2 + 12 * _uint(view, offset, 2, byteorder), 12):
+        if entry + 12 > len(view):
+            return None
+        tag = _uint(view, entry, 2, byteorder)
+        # SHORT (3) values are left-aligned in the 4-byte value field
+        size = 2 if _uint(view, entry + 2, 2, byteorder) == 3 else 4
+        if tag == 256:
+            width = _uint(view, entry + 8, size, byteorder)
+        elif tag == 257:
+            height = _uint(view, entry + 8, size, byteorder)
+        if width is not None and height is not None:
+            return width, height
+    return None
+
+
+def image_dimensions(data, image_format: str = None):
+    """
+    Return (width, height) from an image header without decoding, or None
+    when data is not a supported image or the header is truncated. For
+    animations this is the canvas size.
+    """
+    view = memoryview(data)
+    image_format = image_format or sniff_format(view)
+    if image_format == 'jpeg':
+        return jpeg_dimensions(view)
+    if image_format == 'png' and len(view) >= 24 and bytes(view[12:16]) == b'IHDR':
+        return _uint(view, 16, 4, 'big'), _uint(view, 20, 4, 'big')
+    if image_format == 'gif' and len(view) >= 10:
+        return _uint(view, 6, 2), _uint(view, 8, 2)
+    if image_format == 'bmp' and len(view) >= 26:
+        if _uint(view, 14, 4) == 12:
+            # OS/2 BITMAPCOREHEADER
+            return _uint(view, 18, 2), _uint(view, 20, 2)
+        # Negative heights mean top-down rows
+        return _uint(view, 18, 4), abs(int.from_bytes(view[22:26], 'little', signed=True))
+    if image_format == 'webp' and len(view) >= 30:
+        chunk = bytes(view[12:16])
+        if chunk == b'VP8X':
+            return _uint(view, 24, 3) + 1, _uint(view, 27, 3) + 1
+        if chunk == b'VP8 ' and bytes(view[23:26]) == b'\x9d\x01\x2a':
+            return _uint(view, 26, 2) & 0x3FFF, _uint(view, 28, 2) & 0x3FFF
+        if chunk == b'VP8L' and view[20] == 0x2F:
+            bits = _uint(view, 21, 4)
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        return None
+    if image_format == 'tiff' and len(view) >= 8:
+        return _tiff_dimensions(view)
+    return None
+
+
+def is_animated(data, image_format: str = None) -> bool:
+    """
+    Whether an image header announces an animation: a looping GIF, a WebP
+    with the animation flag or a PNG with an acTL chunk (APNG)
+    """
+    image_format = image_format or sniff_format(data)
+    head = bytes(data)
+    if image_format == 'gif':
+        return b'NETSCAPE2.0' in head or b'ANIMEXTS1.0' in head
+    if image_format == 'webp':
+        return head[12:16] == b'VP8X' and len(head) > 20 and bool(head[20] & 0x02)
+    if image_format == 'png':
+        actl = head.find(b'acTL')
+        idat = head.find(b'IDAT')
+        return actl != -1 and (idat == -1 or actl < idat)
+    return False
+
+
+def check_dimensions(data):
+    """Raise ValueError for images that would decode to more than MAX_IMAGE_PIXELS"""
+    dimensions = image_dimensions(data)
+    if dimensions is not None and dimensions[0] * dimensions[1] > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image too large to decode: {dimensions[0]}x{dimensions[1]} pixels")
+
+
+def reduced_decode_factor(data, target_size: int = INFERENCE_IMAGE_SIZE) -> int:
+    """
+    Largest JPEG DCT scaling factor (1, 2, 4 or 8) that still leaves the long
+    side at least target_size pixels, since the model downsizes to that anyway
+    """
+    dimensions = jpeg_dimensions(data)
+    if dimensions is None:
+        return 1
+    long_side = max(dimensions)
+    for factor in (8, 4, 2):
+        if long_side // factor >= target_size:
+            return factor
+    return 1
+
+
+def decode_image(data, reduced: bool = DECODE_REDUCED_SIZE):
+    """
+    Decode encoded image bytes (bytes, bytearray or memoryview) straight from
+    the buffer with cv2.imdecode. Returns (image, scale): a BGR NumPy array,
+    or an RGB PIL image for formats OpenCV can't read, and the factor that
+    maps coordinates in the decoded image back to the original resolution.
+    """
+    import cv2
+    # A few header bytes stop decompression bombs before any pixels are allocated
+    check_dimensions(data)
+    flags = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+
+    # np.frombuffer wraps the existing buffer, no copy
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    factor = reduced_decode_factor(data) if reduced else 1
+    image = cv2.imdecode(buffer, flags[factor])
+    if image is not None:
+        if factor == 1:
+            return image, 1
+        width, height = jpeg_dimensions(data)
+        return image, max(width, height) / max(image.shape[:2])
+
+    # Formats OpenCV can't decode (e.g. GIF on older builds) go through PIL
+    from PIL import Image
+    return Image.open(io.BytesIO(data)).convert('RGB'), 1
+
+
+def animation_frames(data, max_frames: int = ANIMATION_MAX_FRAMES) -> list:
+    """
+    Decode up to max_frames frames spread evenly over an animated GIF, WebP
+    or PNG. Returns (frame_number, RGB PIL image) pairs; frames are decoded
+    one at a time, so memory stays at one canvas per returned frame.
+    """
+    from PIL import Image
+    check_dimensions(data)
+    animation = Image.open(io.BytesIO(data))
+    total = getattr(animation, 'n_frames', 1)
+    frame_numbers = np.unique(np.linspace(0, total - 1, min(total, max_frames)).round().astype(int))
+    frames = []
+    for frame_number in frame_numbers.tolist():
+        animation.seek(frame_number)
+        frames.append((frame_number, animation.convert('RGB')))
+    return frames
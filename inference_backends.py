@@ -0,0 +1,200 @@
+import numpy as np
+from config import *
+from detections import DetectionSet
+from instrumentation import timer, observe
+
+# Every backend takes a list of images (PIL images in RGB or NumPy arrays in
+# BGR, the same convention ultralytics uses) and returns one DetectionSet per
+# image. ContentModerator only talks to this interface. image_size, threshold
+# and classes let a caller (e.g. the cascade prefilter) run a cheaper pass.
+
+
+class UltralyticsBackend:
+    """Run the PyTorch weights through ultralytics.YOLO"""
+
+    def __init__(self, model_path: str, threads: int = None):
+        # Imported here so the ONNX backend never pays for importing torch
+        import torch
+        from ultralytics import YOLO
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_path)
+
+    def detect(self, images: list, image_size: int = None, threshold: float = CONFIDENCE_THRESHOLD,
+               classes: list = None) -> list:
+        kwargs = {}
+        if image_size:
+            kwargs['imgsz'] = image_size
+        if threshold < NMS_CONFIDENCE_THRESHOLD:
+            # ultralytics drops candidates below its own default otherwise
+            kwargs['conf'] = threshold
+        if classes is not None:
+            kwargs['classes'] = list(classes)
+        batch_results = self.model(images, **kwargs)
+        if batch_results:
+            # ultralytics times its own stages, as milliseconds per image
+            for stage, ms in batch_results[0].speed.items():
+                if ms is not None:
+                    observe(stage, ms * len(batch_results) / 1000)
+        return [DetectionSet.from_results(results, threshold) for results in batch_results]
+
+
+class OnnxBackend:
+    """
+    Run an exported YOLOv8 ONNX model on ONNX Runtime's CPU kernels, with
+    letterbox preprocessing and NMS done in NumPy
+    """
+
+    def __init__(self, model_path: str, image_size: int = INFERENCE_IMAGE_SIZE, threads: int = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        # One graph node at a time; the parallelism is inside each operator
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.image_size = image_size
+        # Models exported without dynamic=True only accept a fixed batch size
+        # and input size
+        batch_dim, height_dim = model_input.shape[0], model_input.shape[2]
+        self.max_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.fixed_size = height_dim if isinstance(height_dim, int) else None
+
+    def detect(self, images: list, image_size: int = None, threshold: float = CONFIDENCE_THRESHOLD,
+               classes: list = None) -> list:
+        image_size = self.fixed_size or image_size or self.image_size
+        outputs = []
+        step = self.max_batch or max(len(images), 1)
+        for start in range(0, len(images), step):
+            batch = images[start:start + step]
+            with timer('preprocess'):
+                tensors, transforms = zip(*[letterbox(image, image_size) for image in batch])
+                tensor = np.stack(tensors)
+            with timer('inference'):
+                predictions = self.session.run(None, {self.input_name: tensor})[0]
+            with timer('postprocess'):
+                for prediction, transform in zip(predictions, transforms):
+                    outputs.append(self._postprocess(prediction, *transform, threshold=threshold, classes=classes))
+        return outputs
+
+    def _postprocess(self, prediction: np.ndarray, gain, pad_x, pad_y, width, height,
+                     threshold: float = CONFIDENCE_THRESHOLD, classes: list = None) -> DetectionSet:
+        """Decode one (4 + classes, anchors) YOLOv8 output into a DetectionSet"""
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        if classes is not None:
+            # Best score among the requested classes only
+            class_map = np.asarray(classes)
+            class_scores = class_scores[:, class_map]
+        class_ids = class_scores.argmax(axis=1)
+        confidences = class_scores[np.arange(len(class_ids)), class_ids]
+        if classes is not None:
+            class_ids = class_map[class_ids]
+
+        candidates = confidences >= min(NMS_CONFIDENCE_THRESHOLD, threshold)
+        boxes = prediction[candidates, :4]
+        class_ids = class_ids[candidates]
+        confidences = confidences[candidates]
+
+        # cx, cy, w, h -> x1, y1, x2, y2
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+
+        keep = non_max_suppression(xyxy, confidences, class_ids, NMS_IOU_THRESHOLD)[:MAX_DETECTIONS]
+        xyxy = xyxy[keep]
+
+        # Undo the letterbox transform back to original image coordinates
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad_x) / gain).clip(0, width)
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad_y) / gain).clip(0, height)
+
+        return DetectionSet(class_ids[keep], confidences[keep], xyxy, threshold)
+
+
+def letterbox(image, image_size: int) -> tuple:
+    """
+    Resize keeping aspect ratio and pad to a square model input. Returns the
+    float32 RGB CHW tensor and (gain, pad_x, pad_y, width, height) to map
+    boxes back. BGR arrays are flipped to RGB during the final float
+    conversion, which copies anyway, so frames are never converted at full
+    resolution.
+    """
+    import cv2
+    from PIL import Image
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert('RGB'))
+        is_bgr = False
+    else:
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        is_bgr = True
+
+    height, width = image.shape[:2]
+    gain = min(image_size / height, image_size / width)
+    new_width, new_height = round(width * gain), round(height * gain)
+    pad_x = (image_size - new_width) / 2
+    pad_y = (image_size - new_height) / 2
+
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((image_size, image_size, 3), 114, dtype=np.uint8)
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    canvas[top:top + new_height, left:left + new_width] = resized
+
+    if is_bgr:
+        canvas = canvas[..., ::-1]
+    tensor = canvas.transpose(2, 0, 1).astype(np.float32) / 255.0
+    return tensor, (gain, left, top, width, height)
+
+
+def non_max_suppression(xyxy: np.ndarray, scores: np.ndarray, class_ids: np.ndarray,
+                        iou_threshold: float, metric: str = 'iou') -> np.ndarray:
+    """
+    Class-aware greedy NMS. Boxes of different classes are shifted apart so
+    one pass suppresses only overlaps within the same class. Returns the
+    indices of kept boxes, highest score first. metric='ios' measures overlap
+    as intersection over the smaller box, which also suppresses partial boxes
+    of an object cut off at a tile border.
+    """
+    if len(xyxy) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    offset_boxes = xyxy + (class_ids.astype(np.float32) * (xyxy.max() + 1))[:, None]
+    x1, y1, x2, y2 = offset_boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        if metric == 'ios':
+            overlap = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        else:
+            overlap = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[overlap <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+BACKENDS = {
+    'ultralytics': UltralyticsBackend,
+    'onnx': OnnxBackend,
+}
+
+
+def create_backend(backend_name: str, model_path: str):
+    """
+    Instantiate the inference backend configured by INFERENCE_BACKEND, with
+    its intra-op threads sized to the cores available
+    """
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend_name}")
+    from inference_profiles import apply_thread_plan
+    return BACKENDS[backend_name](model_path, threads=apply_thread_plan()['inference'])
@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+# Inference is synchronous and CPU-heavy; these helpers keep it off the
+# event loop so one request can't stall every other connection on a worker.
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full; the API answers 429"""
+
+
+class BoundedExecutor:
+    """
+    Run blocking calls on a thread pool, rejecting new work once
+    max_pending calls are queued or running
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def start(self, fn, *args) -> asyncio.Future:
+        """
+        Schedule fn(*args) and return its future. Raises Overloaded right
+        away (not when awaited), so callers can answer 429 before streaming.
+        """
+        if self.pending >= self.max_pending:
+            raise Overloaded("Inference queue is full")
+        # Only touched from the event loop thread, so no lock is needed
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _):
+        self.pending -= 1
+
+    async def run(self, fn, *args):
+        return await self.start(fn, *args)
+
+
+class MicroBatcher:
+    """
+    Collect concurrent single-image requests for up to max_wait_ms and run
+    them through detect_fn (a list of images -> list of results) as one batch
+    """
+
+    def __init__(self, detect_fn, max_batch: int = INFERENCE_BATCH_SIZE,
+                 max_wait_ms: float = API_BATCH_WAIT_MS, max_pending: int = API_MAX_PENDING,
+                 workers: int = API_INFERENCE_WORKERS):
+        self.detect_fn = detect_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._loop = None
+
+    def _ensure_started(self):
+        # Queues belong to an event loop; restart when running under a new
+        # one (e.g. a new Mangum invocation)
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._pending = 0
+        self._slots = asyncio.Semaphore(self.workers)
+        self._collector = loop.create_task(self._collect())
+
+    @property
+    def pending(self) -> int:
+        return self._pending if self._loop is not None else 0
+
+    async def submit(self, image):
+        """Queue one image and wait for its result"""
+        self._ensure_started()
+        if self._pending >= self.max_pending:
+            raise Overloaded("Inference queue is full")
+        self._pending += 1
+        future = self._loop.create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    async def _collect(self):
+        while True:
+            # Don't pull a new batch until a worker is free, so requests keep
+            # accumulating into bigger batches while the model is busy
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        images, futures = zip(*batch)
+        try:
+            results = await self._loop.run_in_executor(self._executor, self.detect_fn, list(images))
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._pending -= len(batch)
+            self._slots.release()
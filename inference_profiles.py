@@ -0,0 +1,88 @@
+import math
+import os
+from config import *
+
+# Inference profiles trade a little accuracy for CPU time: INT8 copies of the
+# ONNX export (written by quantize_model.py) and intra-op thread counts sized
+# to the cores the process actually gets. Lambda allocates vCPUs in proportion
+# to memory, so the right thread count changes with the function's memory size.
+
+PROFILES = ('fp32', 'int8-dynamic', 'int8-static')
+
+
+def profile_model_path(model_path: str, profile: str = INFERENCE_PROFILE) -> str:
+    """Path of model_path's copy for profile, e.g. yolov8n.onnx -> yolov8n.int8-static.onnx"""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown inference profile: {profile}")
+    if profile == 'fp32':
+        return model_path
+    root, ext = os.path.splitext(model_path)
+    return f"{root}.{profile}{ext}"
+
+
+def _cgroup_cpu_quota():
+    """CPU limit of the container in cores, or None when unlimited"""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """Cores this process may run on: its affinity mask, capped by a cgroup CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # macOS/Windows have no affinity API
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def thread_plan(cpus: int = None, inference_threads: int = INFERENCE_THREADS,
+                opencv_threads: int = OPENCV_THREADS) -> dict:
+    """
+    Split the available cores between inference (intra-op) and OpenCV.
+    Inference gets every core unless INFERENCE_THREADS says otherwise;
+    OpenCV gets what is left, at least one thread.
+    """
+    cpus = cpus or available_cpus()
+    inference = inference_threads or cpus
+    return {
+        'cpus': cpus,
+        'inference': inference,
+        'opencv': opencv_threads or max(1, cpus - inference)
+    }
+
+
+_applied_plan = None
+
+
+def apply_thread_plan(plan: dict = None) -> dict:
+    """
+    Apply the OpenCV side of thread_plan() (or of plan, e.g. one worker's
+    share of the cores) once per process and return the plan; backends size
+    their own intra-op pools from plan['inference']
+    """
+    global _applied_plan
+    if _applied_plan is None:
+        import cv2
+        plan = plan or thread_plan()
+        cv2.setNumThreads(plan['opencv'])
+        print(f"CPU threads: {plan['cpus']} available, {plan['inference']} for inference, "
+              f"{plan['opencv']} for OpenCV")
+        _applied_plan = plan
+    return _applied_plan
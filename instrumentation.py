@@ -0,0 +1,259 @@
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from config import *
+
+# Stage timers for the moderation hot path. Timings go to an in-process
+# registry rendered for Prometheus (api_service /metrics) and, in Lambda, to
+# one CloudWatch Embedded Metric Format log line per invocation. With
+# METRICS_ENABLED off, timer() hands out a shared no-op and timed() leaves
+# functions undecorated, so the disabled cost is one attribute lookup.
+
+# Latency buckets in seconds, from sub-millisecond decodes to long videos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EMF_MAX_VALUES = 100  # CloudWatch accepts at most 100 values per metric and line
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus sense"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store for stage histograms, counters and pending EMF values"""
+
+    def __init__(self, emf: bool = METRICS_EMF):
+        self.emf = emf
+        self._histograms = {}
+        self._counters = Counter()
+        self._emf_values = {}
+        self._emf_counts = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if self.emf:
+                values = self._emf_values.setdefault(stage, [])
+                if len(values) < EMF_MAX_VALUES:
+                    values.append(round(seconds * 1000, 3))
+
+    def increment(self, name: str, value: int = 1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+            if self.emf:
+                self._emf_counts[name] += value
+
+    def render_prometheus(self) -> str:
+        """Text exposition format (version 0.0.4)"""
+        lines = [
+            "# HELP moderation_stage_seconds Time spent in each moderation stage",
+            "# TYPE moderation_stage_seconds histogram"
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'moderation_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'moderation_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'moderation_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def flush_emf(self, **dimensions) -> dict:
+        """
+        Build one CloudWatch EMF document from the timings and counters
+        recorded since the last flush, print it and reset the buffer
+        """
+        with self._lock:
+            values, self._emf_values = self._emf_values, {}
+            counts, self._emf_counts = self._emf_counts, Counter()
+        if not values and not counts:
+            return None
+
+        dimensions = dict({'Service': METRICS_SERVICE_NAME}, **dimensions)
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': f"{stage}_ms", 'Unit': 'Milliseconds'} for stage in values] +
+                               [{'Name': name, 'Unit': 'Count'} for name in counts]
+                }]
+            }
+        }
+        document.update(dimensions)
+        document.update({f"{stage}_ms": stage_values for stage, stage_values in values.items()})
+        document.update(counts)
+        # Lambda ships stdout to CloudWatch Logs, which extracts the metrics
+        print(json.dumps(document))
+        return document
+
+
+registry = MetricsRegistry()
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str):
+    """Context manager that records how long its block took under stage"""
+    return _Timer(stage) if METRICS_ENABLED else _NULL_TIMER
+
+
+def timed(stage: str):
+    """Decorator version of timer(); a no-op when metrics are disabled"""
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorate
+
+
+def observe(stage: str, seconds: float):
+    """Record a duration measured elsewhere (e.g. ultralytics' own speed stats)"""
+    if METRICS_ENABLED:
+        registry.observe(stage, seconds)
+
+
+def count(name: str, value: int = 1, **labels):
+    if METRICS_ENABLED:
+        registry.increment(name, value, **labels)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread snapshots every thread's stack
+    each interval seconds and counts identical stacks. Unlike cProfile it
+    doesn't slow the profiled code down. Output is in the folded format that
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {samples}" for stack, samples in self.samples.most_common()) + "\n"
+
+    def save(self, name: str, directory: str = PROFILE_OUTPUT_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        path = os.path.join(directory, f"{safe_name}-{int(time.time() * 1000)}.folded")
+        with open(path, 'w') as f:
+            f.write(self.folded())
+        return path
+
+
+class profile_request:
+    """
+    Profile one request/invocation when force is set or with probability
+    PROFILE_SAMPLE_RATE, then save the folded stacks under PROFILE_OUTPUT_DIR.
+    Does nothing (not even start a thread) for requests that aren't sampled.
+    """
+
+    def __init__(self, name: str, force: bool = False, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.name = name
+        self.profiler = None
+        self.path = None
+        if force or (sample_rate > 0 and random.random() < sample_rate):
+            self.profiler = SamplingProfiler()
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.__exit__(*exc_info)
+            self.path = self.profiler.save(self.name)
+            print(f"Profile for {self.name} ({sum(self.profiler.samples.values())} samples): {self.path}")
+        return False
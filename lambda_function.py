@@ -1,56 +1,156 @@
 import json
-import boto3
-from content_moderator import ContentModerator
+from urllib.parse import unquote_plus
 from config import *
+from instrumentation import registry, timer, profile_request
+
+# Load and warm up the model during the Lambda init phase so the first
+# invocation on a fresh container does not pay for it. Without warm-up the
+# model stack is only imported once an event contains an image.
+if WARMUP_ON_INIT:
+    import model_registry
+    model_registry.warm_up()
 
 def lambda_handler(event: dict, context) -> dict:
     """
-    AWS Lambda function triggered by S3 PutObject events
+    AWS Lambda function triggered by S3 PutObject events (directly or via SQS).
+    Every record in the batch is processed; failed records are reported in
+    batchItemFailures so only they are retried.
     """
+    # Sampled invocations are profiled; stage timings go out as one EMF line
+    with profile_request(getattr(context, 'aws_request_id', None) or 'invocation'), timer('invocation'):
+        response = _handle_event(event)
+    if METRICS_EMF:
+        registry.flush_emf()
+    return response
+
+def _handle_event(event: dict) -> dict:
     try:
-        # Initialize content moderator
-        moderator = ContentModerator()
-        
-        # Process S3 event
-        for record in event['Records']:
-            bucket_name = record['s3']['bucket']['name']
-            object_key = record['s3']['object']['key']
-            
-            # Check if it's an image file
+        results = []
+        images = []
+        videos = []
+        malformed = []
+        for item_id, bucket_name, object_key, etag in _iter_s3_objects(event, malformed):
+            # The extension picks the first path; with PROBE_ENABLED the
+            # object's first bytes decide the rest (see content_probe.py)
             if _is_image_file(object_key):
                 print(f"Processing image: {object_key}")
-                
-                # Process the image
-                result = moderator.handle_s3_image(bucket_name, object_key)
-                
-                print(f"Processing result: {result}")
-                
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({
-                        'message': 'Image processed successfully',
-                        'result': result
-                    })
-                }
+                images.append((item_id, bucket_name, object_key, etag))
+            elif _is_video_file(object_key):
+                print(f"Processing video: {object_key}")
+                videos.append((item_id, bucket_name, object_key, etag))
+            elif PROBE_ENABLED:
+                print(f"Probing file without a media extension: {object_key}")
+                images.append((item_id, bucket_name, object_key, etag))
             else:
-                print(f"Skipping non-image file: {object_key}")
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({
-                        'message': 'File is not an image, skipping processing'
-                    })
-                }
+                print(f"Skipping unsupported file: {object_key}")
+                results.append({
+                    'item_id': item_id,
+                    'key': object_key,
+                    'result': {'action': 'skipped'}
+                })
+        for item_id, error in malformed:
+            print(f"Malformed record {item_id}: {error}")
+            results.append({
+                'item_id': item_id,
+                'key': None,
+                'result': {'action': 'error', 'error': f"Malformed record: {error}"}
+            })
+        
+        batch_results = []
+        if images or videos:
+            import model_registry
+            # Reuse the moderator that lives for the lifetime of the container
+            moderator = model_registry.get_moderator()
+            
+            # Download concurrently and run one batched inference for all
+            # images; the event's ETag lets cached results skip the download
+            if images:
+                batch_results = moderator.handle_s3_images(
+                    [(bucket_name, object_key, etag) for _, bucket_name, object_key, etag in images]
+                )
+            # Videos are streamed from S3 with ranged GETs, one at a time
+            batch_results += [
+                moderator.handle_s3_video(bucket_name, object_key, etag)
+                for _, bucket_name, object_key, etag in videos
+            ]
+            if moderator.result_cache is not None:
+                print(f"Result cache: {moderator.result_cache.stats()}")
+        for (item_id, bucket_name, object_key, etag), result in zip(images + videos, batch_results):
+            print(f"Processing result for {object_key}: {result}")
+            results.append({
+                'item_id': item_id,
+                'key': object_key,
+                'result': result
+            })
+        
+        # Report each failed message once, even if it carried several objects
+        failed_ids = []
+        for r in results:
+            if r['result']['action'] == 'error' and r['item_id'] is not None and r['item_id'] not in failed_ids:
+                failed_ids.append(r['item_id'])
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': f"Processed {len(images)} image(s), {len(videos)} video(s), {len(failed_ids)} failed",
+                'results': results
+            }),
+            'batchItemFailures': [{'itemIdentifier': item_id} for item_id in failed_ids]
+        }
                 
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
+        # SQS takes a response without batchItemFailures as full success and
+        # would delete every message, so report the whole batch as failed
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
-            })
+            }),
+            'batchItemFailures': [
+                {'itemIdentifier': record['messageId']}
+                for record in event.get('Records', []) if 'messageId' in record
+            ]
         }
 
+def _iter_s3_objects(event: dict, malformed: list = None):
+    """
+    Yield (item_id, bucket, key, etag) for every object in an S3 event or an
+    SQS batch of S3 events. item_id is the SQS messageId when there is one.
+    With malformed, a record that can't be parsed is appended to it as
+    (messageId, error) instead of failing the rest of the batch.
+    """
+    for record in event.get('Records', []):
+        try:
+            objects = _record_objects(record)
+        except Exception as e:
+            if malformed is None:
+                raise
+            malformed.append((record.get('messageId'), e))
+            continue
+        yield from objects
+
+def _record_objects(record: dict) -> list:
+    """(item_id, bucket, key, etag) of every object in one event record"""
+    if 'body' in record:
+        # SQS record wrapping an S3 notification (test events have no Records)
+        s3_event = json.loads(record['body'])
+        return [(record['messageId'],) + _s3_object(s3_record) for s3_record in s3_event.get('Records', [])]
+    bucket_name, object_key, etag = _s3_object(record)
+    return [(object_key, bucket_name, object_key, etag)]
+
+def _s3_object(record: dict) -> tuple:
+    """(bucket, key, etag) of an S3 notification record"""
+    return (
+        record['s3']['bucket']['name'],
+        unquote_plus(record['s3']['object']['key']),
+        record['s3']['object'].get('eTag')
+    )
+
 def _is_image_file(filename: str) -> bool:
     """Check if file is an image based on extension"""
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
-    return any(filename.lower().endswith(ext) for ext in image_extensions) 
\ No newline at end of file
+    return any(filename.lower().endswith(ext) for ext in IMAGE_EXTENSIONS) 
+
+def _is_video_file(filename: str) -> bool:
+    """Check if file is a video based on extension"""
+    return any(filename.lower().endswith(ext) for ext in VIDEO_EXTENSIONS)
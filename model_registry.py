@@ -0,0 +1,200 @@
+import threading
+from config import *
+
+# Lambda keeps module state alive in a warm container, so anything expensive
+# to build (model weights, boto3 clients) is created once per process here and
+# shared by the Lambda handler, the API service and the tests.
+_lock = threading.RLock()
+_models = {}
+_clients = {}
+_warmed_up = set()
+_moderator = None
+_result_cache = None
+_result_cache_created = False
+_phash_index = None
+_phash_index_created = False
+_action_executor = None
+_policy_engine = None
+
+
+def default_model_path(backend_name: str = INFERENCE_BACKEND) -> str:
+    """Weights file used by a backend when no explicit path is given"""
+    if backend_name == 'onnx':
+        from inference_profiles import profile_model_path
+        return profile_model_path(ONNX_MODEL_PATH)
+    if INFERENCE_PROFILE != 'fp32':
+        raise ValueError(f"Inference profile {INFERENCE_PROFILE} needs the onnx backend")
+    return MODEL_PATH
+
+
+def get_model(model_path: str = None, backend_name: str = INFERENCE_BACKEND):
+    """
+    Return the inference backend for model_path, loading it on first use
+    """
+    model_path = model_path or default_model_path(backend_name)
+    key = (backend_name, model_path)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            try:
+                # Initialize YOLO model - will download automatically if not present
+                print(f"Loading YOLO model from: {model_path} ({backend_name} backend)")
+                from inference_backends import create_backend
+                model = create_backend(backend_name, model_path)
+                print("YOLO model loaded successfully!")
+            except Exception as e:
+                print(f"Error loading YOLO model: {e}")
+                raise
+            _models[key] = model
+    return model
+
+
+def get_client(service_name: str):
+    """
+    Return a pooled boto3 client for service_name (boto3 clients are thread-safe)
+    """
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.client(
+                service_name,
+                region_name=AWS_REGION,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+            )
+            _clients[service_name] = client
+    return client
+
+
+def get_moderator():
+    """
+    Return the process-wide ContentModerator, creating it on first use
+    """
+    global _moderator
+    if _moderator is not None:
+        return _moderator
+
+    with _lock:
+        if _moderator is None:
+            # Imported here because content_moderator itself uses this registry
+            from content_moderator import ContentModerator
+            _moderator = ContentModerator()
+    return _moderator
+
+
+def get_result_cache():
+    """
+    Return the process-wide detection result cache, or None when disabled
+    """
+    global _result_cache, _result_cache_created
+    if _result_cache_created:
+        return _result_cache
+
+    with _lock:
+        if not _result_cache_created:
+            from result_cache import create_result_cache
+            _result_cache = create_result_cache()
+            _result_cache_created = True
+    return _result_cache
+
+
+def get_phash_index():
+    """
+    Return the process-wide near-duplicate index (loaded from
+    PHASH_INDEX_PATH when a saved copy exists), or None when disabled
+    """
+    global _phash_index, _phash_index_created
+    if _phash_index_created:
+        return _phash_index
+
+    with _lock:
+        if not _phash_index_created:
+            if PHASH_INDEX_ENABLED:
+                import os
+                from phash_index import NearDuplicateIndex
+                from result_cache import CONFIG_FINGERPRINT
+                if PHASH_INDEX_PATH and os.path.exists(PHASH_INDEX_PATH):
+                    _phash_index = NearDuplicateIndex.load(PHASH_INDEX_PATH, config_fingerprint=CONFIG_FINGERPRINT)
+                else:
+                    _phash_index = NearDuplicateIndex(config_fingerprint=CONFIG_FINGERPRINT)
+            _phash_index_created = True
+    return _phash_index
+
+
+def get_action_executor():
+    """
+    Return the process-wide ActionExecutor, whose thread pool, idempotency
+    memory and pending alert digest outlive a single invocation
+    """
+    global _action_executor
+    if _action_executor is not None:
+        return _action_executor
+
+    with _lock:
+        if _action_executor is None:
+            from action_executor import ActionExecutor
+            _action_executor = ActionExecutor(get_client)
+    return _action_executor
+
+
+def get_policy_engine():
+    """
+    Return the process-wide PolicyEngine; policy reloads happen inside it
+    and never touch the loaded models
+    """
+    global _policy_engine
+    if _policy_engine is not None:
+        return _policy_engine
+
+    with _lock:
+        if _policy_engine is None:
+            from moderation_policy import PolicyEngine
+            _policy_engine = PolicyEngine(client_fn=get_client)
+    return _policy_engine
+
+
+def warm_up(model_path: str = None, backend_name: str = INFERENCE_BACKEND):
+    """
+    Load the model and run one dummy inference so the first real request
+    does not pay the graph/kernel setup cost
+    """
+    model_path = model_path or default_model_path(backend_name)
+    key = (backend_name, model_path)
+    model = get_model(model_path, backend_name)
+    if key in _warmed_up:
+        return model
+
+    with _lock:
+        if key not in _warmed_up:
+            import numpy as np
+            dummy = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+            model.detect([dummy])
+            _warmed_up.add(key)
+            print(f"Model warmed up: {model_path}")
+    return model
+
+
+def reset():
+    """Drop every cached model, client and moderator (used by tests)"""
+    global _moderator, _result_cache, _result_cache_created, _phash_index, _phash_index_created, _action_executor
+    global _policy_engine
+    with _lock:
+        _models.clear()
+        _clients.clear()
+        _warmed_up.clear()
+        _moderator = None
+        _result_cache = None
+        _result_cache_created = False
+        _phash_index = None
+        _phash_index_created = False
+        _action_executor = None
+        _policy_engine = None
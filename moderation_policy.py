@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from config import *
+
+# The moderation policy decides which detections make an object forbidden.
+# A policy file (JSON, local path or s3://bucket/key) looks like:
+#
+#   {
+#     "threshold": 0.5,                        # reporting threshold, other classes
+#     "classes": {                              # forbidden on their own
+#       "knife": {"threshold": 0.4, "min_area": 1024},
+#       "scissors": {"threshold": 0.6}
+#     },
+#     "rules": [                                # forbidden only together
+#       {"name": "knife-with-person", "all_of": ["knife", "person"], "threshold": 0.3}
+#     ],
+#     "overrides": [                            # per bucket/prefix, most specific wins
+#       {"bucket": "kids-uploads", "prefix": "avatars/",
+#        "classes": {"scissors": {"threshold": 0.3}, "knife": null}}
+#     ]
+#   }
+#
+# Classes are COCO names or ids; min_area is in pixels of the original
+# image. Overrides extend the top-level policy: their classes replace or (with
+# null) remove entries, their rules are added. Every scope is compiled into
+# per-class NumPy tables once, so evaluating an image is a few array gathers
+# over its detections. The file is re-read when it changes (checked every
+# POLICY_RELOAD_INTERVAL seconds); models are never reloaded for it.
+
+_NUM_CLASSES = max(CLASS_NAMES) + 1
+_CLASS_IDS = {name: class_id for class_id, name in CLASS_NAMES.items()}
+
+
+def default_policy_spec() -> dict:
+    """The policy config.py implies: FORBIDDEN_CLASSES at CONFIDENCE_THRESHOLD"""
+    return {
+        'threshold': CONFIDENCE_THRESHOLD,
+        'classes': {CLASS_NAMES[class_id]: {'threshold': CONFIDENCE_THRESHOLD} for class_id in FORBIDDEN_CLASSES}
+    }
+
+
+def _class_id(name) -> int:
+    if isinstance(name, int) or str(name).isdigit():
+        class_id = int(name)
+        if class_id not in CLASS_NAMES:
+            raise ValueError(f"Unknown class id in policy: {class_id}")
+        return class_id
+    if name not in _CLASS_IDS:
+        raise ValueError(f"Unknown class in policy: {name}")
+    return _CLASS_IDS[name]
+
+
+class CompiledPolicy:
+    """
+    One policy scope as lookup tables indexed by class id. The extra last
+    row stands for class ids the model may produce outside CLASS_NAMES.
+    """
+
+    def __init__(self, spec: dict, name: str = 'default'):
+        self.name = name
+        self.fingerprint = hashlib.blake2b(json.dumps(spec, sort_keys=True).encode(), digest_size=8).hexdigest()
+        default_threshold = float(spec.get('threshold', CONFIDENCE_THRESHOLD))
+
+        self.report_thresholds = np.full(_NUM_CLASSES + 1, default_threshold, dtype=np.float32)
+        self.forbidden_thresholds = np.full(_NUM_CLASSES + 1, np.inf, dtype=np.float32)
+        self.min_areas = np.zeros(_NUM_CLASSES + 1, dtype=np.float32)
+        for class_name, options in spec.get('classes', {}).items():
+            if options is None:
+                continue
+            class_id = _class_id(class_name)
+            threshold = float(options.get('threshold', default_threshold))
+            self.forbidden_thresholds[class_id] = threshold
+            self.min_areas[class_id] = float(options.get('min_area', 0))
+            self.report_thresholds[class_id] = min(self.report_thresholds[class_id], threshold)
+
+        rules = spec.get('rules', [])
+        self.rule_names = [rule.get('name', '+'.join(map(str, rule['all_of']))) for rule in rules]
+        # (rules, classes): confidence a class needs to count towards a rule,
+        # inf for classes the rule doesn't involve
+        self.rule_thresholds = np.full((len(rules), _NUM_CLASSES + 1), np.inf, dtype=np.float32)
+        for i, rule in enumerate(rules):
+            if len(rule['all_of']) < 2:
+                raise ValueError(f"Rule {self.rule_names[i]} needs at least two classes")
+            threshold = float(rule.get('threshold', default_threshold))
+            for class_name in rule['all_of']:
+                class_id = _class_id(class_name)
+                self.rule_thresholds[i, class_id] = threshold
+                self.report_thresholds[class_id] = min(self.report_thresholds[class_id], threshold)
+        self.rule_required = np.isfinite(self.rule_thresholds)
+
+        # Lowest confidence any decision or report needs: the threshold to
+        # run the model at
+        self.floor = float(self.report_thresholds.min())
+        # Classes that can contribute to a forbidden verdict (for the cascade)
+        watched = np.isfinite(self.forbidden_thresholds) | self.rule_required.any(axis=0)
+        self.classes = np.flatnonzero(watched[:_NUM_CLASSES]).tolist()
+
+    def evaluate(self, class_ids: np.ndarray, confidences: np.ndarray, xyxy: np.ndarray) -> tuple:
+        """
+        Return (keep, forbidden) boolean masks over the detections: which are
+        reported and which of those make the image forbidden
+        """
+        ids = np.where((class_ids >= 0) & (class_ids < _NUM_CLASSES), class_ids, _NUM_CLASSES)
+        keep = confidences >= self.report_thresholds[ids]
+        areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        forbidden = (confidences >= self.forbidden_thresholds[ids]) & (areas >= self.min_areas[ids])
+
+        if len(self.rule_names) and len(ids):
+            # (rules, detections): detection counts towards the rule
+            meets = confidences[None, :] >= self.rule_thresholds[:, ids]
+            present = np.zeros_like(self.rule_required)
+            rule_index, detection_index = np.nonzero(meets)
+            present[rule_index, ids[detection_index]] = True
+            fired = (present | ~self.rule_required).all(axis=1)
+            forbidden |= meets[fired].any(axis=0)
+        return keep, forbidden & keep
+
+
+def _merge(base: dict, override: dict) -> dict:
+    classes = dict(base.get('classes', {}))
+    classes.update(override.get('classes', {}))
+    return {
+        'threshold': override.get('threshold', base.get('threshold', CONFIDENCE_THRESHOLD)),
+        'classes': {name: options for name, options in classes.items() if options is not None},
+        'rules': base.get('rules', []) + override.get('rules', [])
+    }
+
+
+class PolicySet:
+    """A compiled policy file: the default scope plus bucket/prefix overrides"""
+
+    def __init__(self, spec: dict):
+        self.default = CompiledPolicy(spec)
+        self.overrides = []
+        for override in spec.get('overrides', []):
+            if 'bucket' not in override and 'prefix' not in override:
+                raise ValueError("Policy overrides need a bucket and/or prefix")
+            name = f"{override.get('bucket', '*')}/{override.get('prefix', '')}"
+            self.overrides.append((override.get('bucket'), override.get('prefix', ''),
+                                   CompiledPolicy(_merge(spec, override), name)))
+        # Most specific first: bucket-bound before bucket-wide, longer prefixes first
+        self.overrides.sort(key=lambda item: (item[0] is None, -len(item[1])))
+        self.scopes = [self.default] + [policy for _, _, policy in self.overrides]
+
+    def resolve(self, bucket_name: str = None, object_key: str = None) -> CompiledPolicy:
+        for bucket, prefix, policy in self.overrides:
+            if bucket in (None, bucket_name) and (object_key or '').startswith(prefix):
+                return policy
+        return self.default
+
+
+class PolicyEngine:
+    """
+    Loads the policy file, compiles it and swaps in a new PolicySet when the
+    file changes. A broken update is reported and the last good policy stays
+    in effect.
+    """
+
+    def __init__(self, source: str = POLICY_PATH, reload_interval: float = POLICY_RELOAD_INTERVAL,
+                 client_fn=None):
+        self.source = source
+        self.reload_interval = reload_interval
+        self._client_fn = client_fn
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.policies = PolicySet(default_policy_spec())
+        if source:
+            self.reload()
+
+    def current(self) -> PolicySet:
+        """The active PolicySet, re-reading the source when it is due for a check"""
+        if self.source and time.time() - self._checked >= self.reload_interval:
+            # Only one thread checks; the others keep using the current policy
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.reload()
+                finally:
+                    self._lock.release()
+        return self.policies
+
+    def resolve(self, bucket_name: str = None, object_key: str = None) -> CompiledPolicy:
+        return self.current().resolve(bucket_name, object_key)
+
+    def reload(self, force: bool = False) -> bool:
+        """Compile the source if it changed since the last load; True when a new policy took effect"""
+        self._checked = time.time()
+        try:
+            version = self._source_version()
+            if version == self._version and not force:
+                return False
+            policies = PolicySet(self._read())
+        except Exception as e:
+            print(f"Error loading moderation policy from {self.source}, keeping the current one: {e}")
+            return False
+        self.policies = policies
+        self._version = version
+        print(f"Moderation policy loaded from {self.source} ({len(policies.scopes)} scope(s), "
+              f"{policies.default.fingerprint})")
+        return True
+
+    def _s3_location(self) -> tuple:
+        bucket, _, key = self.source[len('s3://'):].partition('/')
+        return bucket, key
+
+    def _s3_client(self):
+        if self._client_fn is not None:
+            return self._client_fn('s3')
+        from model_registry import get_client
+        return get_client('s3')
+
+    def _source_version(self):
+        if self.source.startswith('s3://'):
+            bucket, key = self._s3_location()
+            return self._s3_client().head_object(Bucket=bucket, Key=key)['ETag']
+        stat = os.stat(self.source)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> dict:
+        if self.source.startswith('s3://'):
+            bucket, key = self._s3_location()
+            return json.loads(self._s3_client().get_object(Bucket=bucket, Key=key)['Body'].read())
+        with open(self.source) as f:
+            return json.load(f)
@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+import numpy as np
+from config import *
+
+# Bits set in each byte value, for vectorized popcount of uint64 XORs
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes: np.ndarray, image_hash: int) -> np.ndarray:
+    """Hamming distance between every uint64 in hashes and image_hash"""
+    xor = np.bitwise_xor(hashes, np.uint64(image_hash))
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _low_frequencies(gray: np.ndarray) -> np.ndarray:
+    """The 8x8 lowest DCT terms of a 32x32 downscale, DC first"""
+    import cv2
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return cv2.dct(small)[:8, :8].reshape(-1)
+
+
+def texture(gray: np.ndarray) -> float:
+    """
+    RMS contrast, in grey levels, of the detail phash looks at (its AC
+    terms). Close to 0 for blank and near-flat images, whose hashes carry
+    almost no information and collide with each other.
+    """
+    # The DCT is orthonormal, so this is the RMS over the 32x32 pixels
+    return float(np.sqrt(np.sum(_low_frequencies(gray)[1:] ** 2))) / 32
+
+
+def phash(gray: np.ndarray) -> int:
+    """
+    64-bit DCT perceptual hash of a grayscale image. Robust to resizing and
+    recompression, which is what re-encoded reposts go through.
+    """
+    low_frequencies = _low_frequencies(gray)
+    # Median without the DC term so overall brightness doesn't dominate
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash (cheaper than phash, less robust to crops)"""
+    import cv2
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_hash(image_data, algorithm: str = PHASH_ALGORITHM, min_texture: float = PHASH_MIN_TEXTURE):
+    """
+    Perceptual hash of encoded image bytes. Decodes straight to grayscale,
+    at reduced size for large JPEGs, since the hash only needs 32x32 pixels.
+    Returns None for images with less than min_texture detail, which can't
+    be told apart by their hashes.
+    """
+    import cv2
+    from image_io import check_dimensions, reduced_decode_factor
+    flags = {
+        1: cv2.IMREAD_GRAYSCALE,
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+    # Without PROBE_ENABLED nothing has checked the header for bombs yet
+    check_dimensions(image_data)
+    buffer = np.frombuffer(image_data, dtype=np.uint8)
+    gray = cv2.imdecode(buffer, flags[reduced_decode_factor(image_data, target_size=128)])
+    if gray is None:
+        raise ValueError("Could not decode image for perceptual hashing")
+    if texture(gray) < min_texture:
+        return None
+    return dhash(gray) if algorithm == 'dhash' else phash(gray)
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes. Each hash is split into chunks
+    with one lookup table per chunk; by the pigeonhole principle anything
+    within radius r differs by at most r // chunks bits in some chunk, so a
+    search only probes chunk values that close and verifies the candidates
+    with a vectorized popcount. Lookups stay sublinear in the index size.
+    """
+
+    def __init__(self, chunks: int = 4):
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self._tables = [{} for _ in range(chunks)]
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._size = 0
+        self._probe_masks = {}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self._hashes[:self._size]
+
+    def _chunk_values(self, image_hash: int):
+        mask = (1 << self.chunk_bits) - 1
+        return [(image_hash >> (c * self.chunk_bits)) & mask for c in range(self.chunks)]
+
+    def add(self, image_hash: int) -> int:
+        """Add a hash and return its id"""
+        if self._size == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.empty_like(self._hashes)])
+        entry_id = self._size
+        self._hashes[entry_id] = image_hash
+        self._size += 1
+        for table, value in zip(self._tables, self._chunk_values(image_hash)):
+            table.setdefault(value, []).append(entry_id)
+        return entry_id
+
+    def search(self, image_hash: int, radius: int) -> tuple:
+        """Return (ids, distances) of every hash within radius"""
+        masks = self._masks(radius // self.chunks)
+        candidates = set()
+        for table, value in zip(self._tables, self._chunk_values(image_hash)):
+            for mask in masks:
+                candidates.update(table.get(value ^ mask, ()))
+
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        distances = hamming_distances(self._hashes[ids], image_hash)
+        within = distances <= radius
+        return ids[within], distances[within]
+
+    def _masks(self, sub_radius: int) -> list:
+        """Every chunk-sized bit mask with at most sub_radius bits set"""
+        if sub_radius not in self._probe_masks:
+            masks = [0]
+            for _ in range(sub_radius):
+                masks = list({m | (1 << b) for m in masks for b in range(self.chunk_bits)} | set(masks))
+            self._probe_masks[sub_radius] = masks
+        return self._probe_masks[sub_radius]
+
+
+class NearDuplicateIndex:
+    """
+    Perceptual hashes of previously moderated images with their verdicts.
+    A near-match of a forbidden image is quarantined without inference; a
+    near-match of a verified image can skip inference when allowed by policy.
+
+    A verdict only holds for the model, config and moderation policy that
+    made it, so every entry carries a fingerprint of those and only matches
+    lookups with the same fingerprint. A saved index is discarded on load
+    when config_fingerprint (model and config) has changed since.
+    """
+
+    def __init__(self, forbidden_distance: int = PHASH_FORBIDDEN_DISTANCE,
+                 verified_distance: int = PHASH_VERIFIED_DISTANCE,
+                 skip_verified: bool = PHASH_SKIP_VERIFIED, config_fingerprint: str = ''):
+        self.forbidden_distance = forbidden_distance
+        self.verified_distance = verified_distance
+        self.skip_verified = skip_verified
+        self.config_fingerprint = config_fingerprint
+        self._index = HammingIndex()
+        self._forbidden = []
+        self._keys = []
+        self._fingerprints = []
+        self._lock = threading.Lock()
+        self.dirty = False
+        self.last_saved = 0.0
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, image_hash: int, forbidden: bool, object_key: str, fingerprint: str = ''):
+        with self._lock:
+            self._index.add(image_hash)
+            self._forbidden.append(forbidden)
+            self._keys.append(object_key)
+            self._fingerprints.append(fingerprint)
+            self.dirty = True
+
+    def match(self, image_hash: int, fingerprint: str = ''):
+        """
+        Return {'forbidden', 'near_duplicate_of', 'distance'} for the closest
+        entry with this fingerprint that policy allows to decide this image,
+        or None
+        """
+        radius = max(self.forbidden_distance, self.verified_distance if self.skip_verified else -1)
+        with self._lock:
+            ids, distances = self._index.search(image_hash, radius)
+            current = np.array([self._fingerprints[i] == fingerprint for i in ids.tolist()], dtype=bool)
+            ids, distances = ids[current], distances[current]
+            forbidden = np.array([self._forbidden[i] for i in ids.tolist()], dtype=bool)
+
+            # Known-forbidden matches win over verified ones
+            allowed = forbidden & (distances <= self.forbidden_distance)
+            if not allowed.any() and self.skip_verified:
+                allowed = ~forbidden & (distances <= self.verified_distance)
+            if not allowed.any():
+                return None
+
+            best = np.flatnonzero(allowed)[distances[allowed].argmin()]
+            return {
+                'forbidden': bool(forbidden[best]),
+                'near_duplicate_of': self._keys[ids[best]],
+                'distance': int(distances[best])
+            }
+
+    def retain(self, fingerprints) -> int:
+        """Drop every entry whose fingerprint is not in fingerprints; returns how many"""
+        with self._lock:
+            keep = [i for i, fingerprint in enumerate(self._fingerprints) if fingerprint in fingerprints]
+            dropped = len(self._fingerprints) - len(keep)
+            if dropped:
+                hashes = self._index.hashes
+                self._index = HammingIndex()
+                for i in keep:
+                    self._index.add(int(hashes[i]))
+                self._forbidden = [self._forbidden[i] for i in keep]
+                self._keys = [self._keys[i] for i in keep]
+                self._fingerprints = [self._fingerprints[i] for i in keep]
+                self.dirty = True
+            return dropped
+
+    def save(self, path: str):
+        """Persist to a local .npz file (written atomically)"""
+        with self._lock:
+            tmp_path = path + '.tmp.npz'
+            np.savez(
+                tmp_path,
+                hashes=self._index.hashes,
+                forbidden=np.array(self._forbidden, dtype=bool),
+                keys=np.array(self._keys, dtype=str),
+                fingerprints=np.array(self._fingerprints, dtype=str),
+                config_fingerprint=np.array(self.config_fingerprint)
+            )
+            os.replace(tmp_path, path)
+            self.dirty = False
+            self.last_saved = time.time()
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        """
+        Load a saved index. Indexes saved under another config_fingerprint
+        (or before entries had fingerprints) start over empty.
+        """
+        index = cls(**kwargs)
+        with np.load(path) as data:
+            saved_fingerprint = str(data['config_fingerprint']) if 'config_fingerprint' in data else None
+            if saved_fingerprint != index.config_fingerprint:
+                print(f"Discarding near-duplicate index {path}: saved under another model/config")
+                return index
+            for image_hash, forbidden, object_key, fingerprint in zip(
+                data['hashes'].tolist(), data['forbidden'].tolist(), data['keys'].tolist(),
+                data['fingerprints'].tolist()
+            ):
+                index.add(image_hash, forbidden, object_key, fingerprint)
+        index.dirty = False
+        return index
@@ -0,0 +1,273 @@
+"""
+Build the INT8 inference profiles (INFERENCE_PROFILE in config.py) from the
+FP32 ONNX export and report their accuracy and latency against it.
+
+  int8-dynamic  weights quantized offline, activations at run time; needs
+                no calibration data
+  int8-static   weights and activations quantized offline (QDQ format),
+                with activation ranges calibrated on local sample images.
+                The box/score decoding at the end of the YOLOv8 head stays
+                FP32: box coordinates and class scores share one output
+                tensor, and a single INT8 scale cannot represent both.
+
+Quantized models are written next to the input as <name>.<profile>.onnx,
+which is where the onnx backend looks for them. The report runs every
+model over --eval images (default: the calibration images) and compares
+detections with the FP32 model's: precision/recall of matching boxes
+(same class, IoU >= 0.5), verdict agreement and per-image latency.
+
+Usage:
+    python quantize_model.py yolov8n.onnx --calibration ./samples --output quantization.json
+    python quantize_model.py yolov8n.onnx --profiles int8-static --calibration ./samples \\
+        --eval ./eval_images --threads 2
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+import numpy as np
+from config import *
+from inference_profiles import profile_model_path
+
+
+def list_images(directory: str, limit: int = None) -> list:
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    return paths[:limit] if limit else paths
+
+
+def _read_image(path: str):
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not read image: {path}")
+    return image
+
+
+def detection_head_nodes(model, include_convs: bool = False) -> list:
+    """
+    Names of the nodes in the last '/model.<N>/' module of an ultralytics
+    export (the Detect head). By default only its decoding ops and the DFL
+    conv, not the box/class branch convs, which quantize well.
+    """
+    modules = [re.match(r'/model\.(\d+)/', node.name) for node in model.graph.node]
+    indices = [int(match.group(1)) for match in modules if match]
+    if not indices:
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [
+        node.name for node in model.graph.node
+        if node.name.startswith(prefix) and (include_convs or node.op_type != 'Conv' or '/dfl/' in node.name)
+    ]
+
+
+class ImageCalibrationReader:
+    """
+    Calibration data reader (the CalibrationDataReader interface) feeding
+    letterboxed sample images, preprocessed exactly as the onnx backend does
+    """
+
+    def __init__(self, paths: list, input_name: str, image_size: int = INFERENCE_IMAGE_SIZE):
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.image_size = image_size
+
+    def get_next(self):
+        from inference_backends import letterbox
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        tensor, _ = letterbox(_read_image(path), self.image_size)
+        return {self.input_name: tensor[None]}
+
+
+def quantize(model_path: str, profile: str, calibration_paths: list = None,
+             method: str = 'minmax', output_path: str = None) -> str:
+    """Write the profile's INT8 copy of model_path and return its path"""
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    output_path = output_path or profile_model_path(model_path, profile)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Shape inference and graph fusions first, as ONNX Runtime recommends
+        prepared = os.path.join(tmp_dir, 'prepared.onnx')
+        try:
+            quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"Pre-processing failed, quantizing the model as exported: {e}")
+            prepared = model_path
+
+        if profile == 'int8-dynamic':
+            # ConvInteger on the CPU provider only takes uint8 weights
+            quantize_dynamic(prepared, output_path, weight_type=QuantType.QUInt8)
+        elif profile == 'int8-static':
+            if not calibration_paths:
+                raise ValueError("int8-static needs calibration images")
+            model = onnx.load(prepared)
+            quantize_static(
+                prepared, output_path, ImageCalibrationReader(calibration_paths, model.graph.input[0].name),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                calibrate_method={
+                    'minmax': CalibrationMethod.MinMax,
+                    'entropy': CalibrationMethod.Entropy,
+                    'percentile': CalibrationMethod.Percentile
+                }[method],
+                nodes_to_exclude=detection_head_nodes(model)
+            )
+        else:
+            raise ValueError(f"Not a quantized profile: {profile}")
+    return output_path
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of (N, 4) and (M, 4) xyxy boxes"""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_detections(reference, candidate, iou_threshold: float = 0.5) -> tuple:
+    """
+    Greedily match candidate detections to reference ones of the same class,
+    highest confidence first. Returns (matches, confidence deltas).
+    """
+    if not len(reference) or not len(candidate):
+        return 0, []
+    iou = box_iou(candidate.xyxy, reference.xyxy)
+    iou[candidate.class_ids[:, None] != reference.class_ids[None, :]] = 0
+    used = np.zeros(len(reference), dtype=bool)
+    deltas = []
+    for i in np.argsort(-candidate.confidences):
+        overlaps = np.where(used, 0, iou[i])
+        j = int(overlaps.argmax())
+        if overlaps[j] >= iou_threshold:
+            used[j] = True
+            deltas.append(float(candidate.confidences[i] - reference.confidences[j]))
+    return len(deltas), deltas
+
+
+def evaluate(model_path: str, images: list, threads: int = None, batch_size: int = INFERENCE_BATCH_SIZE,
+             threshold: float = CONFIDENCE_THRESHOLD) -> dict:
+    """Detections, per-image latency and batched throughput of one model"""
+    from inference_backends import OnnxBackend
+    backend = OnnxBackend(model_path, threads=threads)
+    backend.detect(images[:1])  # warm-up
+
+    detections = []
+    latencies = []
+    for image in images:
+        start = time.perf_counter()
+        detections.extend(backend.detect([image], threshold=threshold))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for batch_start in range(0, len(images), batch_size):
+        backend.detect(images[batch_start:batch_start + batch_size])
+    batch_s = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'detections': detections,
+        'size_mb': os.path.getsize(model_path) / 1e6,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p90_ms': float(np.percentile(latencies_ms, 90)),
+        'images_per_s': len(images) / batch_s
+    }
+
+
+def compare(reference: dict, candidate: dict) -> dict:
+    """Accuracy of candidate's detections relative to the FP32 reference"""
+    matched = reference_total = candidate_total = agree = 0
+    deltas = []
+    for ref, cand in zip(reference['detections'], candidate['detections']):
+        count, image_deltas = match_detections(ref, cand)
+        matched += count
+        deltas.extend(image_deltas)
+        reference_total += len(ref)
+        candidate_total += len(cand)
+        agree += ref.has_forbidden_content == cand.has_forbidden_content
+    images = len(reference['detections'])
+    return {
+        'precision_vs_fp32': matched / candidate_total if candidate_total else 1.0,
+        'recall_vs_fp32': matched / reference_total if reference_total else 1.0,
+        'verdict_agreement': agree / images if images else 1.0,
+        'mean_abs_confidence_delta': float(np.abs(deltas).mean()) if deltas else 0.0,
+        'detections': candidate_total,
+        'speedup_p50': reference['p50_ms'] / candidate['p50_ms'],
+        'speedup_throughput': candidate['images_per_s'] / reference['images_per_s']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build INT8 inference profiles and compare them with FP32")
+    parser.add_argument('model', help="FP32 ONNX export (train.py)")
+    parser.add_argument('--profiles', default='int8-dynamic,int8-static', type=lambda s: s.split(','))
+    parser.add_argument('--calibration', help="Directory of representative images for int8-static")
+    parser.add_argument('--calibration-limit', type=int, default=200, help="Calibration images to use")
+    parser.add_argument('--method', choices=('minmax', 'entropy', 'percentile'), default='minmax',
+                        help="Activation range calibration")
+    parser.add_argument('--eval', help="Directory of evaluation images (default: calibration images)")
+    parser.add_argument('--eval-limit', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=None, help="Intra-op threads (default: thread_plan)")
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE)
+    parser.add_argument('--threshold', type=float, default=CONFIDENCE_THRESHOLD,
+                        help="Confidence threshold for the comparison; lower it to compare more boxes")
+    parser.add_argument('--skip-quantize', action='store_true', help="Only report on existing profile models")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    calibration_paths = list_images(args.calibration, args.calibration_limit) if args.calibration else []
+    models = {'fp32': args.model}
+    for profile in args.profiles:
+        if args.skip_quantize:
+            models[profile] = profile_model_path(args.model, profile)
+            continue
+        print(f"Quantizing {args.model} ({profile})...")
+        models[profile] = quantize(args.model, profile, calibration_paths, args.method)
+        print(f"  wrote {models[profile]}")
+
+    eval_dir = args.eval or args.calibration
+    if not eval_dir:
+        print("No --eval or --calibration images, skipping the accuracy report")
+        return
+    from inference_profiles import thread_plan
+    threads = args.threads or thread_plan()['inference']
+    images = [_read_image(path) for path in list_images(eval_dir, args.eval_limit)]
+
+    results = {
+        profile: evaluate(path, images, threads, args.batch_size, args.threshold)
+        for profile, path in models.items()
+    }
+    report = {'images': len(images), 'threads': threads, 'threshold': args.threshold, 'profiles': {}}
+    for profile, result in results.items():
+        entry = {key: value for key, value in result.items() if key != 'detections'}
+        entry['model'] = models[profile]
+        if profile != 'fp32':
+            entry.update(compare(results['fp32'], result))
+        report['profiles'][profile] = entry
+        print(f"{profile:13s} {entry['size_mb']:6.1f} MB  p50 {entry['p50_ms']:7.1f} ms  "
+              f"{entry['images_per_s']:6.1f} img/s" + (
+                  f"  recall {entry['recall_vs_fp32']:.3f}  precision {entry['precision_vs_fp32']:.3f}  "
+                  f"verdicts {entry['verdict_agreement']:.3f}" if profile != 'fp32' else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
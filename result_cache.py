@@ -0,0 +1,147 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import *
+
+# Anything that changes what the model would answer is part of every cache
+# key, so changing weights, backend, threshold or forbidden classes
+# invalidates old entries without having to clear the cache.
+CONFIG_FINGERPRINT = hashlib.blake2b(json.dumps([
+    MODEL_VERSION,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_PATH if INFERENCE_BACKEND == 'onnx' else MODEL_PATH,
+    INFERENCE_PROFILE,
+    CONFIDENCE_THRESHOLD,
+    sorted(FORBIDDEN_CLASSES),
+    DECODE_REDUCED_SIZE,
+    [TILING_ENABLED, TILING_TILE_SIZE, TILING_OVERLAP, TILING_MIN_SIZE, TILING_MAX_TILES],
+    [CASCADE_ENABLED, CASCADE_IMAGE_SIZE, CASCADE_THRESHOLD, CASCADE_MODEL_PATH],
+]).encode(), digest_size=8).hexdigest()
+
+
+def content_id(data=None, etag: str = None) -> str:
+    """
+    Identify content by its S3 ETag when available, otherwise by a fast
+    BLAKE2 hash of the bytes
+    """
+    if etag:
+        return 'etag:' + etag.strip('"')
+    return 'blake2b:' + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cache_key(content: str, policy_fingerprint: str = '') -> str:
+    # The moderation policy can change at run time, so it is keyed separately
+    return f"{content}:{CONFIG_FINGERPRINT}:{policy_fingerprint}"
+
+
+class _CounterMixin:
+    """Hit/miss counters shared by every cache backend"""
+
+    def _init_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+class LRUResultCache(_CounterMixin):
+    """In-process LRU cache with a size limit and per-entry TTL"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_counters()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires < time.time():
+                    del self._entries[key]
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+            return self._count(entry and entry[1])
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResultCache(_CounterMixin):
+    """
+    On-disk cache in a local SQLite file (e.g. under /tmp), so results
+    survive for as long as a warm Lambda container or API host does
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._init_counters()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM results WHERE key = ? AND expires >= ?', (key, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            return self._count(row and json.loads(row[0]))
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            # Drop expired entries, then the least recently used beyond the limit
+            self._conn.execute('DELETE FROM results WHERE expires < ?', (now,))
+            self._conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+
+def create_result_cache(backend_name: str = RESULT_CACHE_BACKEND):
+    """Instantiate the cache configured by RESULT_CACHE_BACKEND (None when disabled)"""
+    if backend_name == 'none':
+        return None
+    if backend_name == 'memory':
+        return LRUResultCache()
+    if backend_name == 'sqlite':
+        return SQLiteResultCache()
+    raise ValueError(f"Unknown result cache backend: {backend_name}")
@@ -0,0 +1,114 @@
+import io
+import threading
+from collections import OrderedDict
+from config import *
+
+
+class S3RangeReader(io.BufferedIOBase):
+    """
+    Read-only, seekable file object over an S3 object. Data is fetched in
+    block_size ranged GETs and at most max_blocks blocks are kept, so memory
+    stays bounded for multi-GB objects and nothing is written to /tmp.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, object_key: str,
+                 block_size: int = S3_VIDEO_BLOCK_SIZE, max_blocks: int = S3_VIDEO_MAX_BLOCKS):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        self.size = head['ContentLength']
+        # Pin every range request to this version of the object
+        self.etag = head.get('ETag')
+        self.position = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"s3://{self.bucket_name}/{self.object_key}"
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self.position = position
+        return position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        chunks = []
+        while self.position < end:
+            index, offset = divmod(self.position, self.block_size)
+            block = self._block(index)
+            chunk = block[offset:offset + end - self.position]
+            chunks.append(chunk)
+            self.position += len(chunk)
+        return b''.join(chunks)
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _block(self, index: int) -> bytes:
+        with self._lock:
+            block = self._blocks.get(index)
+            if block is not None:
+                self._blocks.move_to_end(index)
+                return block
+
+            start = index * self.block_size
+            end = min(start + self.block_size, self.size) - 1
+            params = {'Bucket': self.bucket_name, 'Key': self.object_key, 'Range': f"bytes={start}-{end}"}
+            if self.etag:
+                params['IfMatch'] = self.etag
+            block = self.s3_client.get_object(**params)['Body'].read()
+            self.requests += 1
+            self.bytes_fetched += len(block)
+
+            self._blocks[index] = block
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+            return block
+
+
+def open_s3_video(s3_client, bucket_name: str, object_key: str):
+    """
+    Open an S3 video for frame sampling without downloading it. Returns an
+    S3RangeReader when this OpenCV build can read from Python streams
+    (4.10+), otherwise a presigned URL that FFmpeg streams with its own
+    HTTP range requests.
+    """
+    import cv2
+    if hasattr(cv2, 'IStreamReader'):
+        return S3RangeReader(s3_client, bucket_name, object_key)
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket_name, 'Key': object_key},
+        ExpiresIn=S3_VIDEO_URL_EXPIRY
+    )
@@ -0,0 +1,170 @@
+import time
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+import action_executor
+from action_executor import ActionExecutor, AlertDigest, with_retries
+from config import S3_QUARANTINE_BUCKET
+
+FORBIDDEN = {'success': True, 'has_forbidden_content': True,
+             'detections': [{'class': 'knife', 'class_id': 43, 'confidence': 0.9, 'bbox': [0, 0, 1, 1]}]}
+CLEAN = {'success': True, 'has_forbidden_content': False, 'detections': []}
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='uploads')
+        client.create_bucket(Bucket=S3_QUARANTINE_BUCKET)
+        yield client
+
+def _executor(s3_client):
+    return ActionExecutor(lambda service: s3_client, workers=4)
+
+def _quarantined(s3_client):
+    return [o['Key'] for o in s3_client.list_objects_v2(Bucket=S3_QUARANTINE_BUCKET).get('Contents', [])]
+
+def test_actions_run_for_a_batch(s3_client):
+    for key in ('a.jpg', 'b.jpg'):
+        s3_client.put_object(Bucket='uploads', Key=key, Body=b'data')
+
+    outputs = _executor(s3_client).run([('uploads', 'a.jpg', FORBIDDEN, None), ('uploads', 'b.jpg', CLEAN, None),
+                                        ('uploads', 'c.jpg', {'success': False, 'error': 'boom'}, None)])
+
+    assert [o['action'] for o in outputs] == ['quarantined', 'verified', 'error']
+    assert len(_quarantined(s3_client)) == 1 and _quarantined(s3_client)[0].endswith('_a.jpg')
+    assert 'Contents' not in s3_client.list_objects_v2(Bucket='uploads', Prefix='a.jpg')
+    tags = s3_client.get_object_tagging(Bucket='uploads', Key='b.jpg')['TagSet']
+    assert tags == [{'Key': 'ContentModeration', 'Value': 'Verified'}]
+
+def test_redelivered_quarantine_is_not_repeated(s3_client):
+    etag = s3_client.put_object(Bucket='uploads', Key='a.jpg', Body=b'data')['ETag'].strip('"')
+
+    first = _executor(s3_client).apply('uploads', 'a.jpg', FORBIDDEN, etag)
+    # A fresh container has no memory of the first delivery
+    second = _executor(s3_client).apply('uploads', 'a.jpg', FORBIDDEN, etag)
+
+    assert first['action'] == second['action'] == 'quarantined'
+    assert 'already_applied' not in first and second['already_applied']
+    assert len(_quarantined(s3_client)) == 1
+
+def test_stale_event_does_not_verify_newer_upload(s3_client):
+    old_etag = s3_client.put_object(Bucket='uploads', Key='a.jpg', Body=b'old')['ETag']
+    s3_client.put_object(Bucket='uploads', Key='a.jpg', Body=b'new')
+
+    output = _executor(s3_client).apply('uploads', 'a.jpg', CLEAN, old_etag)
+
+    assert output['already_applied']
+    assert s3_client.get_object_tagging(Bucket='uploads', Key='a.jpg')['TagSet'] == []
+
+def test_large_objects_use_multipart_copy(s3_client, monkeypatch):
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_CHUNK_SIZE', 5 * 1024 * 1024)
+    body = b'x' * (11 * 1024 * 1024)
+    s3_client.put_object(Bucket='uploads', Key='big.mp4', Body=body)
+
+    assert _executor(s3_client).apply('uploads', 'big.mp4', FORBIDDEN)['action'] == 'quarantined'
+
+    copy = s3_client.get_object(Bucket=S3_QUARANTINE_BUCKET, Key=_quarantined(s3_client)[0])
+    # Multipart uploads get an ETag of the form <md5>-<parts>
+    assert copy['ETag'].strip('"').endswith('-3')
+    assert copy['Body'].read() == body
+
+def _client_error(code, status):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'Op')
+
+def test_with_retries_only_retries_transient_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _client_error('SlowDown', 503)
+        return 'ok'
+
+    assert with_retries(flaky, base_delay=0) == 'ok' and len(calls) == 3
+
+    def forbidden():
+        calls.append(1)
+        raise _client_error('AccessDenied', 403)
+
+    calls.clear()
+    with pytest.raises(ClientError):
+        with_retries(forbidden, base_delay=0)
+    assert len(calls) == 1
+
+def test_alert_digest_coalesces_emails():
+    class FakeSES:
+        def __init__(self):
+            self.emails = []
+
+        def send_email(self, **kwargs):
+            self.emails.append(kwargs)
+
+    ses = FakeSES()
+    digest = AlertDigest(lambda: ses, interval=3600, max_items=3, enabled=True)
+    digest.add('uploads', 'a.jpg', FORBIDDEN['detections'])
+    digest.add('uploads', 'b.jpg', FORBIDDEN['detections'])
+    assert digest.flush() == 0 and ses.emails == []
+
+    digest.add('uploads', 'c.jpg', FORBIDDEN['detections'])
+    assert digest.flush() == 3
+    assert len(ses.emails) == 1
+    body = ses.emails[0]['Message']['Body']['Text']['Data']
+    assert all(f"s3://uploads/{key}" in body for key in ('a.jpg', 'b.jpg', 'c.jpg'))
+    assert len(digest) == 0
+
+@pytest.mark.parametrize('size', [4, 11 * 1024 * 1024])
+def test_quarantine_copies_only_the_checked_version(s3_client, monkeypatch, size):
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_CHUNK_SIZE', 5 * 1024 * 1024)
+    etag = s3_client.put_object(Bucket='uploads', Key='a.jpg', Body=b'x' * size)['ETag']
+    conditions = []
+    for operation in ('CopyObject', 'UploadPartCopy'):
+        s3_client.meta.events.register(f"provide-client-params.s3.{operation}",
+                                       lambda params, **kwargs: conditions.append(params.get('CopySourceIfMatch')))
+
+    assert _executor(s3_client).apply('uploads', 'a.jpg', FORBIDDEN)['action'] == 'quarantined'
+
+    assert conditions and set(conditions) == {etag}
+
+def test_upload_replaced_during_quarantine_is_left_alone(s3_client, monkeypatch):
+    # moto only enforces CopySourceIfMatch on the multipart path
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(action_executor, 'ACTION_MULTIPART_CHUNK_SIZE', 5 * 1024 * 1024)
+    etag = s3_client.put_object(Bucket='uploads', Key='a.mp4', Body=b'x' * (11 * 1024 * 1024))['ETag']
+    executor = _executor(s3_client)
+    head = executor._head
+
+    def head_then_replace(*args):
+        found = head(*args)
+        s3_client.put_object(Bucket='uploads', Key='a.mp4', Body=b'new upload')
+        return found
+
+    monkeypatch.setattr(executor, '_head', head_then_replace)
+    output = executor.apply('uploads', 'a.mp4', FORBIDDEN, etag)
+
+    assert output['action'] == 'quarantined' and output['already_applied']
+    assert _quarantined(s3_client) == []
+    assert s3_client.get_object(Bucket='uploads', Key='a.mp4')['Body'].read() == b'new upload'
+
+def test_alert_digest_retries_a_failed_send_on_its_timer():
+    class FlakySES:
+        def __init__(self):
+            self.attempts = 0
+
+        def send_email(self, **kwargs):
+            self.attempts += 1
+            if self.attempts == 1:
+                raise _client_error('Throttling', 400)
+
+    ses = FlakySES()
+    digest = AlertDigest(lambda: ses, interval=0.05, max_items=100, enabled=True)
+    digest.add('uploads', 'a.jpg', FORBIDDEN['detections'])
+
+    # Nothing else arrives: the timer alone has to get the alert out
+    deadline = time.time() + 5
+    while digest.sent == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert ses.attempts == 2 and digest.sent == 1 and len(digest) == 0
@@ -0,0 +1,136 @@
+import importlib
+import io
+import json
+import tarfile
+import time
+import zipfile
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+import config
+from inference_dispatcher import MicroBatcher
+
+def _png(level):
+    return cv2.imencode('.png', np.full((16, 16, 3), level, dtype=np.uint8))[1].tobytes()
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def _tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+@pytest.fixture
+def api_service(monkeypatch, brightness_model):
+    # The brightness model stands in for YOLO; don't load the real one at import
+    monkeypatch.setattr(config, 'WARMUP_ON_INIT', False)
+    return importlib.import_module('api_service')
+
+@pytest.fixture
+def client(api_service):
+    with TestClient(api_service.app) as client:
+        yield client
+
+def test_archives_are_expanded(client):
+    files = [
+        ('files', ('bright.png', _png(255), 'image/png')),
+        ('files', ('batch.zip', _zip({'a/dark.png': _png(0), 'notes.txt': b'not an image'}), 'application/zip')),
+        ('files', ('batch.tgz', _tar({'bright.png': _png(250), 'empty.png': b''}), 'application/gzip')),
+    ]
+
+    response = client.post('/analyze-images', files=files)
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    results = {r['filename']: r for r in _lines(response)}
+    assert set(results) == {'bright.png', 'batch.zip/a/dark.png', 'batch.tgz/bright.png', 'batch.tgz/empty.png'}
+    assert [results[name].get('has_forbidden_content') for name in sorted(results)] == [True, None, False, True]
+    assert sorted(r['index'] for r in results.values()) == [0, 1, 2, 3]
+
+def test_a_bad_archive_member_fails_alone(client):
+    archive = _zip({'good.png': _png(0), 'broken.png': b'\x89PNG\r\n\x1a\n truncated'})
+
+    results = _lines(client.post('/analyze-images', files=[('files', ('batch.zip', archive, 'application/zip'))]))
+
+    assert {r['filename']: r['success'] for r in results} == {'batch.zip/good.png': True, 'batch.zip/broken.png': False}
+    assert [r['error'] for r in results if not r['success']]
+
+def test_results_stream_in_completion_order(monkeypatch, api_service, client):
+    slow = _png(10)
+
+    def detect(images):
+        if images[0] == slow:
+            time.sleep(0.5)
+        return api_service.moderator.detect_images(images)
+
+    # One image per batch and two workers, so the slow image doesn't hold up the fast one
+    monkeypatch.setattr(api_service, 'image_batcher', MicroBatcher(detect, max_batch=1, max_wait_ms=0, workers=2))
+    files = [('files', ('slow.png', slow, 'image/png')), ('files', ('fast.png', _png(20), 'image/png'))]
+
+    results = _lines(client.post('/analyze-images', files=files))
+
+    assert [(r['index'], r['filename']) for r in results] == [(1, 'fast.png'), (0, 'slow.png')]
+
+def test_other_uploads_are_refused(client):
+    response = client.post('/analyze-images', files=[('files', ('notes.txt', b'hello', 'text/plain'))])
+
+    assert response.status_code == 400
+
+def test_oversized_video_is_refused_while_saving(monkeypatch, tmp_path, api_service, client):
+    monkeypatch.setattr(api_service, 'API_MAX_VIDEO_BYTES', 1000)
+    monkeypatch.setattr(api_service, 'UPLOAD_CHUNK_SIZE', 1000)
+    monkeypatch.setattr(api_service.tempfile, 'tempdir', str(tmp_path))
+
+    # Small enough to pass the Content-Length check, so _save_upload has to catch it
+    response = client.post('/analyze-video', files={'file': ('clip.mp4', b'\x00' * 1500, 'video/mp4')})
+
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+def test_video_events_are_streamed(monkeypatch, tmp_path, api_service, client):
+    monkeypatch.setattr(api_service.tempfile, 'tempdir', str(tmp_path / 'uploads'))
+    (tmp_path / 'uploads').mkdir()
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 20, (64, 48))
+    for i in range(40):
+        # Dark, then bright enough for the brightness model to flag
+        writer.write(np.full((48, 64, 3), 0 if i < 20 else 255, dtype=np.uint8))
+    writer.release()
+
+    with open(path, 'rb') as f:
+        response = client.post('/analyze-video?stream=true', files={'file': ('clip.avi', f, 'video/x-msvideo')})
+
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    events = _lines(response)
+    assert {e['event'] for e in events[:-1]} == {'segment'}
+    assert all(e['frames'] for e in events[:-1])
+    assert events[-1]['event'] == 'complete'
+    assert events[-1]['filename'] == 'clip.avi'
+    assert events[-1]['has_forbidden_content']
+    assert any(e['has_forbidden_content'] for e in events[:-1])
+    # The upload is removed once the analysis job is done, just after its last event
+    for _ in range(50):
+        if not list((tmp_path / 'uploads').iterdir()):
+            break
+        time.sleep(0.02)
+    assert list((tmp_path / 'uploads').iterdir()) == []
+
+def test_unreadable_video_streams_an_error_event(client):
+    response = client.post('/analyze-video?stream=true', files={'file': ('clip.mp4', b'not a video', 'video/mp4')})
+
+    events = _lines(response)
+    assert [e['event'] for e in events] == ['error']
+    assert 'Could not open video' in events[0]['error']
@@ -0,0 +1,115 @@
+import json
+import cv2
+import numpy as np
+import pytest
+import backfill
+import inference_profiles
+import model_registry
+from backfill import Checkpoint, list_objects, run_backfill, worker_thread_plan
+from backfill import _init_worker as init_worker
+from config import S3_QUARANTINE_BUCKET
+from content_moderator import ContentModerator
+
+@pytest.fixture(autouse=True)
+def no_warm_up(monkeypatch):
+    # Workers would load the real model; the tests run inline on the fake one
+    monkeypatch.setattr(backfill, '_init_worker', lambda: None)
+
+def _upload_images(s3_client, levels):
+    # A gradient below each level gives bright images enough texture to hash
+    gradient = np.linspace(0, 60, 16)[None, :, None]
+    for i, level in enumerate(levels):
+        pixels = np.clip(level - gradient, 0, 255) * np.ones((16, 1, 3))
+        image = cv2.imencode('.png', pixels.astype(np.uint8))[1].tobytes()
+        s3_client.put_object(Bucket='uploads', Key=f"old/{i:03d}.png", Body=image)
+
+def test_list_objects_pages_and_filters(s3_client):
+    _upload_images(s3_client, [0] * 5)
+    s3_client.put_object(Bucket='uploads', Key='old/notes.txt', Body=b'x')
+    s3_client.put_object(Bucket='uploads', Key='old/clip.mp4', Body=b'x')
+
+    keys = [key for key, _, _ in list_objects(s3_client, 'uploads', 'old/', page_size=2)]
+    assert keys == [f"old/{i:03d}.png" for i in range(5)]
+
+    keys = [key for key, _, _ in list_objects(s3_client, 'uploads', 'old/', start_after='old/002.png', videos=True)]
+    assert keys == ['old/003.png', 'old/004.png', 'old/clip.mp4']
+
+def test_checkpoint_only_advances_past_contiguous_batches():
+    checkpoint = Checkpoint(None, 'uploads', '')
+    for last_key in ('b', 'd', 'f'):
+        checkpoint.started(last_key)
+
+    checkpoint.finished('d', [('c', {'action': 'verified'})], 10)
+    assert checkpoint.start_after == ''
+    checkpoint.finished('b', [('a', {'action': 'quarantined'})], 10)
+    assert checkpoint.start_after == 'd'
+    checkpoint.finished('f', [('e', {'action': 'verified'})], 10)
+    assert checkpoint.start_after == 'f'
+    assert checkpoint.counts == {'verified': 2, 'quarantined': 1}
+
+def test_backfill_moderates_and_resumes(s3_client, tmp_path):
+    _upload_images(s3_client, [0, 255, 0, 0, 255])
+    path = str(tmp_path / 'checkpoint.json')
+    results = str(tmp_path / 'results.jsonl')
+
+    summary = run_backfill(Checkpoint(path, 'uploads', 'old/'), workers=0, batch_size=2, results_path=results)
+
+    assert summary['processed'] == 5
+    assert summary['counts'] == {'verified': 3, 'quarantined': 2}
+    assert len(s3_client.list_objects_v2(Bucket=S3_QUARANTINE_BUCKET)['Contents']) == 2
+    with open(path) as f:
+        assert json.load(f)['start_after'] == 'old/004.png'
+    with open(results) as f:
+        assert len(f.readlines()) == 5
+
+    # Resuming a finished run has nothing left to do
+    summary = run_backfill(Checkpoint.load(path), workers=0)
+    assert summary['processed'] == 5 and summary['objects_per_s'] == 0
+
+def test_dry_run_leaves_objects_alone(s3_client):
+    _upload_images(s3_client, [255])
+
+    summary = run_backfill(Checkpoint(None, 'uploads', ''), workers=0, dry_run=True)
+
+    assert summary['counts'] == {'quarantined': 1}
+    assert 'Contents' not in s3_client.list_objects_v2(Bucket=S3_QUARANTINE_BUCKET)
+    assert s3_client.get_object_tagging(Bucket='uploads', Key='old/000.png')['TagSet'] == []
+
+def test_backfill_neither_uses_nor_grows_the_near_duplicate_index(s3_client):
+    _upload_images(s3_client, [255, 250])
+    # The live service has already quarantined a near-identical image
+    ContentModerator().handle_s3_images([('uploads', 'old/000.png')], dry_run=True)
+    index = model_registry.get_phash_index()
+    assert len(index) == 1
+
+    [(key, output)] = backfill.moderate_batch('uploads', [('old/001.png', None)], dry_run=True)
+
+    assert output['action'] == 'quarantined' and 'near_duplicate_of' not in output
+    assert output['detections']
+    assert len(index) == 1
+
+def test_workers_share_the_cores(s3_client, monkeypatch):
+    monkeypatch.setattr(inference_profiles, 'available_cpus', lambda: 8)
+    started = {}
+
+    def process_pool(max_workers, initializer, initargs, **kwargs):
+        started.update(workers=max_workers, plan=initargs[0])
+        return backfill._InlineExecutor(lambda: None)
+
+    monkeypatch.setattr(backfill, 'ProcessPoolExecutor', process_pool)
+    run_backfill(Checkpoint(None, 'uploads', ''), workers=4)
+
+    assert started == {'workers': 4, 'plan': {'cpus': 2, 'inference': 2, 'opencv': 1}}
+    # Never less than one thread each, however many workers
+    assert worker_thread_plan(16, cpus=8) == {'cpus': 1, 'inference': 1, 'opencv': 1}
+
+def test_worker_applies_its_share_before_loading_the_model(monkeypatch):
+    monkeypatch.setattr(inference_profiles, '_applied_plan', None)
+    monkeypatch.setattr(model_registry, 'warm_up', lambda: None)
+    threads = cv2.getNumThreads()
+    try:
+        init_worker({'cpus': 2, 'inference': 2, 'opencv': 1})
+        assert cv2.getNumThreads() == 1
+        assert inference_profiles.apply_thread_plan()['inference'] == 2
+    finally:
+        cv2.setNumThreads(threads)
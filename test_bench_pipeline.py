@@ -0,0 +1,48 @@
+import tempfile
+import cv2
+import numpy as np
+import pytest
+from bench_pipeline import compare, run_case, summarize, synthetic_image, synthetic_video
+
+def test_synthetic_images_are_reproducible():
+    first = synthetic_image(320, 240, seed=3)
+
+    assert first == synthetic_image(320, 240, seed=3)
+    assert first != synthetic_image(320, 240, seed=4)
+    assert cv2.imdecode(np.frombuffer(first, np.uint8), cv2.IMREAD_COLOR).shape == (240, 320, 3)
+
+def test_synthetic_video_has_requested_length(tmp_path):
+    path = synthetic_video(str(tmp_path / 'clip.mp4'), fps=10, duration=2, width=160, height=120)
+
+    cap = cv2.VideoCapture(path)
+    assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == 20
+    assert cap.get(cv2.CAP_PROP_FPS) == 10
+    cap.release()
+
+def test_summarize_reports_throughput_and_percentiles():
+    summary = summarize([0.01] * 99 + [1.0], items=400, wall_s=2.0)
+
+    assert summary['items_per_s'] == 200
+    assert summary['p50_ms'] == 10
+    assert 10 < summary['p99_ms'] <= 1000
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {'cases': [{'name': 'a', 'items_per_s': 100, 'p99_ms': 50, 'peak_rss_mb': 300},
+                          {'name': 'gone', 'items_per_s': 1}]}
+    report = {'cases': [{'name': 'a', 'items_per_s': 85, 'p99_ms': 52, 'peak_rss_mb': 200},
+                        {'name': 'new', 'items_per_s': 1}]}
+
+    rows = {row['metric']: row for row in compare(report, baseline, tolerance=0.1)}
+
+    assert set(rows) == {'items_per_s', 'p99_ms', 'peak_rss_mb'}
+    assert rows['items_per_s']['regression'] and round(rows['items_per_s']['change'], 2) == -0.15
+    assert not rows['p99_ms']['regression']
+    assert not rows['peak_rss_mb']['regression']
+
+def test_cases_clean_up_their_fixtures(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    with pytest.raises(ValueError):
+        run_case({'case': 'no_such_case', 'iterations': 1, 'fps': 2, 'duration': 1, 'resolution': (64, 48)})
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from conftest import BrightnessModel
+from content_moderator import ContentModerator
+from evaluate_cascade import summarize
+
+def test_cascade_skips_full_inference_for_clean_images(monkeypatch, brightness_model):
+    monkeypatch.setattr('content_moderator.CASCADE_THRESHOLD', 0.3)
+    images = [np.full((32, 32, 3), level, dtype=np.uint8) for level in (10, 200, 40, 255)]
+
+    outputs = ContentModerator().detect_images(images, cascade=True, tiled=False)
+
+    # Only the two bright images reach the full detector, in one batch
+    assert brightness_model.calls == [('prefilter', 4), ('full', 2)]
+    assert [o.has_forbidden_content for o in outputs] == [False, True, False, True]
+    assert len(outputs[0]) == 0
+
+def test_prefilter_failure_escalates(monkeypatch):
+    class Broken(BrightnessModel):
+        def detect(self, images, **kwargs):
+            if kwargs.get('classes') is not None:
+                raise RuntimeError("prefilter down")
+            return super().detect(images, **kwargs)
+
+    monkeypatch.setattr(ContentModerator, 'model', Broken())
+    scores = ContentModerator().prefilter_scores([np.zeros((8, 8, 3), dtype=np.uint8)] * 3)
+    assert scores.tolist() == [1.0, 1.0, 1.0]
+
+def test_summarize_recall_and_compute():
+    labels = np.array([True, True, False, False])
+    stages = {
+        'scores': np.array([0.9, 0.05, 0.5, 0.0]),
+        'flags': np.array([True, True, True, False]),
+        'stage1_times': np.full(4, 0.01),
+        'full_times': np.full(4, 0.1)
+    }
+
+    low, high = summarize(labels, stages, [0.01, 0.1])
+
+    assert low['recall_lost'] == 0 and low['escalation_rate'] == 0.75
+    assert high['recall_cascade'] == 0.5 and high['recall_lost'] == 0.5
+    assert high['false_positive_rate'] == 0.5
+    assert high['compute_saved'] == pytest.approx(1 - (0.04 + 0.2) / 0.4)
@@ -0,0 +1,96 @@
+import io
+import struct
+import zlib
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from content_moderator import ContentModerator
+from content_probe import probe, fetch_header, fetch_rest
+from image_io import sniff_format, image_dimensions, decode_image, animation_frames
+
+def _encode(image_format, width=40, height=30, **kwargs):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 200, 200)).save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+def _animated_gif(levels):
+    buffer = io.BytesIO()
+    frames = [Image.new('RGB', (16, 16), (level,) * 3) for level in levels]
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], loop=0, duration=100)
+    return buffer.getvalue()
+
+def _png_header(width, height):
+    """A PNG signature and IHDR claiming width x height, with no pixel data"""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+
+@pytest.mark.parametrize('image_format,expected', [
+    ('JPEG', 'jpeg'), ('PNG', 'png'), ('GIF', 'gif'), ('WEBP', 'webp'), ('BMP', 'bmp'), ('TIFF', 'tiff')
+])
+def test_formats_and_dimensions_from_header(image_format, expected):
+    data = _encode(image_format)
+
+    assert sniff_format(data) == expected
+    assert image_dimensions(data) == (40, 30)
+    assert probe(data)['kind'] == 'image'
+
+def test_probe_rejects_junk_and_routes_videos():
+    assert probe(b'')['reason'] == 'empty'
+    assert probe(b'<html>not an image</html>')['reason'] == 'unsupported'
+    assert probe(_png_header(100000, 100000))['reason'] == 'too_many_pixels'
+    assert probe(_png_header(0, 10))['reason'] == 'corrupt'
+    assert probe(_encode('PNG'), size=10 ** 9)['reason'] == 'too_large'
+    # A truncated probe of a large object can't call missing dimensions corrupt
+    assert probe(b'\xff\xd8\xff\xe1' + b'\x00' * 100, size=10 ** 6)['kind'] == 'image'
+    assert probe(b'\x00\x00\x00\x18ftypisom' + b'\x00' * 20)['kind'] == 'video'
+
+def test_animations_are_sampled():
+    data = _animated_gif([0, 50, 100, 150, 200, 250])
+
+    assert probe(data)['kind'] == 'animation'
+    frames = animation_frames(data, max_frames=3)
+    assert [frame_number for frame_number, _ in frames] == [0, 2, 5]
+    assert frames[2][1].getpixel((0, 0)) == (250, 250, 250)
+
+def test_decode_refuses_bombs():
+    with pytest.raises(ValueError, match='too large'):
+        decode_image(_png_header(100000, 100000))
+
+def test_fetch_reassembles_header_and_rest(s3_client):
+    data = cv2.imencode('.png', np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8))[1].tobytes()
+    s3_client.put_object(Bucket='uploads', Key='a.png', Body=data)
+
+    header, size, etag = fetch_header(s3_client, 'uploads', 'a.png', probe_bytes=100)
+    assert len(header) == 100 and size == len(data)
+    assert bytes(fetch_rest(s3_client, 'uploads', 'a.png', header, size, etag)) == data
+
+def test_handle_s3_images_rejects_and_routes_by_content(s3_client):
+    uploads = {
+        'dark.png': cv2.imencode('.png', np.zeros((16, 16, 3), dtype=np.uint8))[1].tobytes(),
+        'flashes.gif': _animated_gif([0, 30, 255, 60]),
+        'notes.jpg': b'just some text',
+        'bomb.png': _png_header(100000, 100000),
+    }
+    for key, body in uploads.items():
+        s3_client.put_object(Bucket='uploads', Key=key, Body=body)
+
+    outputs = ContentModerator().handle_s3_images([('uploads', key) for key in uploads], dry_run=True)
+
+    assert [o['action'] for o in outputs] == ['verified', 'quarantined', 'rejected', 'rejected']
+    assert outputs[1]['detections'][0]['frame'] == 2
+    assert [o['reason'] for o in outputs[2:]] == ['unsupported', 'too_many_pixels']
+
+@pytest.mark.parametrize('probe_enabled', [True, False])
+def test_moved_or_replaced_objects_are_not_errors(s3_client, monkeypatch, probe_enabled):
+    # A redelivered event after the quarantine move, and an event for an overwritten upload
+    monkeypatch.setattr('content_moderator.PROBE_ENABLED', probe_enabled)
+    data = cv2.imencode('.png', np.zeros((16, 16, 3), dtype=np.uint8))[1].tobytes()
+    s3_client.put_object(Bucket='uploads', Key='replaced.png', Body=data)
+
+    outputs = ContentModerator().handle_s3_images(
+        [('uploads', 'moved.png'), ('uploads', 'replaced.png', '"0123456789abcdef"')], dry_run=True
+    )
+
+    assert [o['action'] for o in outputs] == ['skipped', 'skipped']
+    assert all(o['already_applied'] for o in outputs)
@@ -0,0 +1,35 @@
+import numpy as np
+from detections import DetectionSet
+from config import CONFIDENCE_THRESHOLD, FORBIDDEN_CLASSES
+
+def test_threshold_and_forbidden_mask():
+    """Low-confidence boxes are dropped and forbidden classes are flagged"""
+    knife = FORBIDDEN_CLASSES[0]
+    detections = DetectionSet(
+        class_ids=[0, knife, knife, 2],
+        confidences=[0.9, CONFIDENCE_THRESHOLD - 0.1, 0.8, CONFIDENCE_THRESHOLD],
+        xyxy=np.arange(16).reshape(4, 4)
+    )
+    
+    assert detections.class_ids.tolist() == [0, knife, 2]
+    assert detections.forbidden.tolist() == [False, True, False]
+    assert detections.has_forbidden_content
+    
+    result = detections.to_result()
+    assert result['total_detections'] == 3
+    assert result['detections'][1]['class'] == 'knife'
+    assert result['detections'][1]['bbox'] == [8.0, 9.0, 10.0, 11.0]
+
+def test_forbidden_only_below_threshold():
+    """A forbidden class under the threshold does not flag the image"""
+    detections = DetectionSet([FORBIDDEN_CLASSES[0]], [0.1], [[0, 0, 1, 1]])
+    assert len(detections) == 0
+    assert not detections.has_forbidden_content
+
+def test_empty_and_unknown_classes():
+    """Empty sets and class ids outside the COCO table are handled"""
+    assert DetectionSet.empty().to_result()['detections'] == []
+    
+    detections = DetectionSet([999], [0.9], [[0, 0, 1, 1]])
+    assert not detections.has_forbidden_content
+    assert detections.to_dicts()[0]['class'] == 'unknown_999'
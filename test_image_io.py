@@ -0,0 +1,35 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+from image_io import jpeg_dimensions, reduced_decode_factor, decode_image
+
+def _jpeg(width, height):
+    return cv2.imencode('.jpg', np.zeros((height, width, 3), dtype=np.uint8))[1].tobytes()
+
+def test_jpeg_dimensions_from_header():
+    assert jpeg_dimensions(_jpeg(4000, 3000)) == (4000, 3000)
+    assert jpeg_dimensions(b'\x89PNG\r\n\x1a\n') is None
+    assert jpeg_dimensions(b'\xff\xd8\xff') is None
+
+def test_reduced_decode_keeps_inference_resolution():
+    """Boxes are mapped back to full resolution via the returned scale"""
+    data = _jpeg(4000, 3000)
+    assert reduced_decode_factor(data, target_size=640) == 4
+    
+    image, scale = decode_image(memoryview(data), reduced=True)
+    assert image.shape == (750, 1000, 3)
+    assert scale == 4
+    
+    image, scale = decode_image(bytearray(data), reduced=False)
+    assert image.shape == (3000, 4000, 3)
+    assert scale == 1
+
+def test_decode_gif():
+    """GIFs decode either natively (newer OpenCV) or through the PIL fallback"""
+    buffer = io.BytesIO()
+    Image.new('P', (32, 16)).save(buffer, format='GIF')
+    image, scale = decode_image(buffer.getvalue())
+    size = image.size if isinstance(image, Image.Image) else image.shape[1::-1]
+    assert tuple(size) == (32, 16)
+    assert scale == 1
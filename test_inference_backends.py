@@ -0,0 +1,77 @@
+import numpy as np
+from PIL import Image
+from inference_backends import OnnxBackend, letterbox, non_max_suppression
+
+KNIFE, PERSON = 43, 0
+
+def test_nms_suppresses_overlaps_within_a_class():
+    """Overlapping boxes of one class collapse to the best one"""
+    xyxy = np.array([
+        [0, 0, 100, 100],
+        [5, 5, 105, 105],
+        [200, 200, 300, 300]
+    ], dtype=np.float32)
+    scores = np.array([0.6, 0.9, 0.7], dtype=np.float32)
+    class_ids = np.array([1, 1, 1])
+    
+    keep = non_max_suppression(xyxy, scores, class_ids, iou_threshold=0.5)
+    assert keep.tolist() == [1, 2]
+
+def test_nms_keeps_overlapping_boxes_of_different_classes():
+    """A knife inside a person box is not suppressed by the person"""
+    xyxy = np.array([[0, 0, 100, 100], [0, 0, 100, 100]], dtype=np.float32)
+    scores = np.array([0.9, 0.8], dtype=np.float32)
+    class_ids = np.array([0, 43])
+    
+    keep = non_max_suppression(xyxy, scores, class_ids, iou_threshold=0.5)
+    assert keep.tolist() == [0, 1]
+    assert non_max_suppression(xyxy[:0], scores[:0], class_ids[:0], 0.5).size == 0
+
+def test_letterbox_pads_to_a_square_rgb_tensor():
+    bgr = np.zeros((100, 200, 3), dtype=np.uint8)
+    bgr[..., 0] = 255  # pure blue in OpenCV's channel order
+
+    tensor, transform = letterbox(bgr, 64)
+
+    assert tensor.shape == (3, 64, 64) and tensor.dtype == np.float32
+    # 200x100 scales by 0.32 to 64x32, centred with 16 rows of padding above and below
+    assert transform == (0.32, 0, 16, 200, 100)
+    assert (tensor[2, 16:48] == 1).all() and (tensor[:2, 16:48] == 0).all()
+    assert np.allclose(tensor[:, :16], 114 / 255) and np.allclose(tensor[:, 48:], 114 / 255)
+    # The same picture as a PIL image (RGB) gives the same input
+    pil_tensor, pil_transform = letterbox(Image.fromarray(bgr[..., ::-1]), 64)
+    assert np.array_equal(pil_tensor, tensor) and pil_transform == transform
+    gray, _ = letterbox(np.full((100, 200), 50, dtype=np.uint8), 64)
+    assert np.allclose(gray[:, 16:48], 50 / 255)
+
+def _prediction(anchors, class_count=50):
+    """A (4 + classes, anchors) YOLOv8 output from (cx, cy, w, h, {class: score})"""
+    prediction = np.zeros((4 + class_count, len(anchors)), dtype=np.float32)
+    for i, (cx, cy, w, h, scores) in enumerate(anchors):
+        prediction[:4, i] = cx, cy, w, h
+        for class_id, score in scores.items():
+            prediction[4 + class_id, i] = score
+    return prediction
+
+def test_onnx_postprocess_maps_boxes_back_to_the_image():
+    prediction = _prediction([
+        (32, 32, 16, 8, {KNIFE: 0.9, PERSON: 0.3}),
+        (33, 32, 16, 8, {KNIFE: 0.6}),   # same knife, suppressed by NMS
+        (10, 20, 8, 8, {PERSON: 0.8}),
+        (60, 40, 20, 10, {KNIFE: 0.4}),  # below 0.5, sticks out of the image
+    ])
+    # Letterbox of a 200x100 image into 64x64
+    transform = (0.32, 0, 16, 200, 100)
+    backend = OnnxBackend.__new__(OnnxBackend)
+
+    detections = backend._postprocess(prediction, *transform, threshold=0.5)
+
+    assert detections.class_ids.tolist() == [KNIFE, PERSON]
+    assert np.allclose(detections.confidences, [0.9, 0.8])
+    assert np.allclose(detections.xyxy, [[75, 37.5, 125, 62.5], [18.75, 0, 43.75, 25]])
+
+    # Only the requested classes, scored by their own best class; a lower threshold keeps more
+    knives = backend._postprocess(prediction, *transform, threshold=0.3, classes=[KNIFE])
+    assert knives.class_ids.tolist() == [KNIFE, KNIFE]
+    assert np.allclose(knives.confidences, [0.9, 0.4])
+    assert np.allclose(knives.xyxy[1], [156.25, 59.375, 200, 90.625])
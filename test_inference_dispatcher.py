@@ -0,0 +1,45 @@
+import asyncio
+import threading
+import pytest
+from inference_dispatcher import BoundedExecutor, MicroBatcher, Overloaded
+
+def test_concurrent_requests_are_batched():
+    batches = []
+    
+    def detect(images):
+        batches.append(list(images))
+        return [image * 10 for image in images]
+    
+    async def main():
+        batcher = MicroBatcher(detect, max_batch=4, max_wait_ms=50, max_pending=100, workers=1)
+        return await asyncio.gather(*[batcher.submit(i) for i in range(6)])
+    
+    assert asyncio.run(main()) == [0, 10, 20, 30, 40, 50]
+    assert [len(batch) for batch in batches] == [4, 2]
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+    
+    def detect(images):
+        release.wait(5)
+        return images
+    
+    async def main():
+        batcher = MicroBatcher(detect, max_batch=1, max_wait_ms=0, max_pending=2, workers=1)
+        first = [asyncio.ensure_future(batcher.submit(i)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(Overloaded):
+            await batcher.submit(3)
+        release.set()
+        return await asyncio.gather(*first)
+    
+    assert asyncio.run(main()) == [0, 1]
+
+def test_bounded_executor_runs_off_the_event_loop():
+    async def main():
+        executor = BoundedExecutor(max_workers=1, max_pending=1)
+        loop_thread = threading.get_ident()
+        worker_thread = await executor.run(threading.get_ident)
+        return loop_thread != worker_thread
+    
+    assert asyncio.run(main())
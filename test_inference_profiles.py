@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+import pytest
+import inference_profiles
+from detections import DetectionSet
+from inference_profiles import profile_model_path, thread_plan, available_cpus
+from quantize_model import box_iou, match_detections
+
+def test_profile_model_paths():
+    assert profile_model_path('./yolov8n.onnx', 'fp32') == './yolov8n.onnx'
+    assert profile_model_path('./yolov8n.onnx', 'int8-static') == './yolov8n.int8-static.onnx'
+    with pytest.raises(ValueError):
+        profile_model_path('./yolov8n.onnx', 'fp16')
+
+def test_thread_plan_leaves_opencv_what_inference_does_not_use():
+    assert thread_plan(cpus=4, inference_threads=0, opencv_threads=0) == {'cpus': 4, 'inference': 4, 'opencv': 1}
+    assert thread_plan(cpus=6, inference_threads=4, opencv_threads=0)['opencv'] == 2
+    assert thread_plan(cpus=2, inference_threads=1, opencv_threads=3)['opencv'] == 3
+
+def test_available_cpus_honours_cgroup_quota(monkeypatch):
+    monkeypatch.setattr(inference_profiles.os, 'sched_getaffinity', lambda pid: set(range(8)), raising=False)
+    monkeypatch.setattr(inference_profiles, '_cgroup_cpu_quota', lambda: 1.5)
+    assert available_cpus() == 2
+    monkeypatch.setattr(inference_profiles, '_cgroup_cpu_quota', lambda: None)
+    assert available_cpus() == 8
+
+def test_match_detections_requires_same_class_and_overlap():
+    reference = DetectionSet([43, 76], [0.9, 0.8], [[0, 0, 10, 10], [20, 20, 30, 30]], threshold=0)
+    candidate = DetectionSet([43, 43, 0], [0.85, 0.6, 0.7], [[1, 1, 10, 10], [20, 20, 30, 30], [0, 0, 10, 10]],
+                             threshold=0)
+
+    assert box_iou(reference.xyxy, reference.xyxy).diagonal() == pytest.approx([1, 1])
+    matches, deltas = match_detections(reference, candidate)
+    assert matches == 1 and deltas == [pytest.approx(-0.05)]
+
+def test_static_quantization_runs_on_the_backend(tmp_path):
+    onnx = pytest.importorskip('onnx')
+    from onnx import helper, TensorProto, numpy_helper
+    from inference_backends import OnnxBackend
+    from quantize_model import detection_head_nodes, quantize
+
+    rng = np.random.default_rng(0)
+    # images -> conv -> conv (head) -> sigmoid (head decoding), channels shaped like a 1-class YOLO output
+    nodes = [
+        helper.make_node('Conv', ['images', 'w0'], ['x0'], name='/model.0/conv/Conv', pads=[1, 1, 1, 1],
+                         strides=[32, 32]),
+        helper.make_node('Conv', ['x0', 'w1'], ['x1'], name='/model.1/cv3/Conv'),
+        helper.make_node('Sigmoid', ['x1'], ['x2'], name='/model.1/Sigmoid'),
+        helper.make_node('Reshape', ['x2', 'shape'], ['x3'], name='/model.1/Reshape'),
+        helper.make_node('Identity', ['x3'], ['output0'], name='/model.1/Identity'),
+    ]
+    graph = helper.make_graph(
+        nodes, 'tiny',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['batch', 3, 'height', 'width'])],
+        [helper.make_tensor_value_info('output0', TensorProto.FLOAT, None)],
+        [numpy_helper.from_array(rng.normal(size=(8, 3, 3, 3)).astype(np.float32), 'w0'),
+         numpy_helper.from_array(rng.normal(size=(5, 8, 1, 1)).astype(np.float32), 'w1'),
+         numpy_helper.from_array(np.array([0, 5, -1], dtype=np.int64), 'shape')]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8  # loadable by older ONNX Runtime releases
+    model_path = str(tmp_path / 'tiny.onnx')
+    onnx.save(model, model_path)
+    assert detection_head_nodes(model) == ['/model.1/Sigmoid', '/model.1/Reshape', '/model.1/Identity']
+
+    images = []
+    for i in range(3):
+        images.append(str(tmp_path / f"{i}.jpg"))
+        cv2.imwrite(images[-1], rng.integers(0, 256, (96, 128, 3), dtype=np.uint8))
+    quantized = quantize(model_path, 'int8-static', images)
+
+    assert quantized == str(tmp_path / 'tiny.int8-static.onnx')
+    assert any(node.op_type == 'QuantizeLinear' for node in onnx.load(quantized).graph.node)
+    detections = OnnxBackend(quantized, threads=1).detect([cv2.imread(images[0])], threshold=0)
+    assert len(detections) == 1 and len(detections[0]) > 0
@@ -0,0 +1,82 @@
+import json
+import time
+import instrumentation
+from instrumentation import MetricsRegistry, SamplingProfiler, profile_request, timer, timed
+
+def test_prometheus_histogram_is_cumulative():
+    registry = MetricsRegistry(emf=False)
+    for seconds in (0.002, 0.02, 0.02, 7.0):
+        registry.observe('decode', seconds)
+    registry.increment('moderation_objects_total', action='verified')
+    registry.increment('moderation_objects_total', 2, action='quarantined')
+
+    lines = registry.render_prometheus().splitlines()
+
+    assert 'moderation_stage_seconds_bucket{stage="decode",le="0.0025"} 1' in lines
+    assert 'moderation_stage_seconds_bucket{stage="decode",le="0.025"} 3' in lines
+    assert 'moderation_stage_seconds_bucket{stage="decode",le="5.0"} 3' in lines
+    assert 'moderation_stage_seconds_bucket{stage="decode",le="+Inf"} 4' in lines
+    assert 'moderation_stage_seconds_count{stage="decode"} 4' in lines
+    assert 'moderation_objects_total{action="quarantined"} 2' in lines
+    assert lines.count('# TYPE moderation_objects_total counter') == 1
+
+def test_emf_document_is_flushed_once(capsys):
+    registry = MetricsRegistry(emf=True)
+    registry.observe('inference', 0.0125)
+    registry.observe('inference', 0.025)
+    registry.increment('moderation_objects_total', action='verified')
+
+    document = registry.flush_emf(FunctionName='moderate')
+
+    assert json.loads(capsys.readouterr().out) == document
+    directive = document['_aws']['CloudWatchMetrics'][0]
+    assert directive['Dimensions'] == [['Service', 'FunctionName']]
+    assert {'Name': 'inference_ms', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert document['inference_ms'] == [12.5, 25.0]
+    assert document['moderation_objects_total'] == 1
+    assert registry.flush_emf() is None
+
+def test_timers_record_into_the_registry(monkeypatch):
+    registry = MetricsRegistry(emf=False)
+    monkeypatch.setattr(instrumentation, 'registry', registry)
+    monkeypatch.setattr(instrumentation, 'METRICS_ENABLED', True)
+
+    with timer('download'):
+        pass
+    assert timed('decode')(lambda x: x + 1)(1) == 2
+
+    assert 'moderation_stage_seconds_count{stage="download"} 1' in registry.render_prometheus()
+    assert 'moderation_stage_seconds_count{stage="decode"} 1' in registry.render_prometheus()
+
+def test_disabled_timers_are_no_ops(monkeypatch):
+    registry = MetricsRegistry(emf=False)
+    monkeypatch.setattr(instrumentation, 'registry', registry)
+    monkeypatch.setattr(instrumentation, 'METRICS_ENABLED', False)
+
+    def fn():
+        pass
+
+    with timer('download'):
+        pass
+    assert timed('decode')(fn) is fn
+    assert 'stage=' not in registry.render_prometheus()
+
+def test_sampling_profiler_sees_the_busy_function(tmp_path):
+    def spin():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    with SamplingProfiler(interval=0.002) as profiler:
+        spin()
+
+    assert any('spin (test_instrumentation.py' in stack for stack in profiler.samples)
+    path = profiler.save('analyze/image', str(tmp_path))
+    assert path.startswith(str(tmp_path / 'analyze_image-'))
+    line = open(path).readline()
+    assert line.rsplit(' ', 1)[1].strip().isdigit()
+
+def test_unsampled_requests_are_not_profiled():
+    with profile_request('request', sample_rate=0) as profile:
+        pass
+    assert profile.profiler is None and profile.path is None
@@ -0,0 +1,125 @@
+import importlib
+import json
+import cv2
+import numpy as np
+import pytest
+import config
+import model_registry
+
+def _png(level):
+    return cv2.imencode('.png', np.full((16, 16, 3), level, dtype=np.uint8))[1].tobytes()
+
+def _s3_record(key, bucket='uploads', etag=None):
+    s3_object = {'key': key}
+    if etag:
+        s3_object['eTag'] = etag
+    return {'s3': {'bucket': {'name': bucket}, 'object': s3_object}}
+
+def _sqs_record(message_id, *s3_records):
+    return {'messageId': message_id, 'body': json.dumps({'Records': list(s3_records)})}
+
+@pytest.fixture
+def lambda_function(monkeypatch, s3_client):
+    # The brightness model stands in for YOLO; don't load the real one at import
+    monkeypatch.setattr(config, 'WARMUP_ON_INIT', False)
+    module = importlib.import_module('lambda_function')
+    monkeypatch.setattr(module, 'PROBE_ENABLED', True)
+    return module
+
+@pytest.fixture
+def routed(monkeypatch, lambda_function):
+    """Record which path each key took; videos are reported without being read"""
+    moderator = model_registry.get_moderator()
+    handle_s3_images = moderator.handle_s3_images
+    paths = {'images': [], 'videos': []}
+
+    def images(objects, **kwargs):
+        paths['images'] += [obj[1] for obj in objects]
+        return handle_s3_images(objects, **kwargs)
+
+    def video(bucket_name, object_key, etag=None, **kwargs):
+        paths['videos'].append(object_key)
+        return {'action': 'verified'}
+
+    monkeypatch.setattr(moderator, 'handle_s3_images', images)
+    monkeypatch.setattr(moderator, 'handle_s3_video', video)
+    return paths
+
+def test_sqs_records_are_unwrapped_and_keys_decoded(lambda_function):
+    event = {'Records': [
+        _sqs_record('m1', _s3_record('summer+photos/a%2Bb.png'), _s3_record('c.png', etag='abc')),
+        _s3_record('d%20e.jpg'),
+    ]}
+
+    assert list(lambda_function._iter_s3_objects(event)) == [
+        ('m1', 'uploads', 'summer photos/a+b.png', None),
+        ('m1', 'uploads', 'c.png', 'abc'),
+        ('d e.jpg', 'uploads', 'd e.jpg', None),
+    ]
+
+def test_only_failed_messages_are_retried(s3_client, lambda_function):
+    s3_client.put_object(Bucket='uploads', Key='dark.png', Body=_png(0))
+    s3_client.put_object(Bucket='uploads', Key='bright.png', Body=_png(255))
+    s3_client.put_object(Bucket='uploads', Key='notes.txt', Body=b'not an image')
+    event = {'Records': [
+        _sqs_record('clean', _s3_record('dark.png')),
+        _sqs_record('forbidden', _s3_record('bright.png')),
+        # A redelivery after the quarantine move is not a failure either
+        _sqs_record('redelivered', _s3_record('gone.png')),
+        # Rejected by the probe, and retrying won't change that
+        _sqs_record('other', _s3_record('notes.txt')),
+        # Failed once even though it carries two objects
+        _sqs_record('broken', _s3_record('a.png', bucket='missing'), _s3_record('b.png', bucket='missing')),
+    ]}
+
+    response = lambda_function._handle_event(event)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'broken'}]
+    actions = {r['key']: r['result']['action'] for r in json.loads(response['body'])['results']}
+    assert actions == {'dark.png': 'verified', 'bright.png': 'quarantined', 'notes.txt': 'rejected',
+                       'gone.png': 'skipped', 'a.png': 'error', 'b.png': 'error'}
+
+@pytest.mark.parametrize('probe_enabled', [True, False])
+def test_records_are_split_by_extension_and_probe(s3_client, monkeypatch, lambda_function, routed, probe_enabled):
+    monkeypatch.setattr(lambda_function, 'PROBE_ENABLED', probe_enabled)
+    s3_client.put_object(Bucket='uploads', Key='a.png', Body=_png(0))
+    s3_client.put_object(Bucket='uploads', Key='upload-1234', Body=_png(0))
+    event = {'Records': [_s3_record('a.png'), _s3_record('clip.MP4'), _s3_record('upload-1234')]}
+
+    response = lambda_function._handle_event(event)
+
+    assert routed['videos'] == ['clip.MP4']
+    if probe_enabled:
+        assert routed['images'] == ['a.png', 'upload-1234']
+    else:
+        assert routed['images'] == ['a.png']
+        results = json.loads(response['body'])['results']
+        assert results[0] == {'item_id': 'upload-1234', 'key': 'upload-1234', 'result': {'action': 'skipped'}}
+    assert response['batchItemFailures'] == []
+
+def test_a_malformed_record_fails_only_its_message(s3_client, lambda_function):
+    s3_client.put_object(Bucket='uploads', Key='dark.png', Body=_png(0))
+    event = {'Records': [
+        _sqs_record('clean', _s3_record('dark.png')),
+        {'messageId': 'garbled', 'body': 'not json'},
+        {'messageId': 'no-key', 'body': json.dumps({'Records': [{'s3': {'bucket': {'name': 'uploads'}}}]})},
+    ]}
+
+    response = lambda_function._handle_event(event)
+
+    assert response['statusCode'] == 200
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'garbled'}, {'itemIdentifier': 'no-key'}]
+    actions = [(r['item_id'], r['result']['action']) for r in json.loads(response['body'])['results']]
+    assert sorted(actions) == [('clean', 'verified'), ('garbled', 'error'), ('no-key', 'error')]
+
+def test_an_unexpected_error_fails_the_whole_batch(s3_client, monkeypatch, lambda_function):
+    def broken(objects, **kwargs):
+        raise RuntimeError('model crashed')
+
+    monkeypatch.setattr(model_registry.get_moderator(), 'handle_s3_images', broken)
+    event = {'Records': [_sqs_record('m1', _s3_record('a.png')), _sqs_record('m2', _s3_record('b.png'))]}
+
+    response = lambda_function._handle_event(event)
+
+    assert response['statusCode'] == 500
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm1'}, {'itemIdentifier': 'm2'}]
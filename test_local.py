@@ -1,4 +1,4 @@
-from content_moderator import ContentModerator
+from model_registry import get_moderator
 import os
 import requests
 from PIL import Image
@@ -9,7 +9,7 @@ def test_image_processing():
     print("Testing image processing...")
     
     try:
-        moderator = ContentModerator()
+        moderator = get_moderator()
         print("Content moderator initialized successfully!")
         
         # Test with a sample image from the internet (or use local file)
@@ -42,7 +42,7 @@ def test_video_processing():
     print("\nTesting video processing...")
     
     try:
-        moderator = ContentModerator()
+        moderator = get_moderator()
         
         # Test with a sample video (replace with your test video path)
         test_video_path = "test_video.mp4"  # Replace with actual test video path
@@ -71,7 +71,7 @@ def test_s3_simulation():
     print("\nTesting S3 handling simulation...")
     
     try:
-        moderator = ContentModerator()
+        moderator = get_moderator()
         
         # Simulate S3 object processing
         test_bucket = "test-bucket"
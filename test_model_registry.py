@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import inference_backends
+import model_registry
+from detections import DetectionSet
+
+class FakeBackend:
+    """Records the images of every inference"""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, images):
+        self.calls.append([image.shape for image in images])
+        return [DetectionSet.empty() for _ in images]
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Count backend loads; each one is slow, so concurrent first calls overlap"""
+    created = []
+
+    def create_backend(backend_name, model_path):
+        time.sleep(0.05)
+        created.append((backend_name, model_path))
+        return FakeBackend()
+
+    monkeypatch.setattr(inference_backends, 'create_backend', create_backend)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    model_registry.reset()
+    yield created
+    model_registry.reset()
+
+def test_models_load_once_per_process(loads):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        models = list(pool.map(lambda _: model_registry.get_model('a.pt', 'ultralytics'), range(8)))
+
+    assert loads == [('ultralytics', 'a.pt')]
+    assert all(model is models[0] for model in models)
+    # Another weights file or backend is another model
+    assert model_registry.get_model('b.pt', 'ultralytics') is not models[0]
+    assert model_registry.get_model('a.pt', 'onnx') is not models[0]
+    assert len(loads) == 3
+
+def test_clients_and_moderator_are_shared(loads):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        moderators = list(pool.map(lambda _: model_registry.get_moderator(), range(8)))
+        clients = list(pool.map(lambda _: model_registry.get_client('s3'), range(8)))
+
+    assert all(moderator is moderators[0] for moderator in moderators)
+    assert all(client is clients[0] for client in clients)
+    assert moderators[0].s3_client is clients[0]
+    assert model_registry.get_client('ses') is not clients[0]
+    # The moderator only loads its model once something needs it
+    assert loads == []
+    assert moderators[0].model is moderators[1].model
+    assert len(loads) == 1
+
+def test_reset_recreates_everything(loads):
+    model = model_registry.get_model('a.pt', 'ultralytics')
+    client = model_registry.get_client('s3')
+    moderator = model_registry.get_moderator()
+
+    model_registry.reset()
+
+    assert model_registry.get_model('a.pt', 'ultralytics') is not model
+    assert model_registry.get_client('s3') is not client
+    assert model_registry.get_moderator() is not moderator
+    assert loads.count(('ultralytics', 'a.pt')) == 2
+
+def test_warm_up_runs_one_dummy_inference(loads):
+    model = model_registry.warm_up('a.pt', 'ultralytics')
+    assert model_registry.warm_up('a.pt', 'ultralytics') is model
+
+    size = model_registry.WARMUP_IMAGE_SIZE
+    assert model.calls == [[(size, size, 3)]]
+    assert model is model_registry.get_model('a.pt', 'ultralytics')
+    assert len(loads) == 1
+
+    # After a reset the new model is warmed up again
+    model_registry.reset()
+    assert model_registry.warm_up('a.pt', 'ultralytics').calls == [[(size, size, 3)]]
@@ -0,0 +1,109 @@
+import json
+import os
+import cv2
+import numpy as np
+import model_registry
+from content_moderator import ContentModerator
+from detections import DetectionSet
+from moderation_policy import CompiledPolicy, PolicyEngine, PolicySet
+
+KNIFE, SCISSORS, PERSON = 43, 76, 0
+
+def detections(*items):
+    """(class_id, confidence, box) tuples as an unfiltered DetectionSet"""
+    return DetectionSet([c for c, _, _ in items], [p for _, p, _ in items], [b for _, _, b in items], threshold=0)
+
+def test_per_class_thresholds_and_min_area():
+    policy = CompiledPolicy({'threshold': 0.5, 'classes': {'knife': {'threshold': 0.3, 'min_area': 100},
+                                                           'scissors': {'threshold': 0.8}}})
+    result = detections(
+        (KNIFE, 0.35, [0, 0, 20, 20]),      # forbidden: above 0.3, 400 px
+        (KNIFE, 0.9, [0, 0, 5, 5]),         # reported, too small to count
+        (SCISSORS, 0.7, [0, 0, 50, 50]),    # reported, below its 0.8
+        (PERSON, 0.4, [0, 0, 50, 50]),      # not reported
+    ).apply_policy(policy)
+
+    assert result.class_ids.tolist() == [KNIFE, KNIFE, SCISSORS]
+    assert result.forbidden.tolist() == [True, False, False]
+    assert policy.floor == np.float32(0.3) and policy.classes == [KNIFE, SCISSORS]
+
+def test_rules_need_every_class():
+    policy = CompiledPolicy({'classes': {}, 'rules': [{'all_of': ['knife', 'person'], 'threshold': 0.3}]})
+
+    alone = detections((KNIFE, 0.6, [0, 0, 10, 10])).apply_policy(policy)
+    together = detections((KNIFE, 0.6, [0, 0, 10, 10]), (PERSON, 0.35, [0, 0, 10, 10])).apply_policy(policy)
+
+    assert not alone.has_forbidden_content
+    assert together.forbidden.tolist() == [True, True]
+    assert policy.classes == [PERSON, KNIFE]
+
+def test_most_specific_override_wins():
+    policies = PolicySet({
+        'classes': {'knife': {'threshold': 0.5}},
+        'overrides': [
+            {'bucket': 'kids', 'classes': {'scissors': {'threshold': 0.3}}},
+            {'bucket': 'kids', 'prefix': 'cooking/', 'classes': {'knife': None}},
+            {'prefix': 'tmp/', 'threshold': 0.9},
+        ]
+    })
+
+    assert policies.resolve('adults', 'a.jpg') is policies.default
+    assert policies.resolve('kids', 'a.jpg').classes == [KNIFE, SCISSORS]
+    # Overrides extend the top-level policy, not each other
+    assert policies.resolve('kids', 'cooking/a.jpg').classes == []
+    assert policies.resolve('other', 'tmp/a.jpg').name == '*/tmp/'
+
+def test_reload_picks_up_changes_and_keeps_last_good_policy(tmp_path):
+    path = tmp_path / 'policy.json'
+    path.write_text(json.dumps({'classes': {'knife': {}}}))
+    engine = PolicyEngine(str(path), reload_interval=0)
+    assert engine.resolve().classes == [KNIFE]
+
+    path.write_text(json.dumps({'classes': {'scissors': {}}}))
+    os.utime(path, ns=(1, 1))
+    assert engine.resolve().classes == [SCISSORS]
+
+    path.write_text('{"classes": {"chainsaw": {}}}')
+    os.utime(path, ns=(2, 2))
+    assert engine.resolve().classes == [SCISSORS]
+
+def test_detect_images_runs_at_the_policy_floor(monkeypatch):
+    class Model:
+        def __init__(self):
+            self.thresholds = []
+
+        def detect(self, images, threshold=0.5):
+            self.thresholds.append(threshold)
+            return [detections((KNIFE, 0.35, [0, 0, 8, 8]), (PERSON, 0.9, [0, 0, 8, 8])) for _ in images]
+
+    model = Model()
+    monkeypatch.setattr(ContentModerator, 'model', model)
+    strict = CompiledPolicy({'classes': {'knife': {'threshold': 0.3}}})
+    lenient = CompiledPolicy({'classes': {'knife': {'threshold': 0.6}}})
+    images = [np.zeros((16, 16, 3), dtype=np.uint8)] * 2
+
+    outputs = ContentModerator().detect_images(images, tiled=False, cascade=False, policy=[strict, lenient])
+
+    assert model.thresholds == [np.float32(0.3)]
+    assert [o.has_forbidden_content for o in outputs] == [True, False]
+    assert outputs[1].class_ids.tolist() == [PERSON]
+
+def test_policy_reload_retires_near_duplicate_verdicts(s3_client, tmp_path, monkeypatch):
+    path = tmp_path / 'policy.json'
+    path.write_text(json.dumps({'classes': {'knife': {}}}))
+    engine = PolicyEngine(str(path), reload_interval=0)
+    monkeypatch.setattr(model_registry, '_policy_engine', engine)
+    coarse = np.random.default_rng(0).integers(128, 256, (8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (64, 64), interpolation=cv2.INTER_CUBIC)
+    s3_client.put_object(Bucket='uploads', Key='a.png', Body=cv2.imencode('.png', image)[1].tobytes())
+    s3_client.put_object(Bucket='uploads', Key='b.jpg', Body=cv2.imencode('.jpg', image)[1].tobytes())
+    moderator = ContentModerator()
+
+    assert moderator.handle_s3_image('uploads', 'a.png')['action'] == 'quarantined'
+    assert moderator.handle_s3_images([('uploads', 'b.jpg')], dry_run=True)[0]['near_duplicate_of'] == 'a.png'
+
+    # The live policy no longer forbids knives: the old verdict must not decide the copy
+    path.write_text(json.dumps({'classes': {}}))
+    os.utime(path, ns=(1, 1))
+    output = moderator.handle_s3_images([('uploads', 'b.jpg')], dry_run=True)[0]
+    assert output['action'] == 'verified' and 'near_duplicate_of' not in output
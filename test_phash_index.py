@@ -0,0 +1,97 @@
+import os
+import struct
+import tempfile
+import zlib
+import cv2
+import numpy as np
+import pytest
+from content_moderator import ContentModerator
+from phash_index import HammingIndex, NearDuplicateIndex, image_hash, hamming_distances
+
+def _photo(seed=0):
+    """Smooth synthetic image, so hashes behave like they do on photos"""
+    rng = np.random.default_rng(seed)
+    noise = (rng.random((60, 80, 3)) * 255).astype(np.uint8)
+    return cv2.resize(noise, (800, 600), interpolation=cv2.INTER_CUBIC)
+
+def test_hash_survives_resize_and_recompression():
+    original = cv2.imencode('.png', _photo())[1].tobytes()
+    repost = cv2.imencode('.jpg', cv2.resize(_photo(), (400, 300)), [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+    other = cv2.imencode('.png', _photo(seed=1))[1].tobytes()
+    
+    distance = lambda a, b: bin(image_hash(a) ^ image_hash(b)).count('1')
+    assert distance(original, repost) <= 6
+    assert distance(original, other) > 16
+
+def test_multi_index_search_matches_brute_force():
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**63, size=2000, dtype=np.uint64)
+    index = HammingIndex()
+    for h in hashes.tolist():
+        index.add(h)
+    
+    # Queries near existing entries and random ones
+    queries = [hashes[5].item() ^ 0b1011, hashes[7].item() ^ (1 << 63), rng.integers(0, 2**63).item()]
+    for query in queries:
+        ids, distances = index.search(query, radius=8)
+        expected = np.flatnonzero(hamming_distances(hashes, query) <= 8)
+        assert sorted(ids.tolist()) == expected.tolist()
+
+def test_near_duplicate_policy_and_persistence():
+    index = NearDuplicateIndex(forbidden_distance=6, verified_distance=2, skip_verified=False)
+    index.add(0b1111, forbidden=True, object_key='knife.jpg')
+    index.add(0xFF00, forbidden=False, object_key='cat.jpg')
+    
+    assert index.match(0b0111)['near_duplicate_of'] == 'knife.jpg'
+    assert index.match(0xFF00) is None  # verified matches need skip_verified
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'index.npz')
+        index.save(path)
+        loaded = NearDuplicateIndex.load(path, skip_verified=True, verified_distance=2)
+    assert len(loaded) == 2
+    assert loaded.match(0xFF01) == {'forbidden': False, 'near_duplicate_of': 'cat.jpg', 'distance': 1}
+
+def test_verdicts_only_hold_for_their_fingerprint(tmp_path):
+    index = NearDuplicateIndex(config_fingerprint='model-1')
+    index.add(0b1111, forbidden=True, object_key='knife.jpg', fingerprint='model-1:policy-a')
+
+    assert index.match(0b1111, 'model-1:policy-a')['near_duplicate_of'] == 'knife.jpg'
+    assert index.match(0b1111, 'model-1:policy-b') is None
+
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    assert len(NearDuplicateIndex.load(path, config_fingerprint='model-1')) == 1
+    # Another model or config: the saved verdicts are discarded
+    assert len(NearDuplicateIndex.load(path, config_fingerprint='model-2')) == 0
+
+    assert index.retain({'model-1:policy-b'}) == 1
+    assert len(index) == 0
+
+def test_blank_images_are_not_hashed():
+    encode = lambda pixels: cv2.imencode('.png', pixels.astype(np.uint8))[1].tobytes()
+    gradient = np.linspace(100, 110, 256)[None, :] * np.ones((256, 1))
+    # These all hash within a few bits of each other
+    for pixels in (np.full((256, 256), 255), np.full((256, 256), 128), np.zeros((256, 256)), gradient):
+        assert image_hash(encode(pixels)) is None
+    assert image_hash(encode(_photo()[:, :, 0])) is not None
+
+def test_blank_verdicts_do_not_spread(s3_client):
+    # Brightness decides: white is forbidden, dark grey is clean
+    for key, level in (('white.png', 255), ('grey.png', 40)):
+        pixels = np.full((64, 64, 3), level, dtype=np.uint8)
+        s3_client.put_object(Bucket='uploads', Key=key, Body=cv2.imencode('.png', pixels)[1].tobytes())
+    moderator = ContentModerator()
+
+    assert moderator.handle_s3_images([('uploads', 'white.png')], dry_run=True)[0]['action'] == 'quarantined'
+    output = moderator.handle_s3_images([('uploads', 'grey.png')], dry_run=True)[0]
+
+    assert output['action'] == 'verified' and 'near_duplicate_of' not in output
+    assert len(moderator.phash_index) == 0
+
+def test_hashing_refuses_bombs():
+    ihdr = struct.pack('>IIBBBBB', 100000, 100000, 8, 0, 0, 0, 0)
+    bomb = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+
+    with pytest.raises(ValueError, match='too large'):
+        image_hash(bomb)
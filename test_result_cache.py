@@ -0,0 +1,39 @@
+import os
+import tempfile
+import time
+import pytest
+from result_cache import LRUResultCache, SQLiteResultCache, cache_key, content_id
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def make(**kwargs):
+            if request.param == 'memory':
+                return LRUResultCache(**kwargs)
+            return SQLiteResultCache(os.path.join(tmp_dir, 'cache.sqlite3'), **kwargs)
+        yield make
+
+def test_hits_misses_and_lru_eviction(make_cache):
+    cache = make_cache(max_entries=2, ttl=60)
+    cache.set('a', {'has_forbidden_content': True})
+    cache.set('b', {'has_forbidden_content': False})
+    assert cache.get('a') == {'has_forbidden_content': True}
+    
+    # 'b' is now the least recently used entry
+    time.sleep(0.01)
+    cache.set('c', {'has_forbidden_content': False})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+def test_ttl_expiry(make_cache):
+    cache = make_cache(ttl=-1)
+    cache.set('a', {'success': True})
+    assert cache.get('a') is None
+
+def test_keys_identify_content():
+    assert content_id(etag='"abc"') == 'etag:abc'
+    assert content_id(b'image') == content_id(b'image')
+    assert content_id(b'image') != content_id(b'other')
+    assert cache_key(content_id(b'image')).startswith('blake2b:')
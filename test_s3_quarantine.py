@@ -1,6 +1,6 @@
 import boto3
 import os
-from content_moderator import ContentModerator
+from model_registry import get_moderator
 from config import *
 
 def test_s3_quarantine():
@@ -11,7 +11,7 @@ def test_s3_quarantine():
     
     # Initialize content moderator
     try:
-        moderator = ContentModerator()
+        moderator = get_moderator()
         print("✅ Content moderator initialized")
     except Exception as e:
         print(f"❌ Error initializing content moderator: {e}")
@@ -0,0 +1,80 @@
+import numpy as np
+from config import FORBIDDEN_CLASSES
+from content_moderator import ContentModerator
+from detections import DetectionSet
+from tiling import tile_grid, merge_detections
+
+KNIFE = FORBIDDEN_CLASSES[0]
+
+def test_tile_grid_covers_image_with_overlap():
+    """Tiles cover every pixel, stay inside the image and overlap"""
+    boxes = tile_grid(1800, 1000, tile_size=640, overlap=0.2, max_tiles=16)
+
+    covered = np.zeros((1000, 1800), dtype=bool)
+    for x0, y0, x1, y1 in boxes.tolist():
+        assert 0 <= x0 < x1 <= 1800 and 0 <= y0 < y1 <= 1000
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+
+    xs = sorted(set(boxes[:, 0].tolist()))
+    assert all(b - a <= 640 * 0.8 for a, b in zip(xs, xs[1:]))
+
+def test_tile_grid_respects_budget():
+    """Huge images get bigger tiles instead of more of them"""
+    boxes = tile_grid(8000, 6000, tile_size=640, overlap=0.2, max_tiles=9)
+    assert len(boxes) <= 9
+    assert boxes[:, 2].max() == 8000 and boxes[:, 3].max() == 6000
+
+def test_merge_suppresses_cross_tile_duplicates():
+    """An object seen by two overlapping tiles (one cut off) is kept once"""
+    full = DetectionSet.empty()
+    boxes = np.array([[0, 0, 640, 640], [512, 0, 1152, 640]])
+    left = DetectionSet([KNIFE], [0.9], [[500, 100, 600, 150]])
+    # Same knife in the right tile, partly cut off at its left border
+    right = DetectionSet([KNIFE, 0], [0.6, 0.8], [[0, 100, 88, 150], [300, 300, 400, 400]])
+
+    merged = merge_detections(full, [left, right], boxes)
+
+    assert sorted(merged.class_ids.tolist()) == [0, KNIFE]
+    knife = merged.xyxy[merged.class_ids == KNIFE][0]
+    assert knife.tolist() == [500, 100, 600, 150]
+    person = merged.xyxy[merged.class_ids == 0][0]
+    assert person.tolist() == [812, 300, 912, 400]
+
+class SmallObjectModel:
+    """Sees the knife only when the image is no bigger than one tile"""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, images):
+        self.calls.append(len(images))
+        results = []
+        for image in images:
+            if max(image.shape[:2]) <= 640 and image[..., 2].max() > 0:
+                ys, xs = np.nonzero(image[..., 2])
+                results.append(DetectionSet([KNIFE], [0.9], [[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]]))
+            else:
+                results.append(DetectionSet.empty())
+        return results
+
+def test_detect_images_tile_pass(monkeypatch):
+    """Large images get a batched tile pass; small images don't"""
+    model = SmallObjectModel()
+    monkeypatch.setattr(ContentModerator, 'model', model)
+    large = np.zeros((1500, 2000, 3), dtype=np.uint8)
+    large[1200:1210, 1700:1720, 2] = 255
+    small = np.zeros((400, 600, 3), dtype=np.uint8)
+
+    outputs = ContentModerator().detect_images([large, small], batch_size=8, tiled=True)
+
+    assert outputs[0].has_forbidden_content
+    assert outputs[0].xyxy.tolist() == [[1700, 1200, 1720, 1210]]
+    assert not outputs[1].has_forbidden_content
+    # One full-image batch, then the large image's tiles in batches of 8
+    assert model.calls[0] == 2 and sum(model.calls[1:]) == len(tile_grid(2000, 1500))
+
+    model.calls.clear()
+    outputs = ContentModerator().detect_images([large], tiled=False)
+    assert not outputs[0].has_forbidden_content
+    assert model.calls == [1]
@@ -0,0 +1,158 @@
+import os
+import tempfile
+import cv2
+import numpy as np
+import pytest
+from config import FORBIDDEN_CLASSES
+from detections import DetectionSet
+from video_sampler import (
+    VideoFrameSampler, SceneChangeDetector, skip_unchanged, forbidden_segments, prefetch, batched
+)
+
+def _write_video(path, fps, frame_count):
+    """Write a small video whose frame i is filled with gray level 4 * i"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (64, 48))
+    for i in range(frame_count):
+        writer.write(np.full((48, 64, 3), 4 * i, dtype=np.uint8))
+    writer.release()
+
+@pytest.fixture
+def video_path():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'clip.avi')
+        _write_video(path, fps=20, frame_count=50)
+        yield path
+
+@pytest.mark.parametrize('mode', ['grab', 'seek'])
+def test_samples_one_frame_per_second(video_path, mode):
+    """Both strategies return the same, correct frames"""
+    cap = cv2.VideoCapture(video_path)
+    sampler = VideoFrameSampler(cap, sample_rate=1, max_duration=300, mode=mode)
+    frames = list(sampler)
+    cap.release()
+    
+    assert [n for n, _, _ in frames] == [0, 20, 40]
+    assert [t for _, t, _ in frames] == [0.0, 1.0, 2.0]
+    # Frame content matches the frame number (allowing for JPEG noise)
+    for frame_number, _, frame in frames:
+        assert abs(int(frame.mean()) - 4 * frame_number) <= 2
+    assert sampler.duration == pytest.approx(2.5)
+
+def test_sample_rate_above_fps_uses_every_frame(video_path):
+    """fps below the sample rate must not produce a zero interval"""
+    cap = cv2.VideoCapture(video_path)
+    sampler = VideoFrameSampler(cap, sample_rate=50, mode='grab')
+    assert sampler.frame_interval == 1
+    assert len(list(sampler)) == 50
+    cap.release()
+
+def test_max_duration(video_path):
+    """Sampling stops once the duration limit is reached"""
+    cap = cv2.VideoCapture(video_path)
+    sampler = VideoFrameSampler(cap, sample_rate=1, max_duration=1, mode='auto')
+    assert [n for n, _, _ in sampler] == [0, 20]
+    assert sampler.duration == pytest.approx(1.0, abs=0.1)
+    cap.release()
+
+def test_prefetch_preserves_order_and_stops_early():
+    """Items arrive in order and closing the consumer stops the producer"""
+    produced = []
+    
+    def numbers():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+    
+    assert list(prefetch(range(10), maxsize=2)) == list(range(10))
+    
+    items = prefetch(numbers(), maxsize=2)
+    assert [next(items) for _ in range(3)] == [0, 1, 2]
+    items.close()
+    # Bounded queue: the producer never ran far ahead of the consumer
+    assert len(produced) < 10
+
+def test_prefetch_reraises_producer_errors():
+    def broken():
+        yield 1
+        raise ValueError("corrupt frame")
+    
+    with pytest.raises(ValueError):
+        list(prefetch(broken()))
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+@pytest.mark.parametrize('mode', ['diff', 'hist'])
+def test_scene_change_detector(mode):
+    """Static frames are skipped, real changes and slow drift are not"""
+    detector = SceneChangeDetector(mode=mode, threshold=0.03, max_carry=10)
+    gray = lambda level: np.full((48, 64, 3), level, dtype=np.uint8)
+    
+    assert detector.changed(gray(100), 0.0)
+    assert not detector.changed(gray(101), 1.0)
+    assert not detector.changed(gray(103), 2.0)
+    # Drift is measured against the last analyzed frame, not the previous one
+    assert detector.changed(gray(120), 3.0)
+    # A long static shot is still re-checked after max_carry seconds
+    assert not detector.changed(gray(120), 12.0)
+    assert detector.changed(gray(120), 13.0)
+
+def test_skip_unchanged_drops_pixels():
+    frames = [(i, float(i), np.full((8, 8, 3), level, dtype=np.uint8)) for i, level in enumerate([0, 0, 200])]
+    items = list(skip_unchanged(frames, SceneChangeDetector(mode='diff')))
+    assert [frame is None for _, _, frame in items] == [False, True, False]
+    assert all(isinstance(frame, np.ndarray) for _, _, frame in frames)
+
+def test_forbidden_segments():
+    """Consecutive frames with the same forbidden class form one segment"""
+    knife, scissors = FORBIDDEN_CLASSES
+    box = [[0, 0, 1, 1]]
+    frames = [
+        (0, 0.0, DetectionSet([0], [0.9], box)),
+        (1, 1.0, DetectionSet([knife], [0.6], box)),
+        (2, 2.0, DetectionSet([knife, scissors], [0.8, 0.7], box * 2)),
+        (3, 3.0, DetectionSet([scissors], [0.9], box)),
+        (4, 4.0, DetectionSet.empty()),
+        (5, 5.0, DetectionSet([knife], [0.7], box)),
+    ]
+    
+    segments = [(s['class_id'], s['start'], s['end'], s['frames'], s['max_confidence'])
+                for s in forbidden_segments(frames)]
+    
+    assert segments == [
+        (knife, 1.0, 2.0, 2, pytest.approx(0.8)),
+        (scissors, 2.0, 3.0, 2, pytest.approx(0.9)),
+        (knife, 5.0, 5.0, 1, pytest.approx(0.7)),
+    ]
+
+def test_static_video_carries_results_forward(monkeypatch):
+    """Only frames that changed are inferred; the rest reuse their result"""
+    from content_moderator import ContentModerator
+    
+    class CountingModel:
+        inferred = 0
+        
+        def detect(self, images):
+            CountingModel.inferred += len(images)
+            return [
+                DetectionSet([FORBIDDEN_CLASSES[0]], [0.9], [[0, 0, 1, 1]]) if image.mean() > 100
+                else DetectionSet.empty()
+                for image in images
+            ]
+    
+    monkeypatch.setattr(ContentModerator, 'model', CountingModel())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'static.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        # 6 seconds static, 4 seconds of a different (forbidden) shot
+        for i in range(100):
+            writer.write(np.full((48, 64, 3), 30 if i < 60 else 200, dtype=np.uint8))
+        writer.release()
+        
+        result = ContentModerator().process_video(path)
+    
+    assert result['success']
+    assert result['total_frames_processed'] == 10
+    assert result['frames_inferred'] == CountingModel.inferred == 2
+    assert [f['timestamp'] for f in result['forbidden_frames']] == [6.0, 7.0, 8.0, 9.0]
+    assert [(s['start'], s['end']) for s in result['forbidden_segments']] == [(6.0, 9.0)]
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+from config import *
+from detections import DetectionSet
+from inference_backends import non_max_suppression
+
+
+def image_size(image) -> tuple:
+    """(width, height) of a BGR NumPy array or a PIL image"""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def needs_tiling(image, min_size: int = TILING_MIN_SIZE) -> bool:
+    return max(image_size(image)) >= min_size
+
+
+def _starts(length: int, tile_size: int, stride: int) -> np.ndarray:
+    """Evenly spaced tile offsets along one axis, the last one flush with the edge"""
+    if length <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+    count = math.ceil((length - tile_size) / stride) + 1
+    return np.linspace(0, length - tile_size, count).round().astype(np.int64)
+
+
+def tile_grid(width: int, height: int, tile_size: int = TILING_TILE_SIZE,
+              overlap: float = TILING_OVERLAP, max_tiles: int = TILING_MAX_TILES) -> np.ndarray:
+    """
+    (N, 4) array of x0, y0, x1, y1 tiles covering the image, neighbours
+    overlapping by at least overlap * tile_size. The tile size is increased
+    until at most max_tiles tiles are needed.
+    """
+    while True:
+        stride = max(1, int(tile_size * (1 - overlap)))
+        xs = _starts(width, tile_size, stride)
+        ys = _starts(height, tile_size, stride)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = math.ceil(tile_size * 1.25)
+
+    x0, y0 = (grid.reshape(-1) for grid in np.meshgrid(xs, ys))
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def crop(image, box):
+    """Crop a tile; NumPy tiles are views into the image, not copies"""
+    x0, y0, x1, y1 = box
+    if isinstance(image, np.ndarray):
+        return image[y0:y1, x0:x1]
+    return image.crop((x0, y0, x1, y1))
+
+
+def merge_detections(full: DetectionSet, tiles: list, boxes: np.ndarray,
+                     threshold: float = TILING_MERGE_THRESHOLD) -> DetectionSet:
+    """
+    Merge full-image detections with per-tile detections (in tile
+    coordinates, one DetectionSet per row of boxes) using class-aware NMS
+    over the combined boxes
+    """
+    sets = [full] + list(tiles)
+    offsets = [np.zeros(4, dtype=np.float32)] + [
+        np.array([x0, y0, x0, y0], dtype=np.float32) for x0, y0, _, _ in boxes.tolist()
+    ]
+    class_ids = np.concatenate([s.class_ids for s in sets])
+    confidences = np.concatenate([s.confidences for s in sets])
+    xyxy = np.concatenate([s.xyxy + offset for s, offset in zip(sets, offsets)])
+
+    keep = non_max_suppression(xyxy, confidences, class_ids, threshold, metric='ios')
+    # Everything here already passed the confidence threshold
+    return DetectionSet(class_ids[keep], confidences[keep], xyxy[keep], threshold=0)
@@ -12,4 +12,6 @@ except Exception as e:
 
 model.train(data='./content-moderation.yaml', epochs=100)
 
-model.export(format='onnx', imgsz=640, batch=1)
\ No newline at end of file
+# Dynamic batch axis so the ONNX Runtime backend (INFERENCE_BACKEND=onnx)
+# can run batched inference
+model.export(format='onnx', imgsz=640, dynamic=True)
\ No newline at end of file
@@ -0,0 +1,233 @@
+import math
+import queue
+import threading
+import numpy as np
+from config import *
+from instrumentation import timer
+
+
+class VideoFrameSampler:
+    """
+    Iterate over the frames of an opened cv2.VideoCapture that should be
+    analyzed, without decoding the ones in between.
+
+    Short intervals use grab() to skip frames (demux only, no retrieve/colour
+    conversion); long intervals seek straight to the next target frame. Yields
+    (frame_number, timestamp, frame) with frame as a BGR NumPy array.
+    """
+
+    def __init__(self, cap, sample_rate: float = VIDEO_FRAME_RATE,
+                 max_duration: float = MAX_VIDEO_DURATION, mode: str = VIDEO_SAMPLING_MODE):
+        import cv2
+        self.cap = cap
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        # Some containers report 0 or NaN; fall back to a nominal rate so the
+        # interval (and timestamps) stay well defined
+        self.fps_reported = bool(fps) and math.isfinite(fps) and fps > 0
+        self.fps = fps if self.fps_reported else DEFAULT_VIDEO_FPS
+        # At least 1, so videos slower than the sample rate use every frame
+        self.frame_interval = max(1, int(round(self.fps / sample_rate)))
+        self.max_frames = int(max_duration * self.fps)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+        if mode == 'auto':
+            mode = 'seek' if self.frame_interval >= VIDEO_SEEK_MIN_INTERVAL else 'grab'
+        if mode not in ('grab', 'seek'):
+            raise ValueError(f"Unknown video sampling mode: {mode}")
+        self.mode = mode
+        # Position of the next frame the capture will return
+        self.position = 0
+
+    @property
+    def duration(self) -> float:
+        """Seconds of video covered so far (whole video once iteration ends)"""
+        return self.position / self.fps
+
+    def __iter__(self):
+        target = 0
+        while target <= self.max_frames:
+            if self.mode == 'seek' and target != self.position:
+                if self.total_frames and target >= self.total_frames:
+                    # Nothing left to sample, don't grab through the tail
+                    self.position = self.total_frames
+                    return
+                if not self._seek(target):
+                    # Backend can't seek reliably; skip ahead by grabbing instead
+                    self.mode = 'grab'
+                # An inexact seek may land past the target; sample from there
+                target = max(target, self.position)
+            with timer('frame_decode'):
+                while self.position < target:
+                    if not self.cap.grab():
+                        return
+                    self.position += 1
+
+                ret, frame = self.cap.read()
+            if not ret:
+                return
+            self.position += 1
+
+            yield target, target / self.fps, frame
+            target += self.frame_interval
+
+        # Stop if video is too long
+        self.position = max(self.position, self.max_frames)
+
+    def _seek(self, target: int) -> bool:
+        import cv2
+        if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+            return False
+        self.position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        return self.position == target
+
+
+class SceneChangeDetector:
+    """
+    Decide whether a sampled frame differs enough from the last analyzed one
+    to be worth another inference. Frames are compared as 32x32 grayscale
+    thumbnails by mean absolute difference ('diff') or by half the L1
+    distance of their histograms ('hist'); both distances are in [0, 1].
+    """
+
+    def __init__(self, mode: str = SCENE_CHANGE_MODE, threshold: float = SCENE_CHANGE_THRESHOLD,
+                 max_carry: float = SCENE_MAX_CARRY):
+        if mode not in ('diff', 'hist', 'off'):
+            raise ValueError(f"Unknown scene change mode: {mode}")
+        self.mode = mode
+        self.threshold = threshold
+        self.max_carry = max_carry
+        self.reference = None
+        self.reference_time = None
+
+    def _signature(self, frame: np.ndarray) -> np.ndarray:
+        import cv2
+        small = cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.mode == 'hist':
+            return np.bincount(small.reshape(-1) >> 2, minlength=64) / small.size
+        return small.astype(np.float32) / 255
+
+    def _distance(self, a: np.ndarray, b: np.ndarray) -> float:
+        if self.mode == 'hist':
+            return float(np.abs(a - b).sum() / 2)
+        return float(np.abs(a - b).mean())
+
+    def changed(self, frame: np.ndarray, timestamp: float) -> bool:
+        """
+        True when frame should be analyzed, which also makes it the new
+        reference. Compared against the last analyzed frame, not the previous
+        one, so slow drift still adds up to a change.
+        """
+        if self.mode == 'off':
+            return True
+        signature = self._signature(frame)
+        if (self.reference is not None and timestamp - self.reference_time < self.max_carry
+                and self._distance(signature, self.reference) <= self.threshold):
+            return False
+        self.reference = signature
+        self.reference_time = timestamp
+        return True
+
+
+def skip_unchanged(frames, detector: SceneChangeDetector):
+    """
+    Pass (frame_number, timestamp, frame) items through, replacing the frame
+    with None when it didn't change enough to analyze. Dropping the pixels
+    early keeps them out of the prefetch queue.
+    """
+    for frame_number, timestamp, frame in frames:
+        with timer('scene_change'):
+            changed = detector.changed(frame, timestamp)
+        yield frame_number, timestamp, frame if changed else None
+
+
+def forbidden_segments(frames: list) -> list:
+    """
+    Group consecutive sampled frames, given as (frame_number, timestamp,
+    DetectionSet), that contain the same forbidden class into time segments
+    """
+    open_segments = {}
+    segments = []
+    for _, timestamp, detections in frames:
+        present = {}
+        for class_id, confidence in zip(
+            detections.class_ids[detections.forbidden].tolist(),
+            detections.confidences[detections.forbidden].tolist()
+        ):
+            present[class_id] = max(confidence, present.get(class_id, 0.0))
+
+        for class_id in [c for c in open_segments if c not in present]:
+            segments.append(open_segments.pop(class_id))
+        for class_id, confidence in present.items():
+            segment = open_segments.setdefault(class_id, {
+                'class': CLASS_NAMES.get(class_id, f'unknown_{class_id}'),
+                'class_id': class_id,
+                'start': timestamp,
+                'end': timestamp,
+                'frames': 0,
+                'max_confidence': 0.0
+            })
+            segment['end'] = timestamp
+            segment['frames'] += 1
+            segment['max_confidence'] = max(segment['max_confidence'], confidence)
+
+    segments.extend(open_segments.values())
+    return sorted(segments, key=lambda segment: (segment['start'], segment['class_id']))
+
+
+def prefetch(iterable, maxsize: int = VIDEO_QUEUE_SIZE):
+    """
+    Consume iterable on a background thread and yield its items through a
+    bounded queue, so decoding overlaps with inference while holding at most
+    maxsize items in memory. Closing the generator early stops the producer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item) -> bool:
+        # Block while the queue is full, but give up once the consumer stops
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        producer.join()
+
+
+def batched(iterable, batch_size: int):
+    """Yield lists of up to batch_size items"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch